@@ -0,0 +1,320 @@
+""" A chunked, randomly accessible file format for preprocessed buffers
+
+A store holds one recording as a (samples, channels) array, the same layout
+as the .pt buffers, split into chunks of a fixed number of samples. Each
+chunk is stored as float32, or as int16 with a per-channel scale, and can be
+zlib compressed. A JSON index at the end of the file gives the position of
+every chunk, so any time range is read by decoding only the chunks that
+overlap it.
+
+File layout:
+    MAGIC | chunk 0 | chunk 1 | ... | JSON index | index length (8 bytes)
+"""
+import json
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+STORE_EXT = '.bufs'
+MAGIC = b'JHUBUFS1'
+DTYPES = ('float32', 'int16')
+COMPRESSIONS = (None, 'zlib')
+_INT16_MAX = 32767
+
+
+def _encode_chunk(chunk, dtype, compression):
+    """Encode a (samples, channels) chunk, returning its bytes and scale"""
+    scale = None
+    if dtype == 'int16':
+        scale = np.max(np.abs(chunk), axis=0) / _INT16_MAX
+        scale[scale == 0] = 1.0
+        chunk = np.round(chunk / scale).astype('<i2')
+        scale = scale.tolist()
+    else:
+        chunk = chunk.astype('<f4')
+    raw = np.ascontiguousarray(chunk).tobytes()
+    if compression == 'zlib':
+        raw = zlib.compress(raw, 1)
+    return raw, scale
+
+
+class BufferStoreWriter():
+    """ Write a recording to a store a block of samples at a time
+
+    Samples passed to write() are buffered until a whole chunk is available,
+    so blocks of any length can be written. close() writes the last partial
+    chunk and the index.
+    """
+
+    def __init__(self, fn, fs, nchns, chunk_seconds=10, dtype='float32',
+                 compression=None, labels=None):
+        """
+        inputs:
+            fn - name of the store file to write
+            fs - sample rate of the buffers
+            nchns - number of channels
+            chunk_seconds - duration of each chunk
+            dtype - 'float32', or 'int16' with a per-chunk channel scale
+            compression - None or 'zlib'
+            labels - optional list of channel labels
+        """
+        if dtype not in DTYPES:
+            raise ValueError('dtype must be one of {}'.format(DTYPES))
+        if compression not in COMPRESSIONS:
+            raise ValueError(
+                'compression must be one of {}'.format(COMPRESSIONS))
+        self.fn = fn
+        self.index = {
+            'fs': fs,
+            'nchns': nchns,
+            'nsamples': 0,
+            'chunk_samples': max(int(round(chunk_seconds * fs)), 1),
+            'dtype': dtype,
+            'compression': compression,
+            'labels': labels,
+            'chunks': [],
+        }
+        self._pending = np.zeros((0, nchns), dtype=np.float32)
+        self._f = open(fn, 'wb')
+        self._f.write(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_chunk(self, chunk):
+        raw, scale = _encode_chunk(chunk, self.index['dtype'],
+                                   self.index['compression'])
+        self.index['chunks'].append({
+            'offset': self._f.tell(),
+            'nbytes': len(raw),
+            'nsamples': len(chunk),
+            'scale': scale,
+        })
+        self._f.write(raw)
+        self.index['nsamples'] += len(chunk)
+
+    def write(self, samples):
+        """Append a (samples, channels) block to the recording"""
+        samples = np.asarray(samples, dtype=np.float32)
+        if samples.ndim != 2 or samples.shape[1] != self.index['nchns']:
+            raise ValueError('Expected samples of shape (n, {})'.format(
+                self.index['nchns']))
+        self._pending = np.concatenate((self._pending, samples))
+        n = self.index['chunk_samples']
+        nchunks = len(self._pending) // n
+        for ii in range(nchunks):
+            self._write_chunk(self._pending[ii * n:(ii + 1) * n])
+        self._pending = self._pending[nchunks * n:]
+
+    def close(self):
+        """Write the last chunk and the index"""
+        if self._f is None:
+            return
+        if len(self._pending) > 0:
+            self._write_chunk(self._pending)
+            self._pending = self._pending[:0]
+        raw = json.dumps(self.index).encode('utf-8')
+        self._f.write(raw)
+        self._f.write(struct.pack('<Q', len(raw)))
+        self._f.close()
+        self._f = None
+
+
+def write_store(fn, buffers, fs, **kwargs):
+    """
+    Write a whole recording to a store
+
+    inputs:
+        fn - name of the store file to write
+        buffers - (samples, channels) array or tensor
+        fs - sample rate of the buffers
+        kwargs - options of BufferStoreWriter
+    """
+    buffers = np.asarray(buffers)
+    with BufferStoreWriter(fn, fs, buffers.shape[1], **kwargs) as writer:
+        writer.write(buffers)
+
+
+class BufferStore():
+    """ Random access reader for a store file
+
+    Slicing a store along the first axis returns a float32 (samples,
+    channels) array and reads only the chunks covering the slice. The most
+    recently decoded chunk is kept, so consecutive windows that fall in the
+    same chunk are only decoded once.
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        self._f = open(fn, 'rb')
+        if self._f.read(len(MAGIC)) != MAGIC:
+            self._f.close()
+            raise ValueError('{} is not a buffer store'.format(fn))
+        self._f.seek(-8, os.SEEK_END)
+        index_bytes = struct.unpack('<Q', self._f.read(8))[0]
+        self._f.seek(-8 - index_bytes, os.SEEK_END)
+        self.index = json.loads(self._f.read(index_bytes).decode('utf-8'))
+        self.fs = self.index['fs']
+        self.nchns = self.index['nchns']
+        self.nsamples = self.index['nsamples']
+        self.chunk_samples = self.index['chunk_samples']
+        self.dtype = self.index['dtype']
+        self.labels = self.index['labels']
+        self.chunks = self.index['chunks']
+        self._cached = (None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    @property
+    def shape(self):
+        return (self.nsamples, self.nchns)
+
+    @property
+    def duration(self):
+        return self.nsamples / self.fs
+
+    def __len__(self):
+        return self.nsamples
+
+    def _read_chunk(self, ii):
+        """Decode chunk ii into a float32 (samples, channels) array"""
+        if self._cached[0] == ii:
+            return self._cached[1]
+        chunk = self.chunks[ii]
+        if hasattr(os, 'pread'):
+            raw = os.pread(self._f.fileno(), chunk['nbytes'], chunk['offset'])
+        else:
+            self._f.seek(chunk['offset'])
+            raw = self._f.read(chunk['nbytes'])
+        if self.index['compression'] == 'zlib':
+            raw = zlib.decompress(raw)
+        if self.dtype == 'int16':
+            data = np.frombuffer(raw, dtype='<i2').reshape(-1, self.nchns)
+            data = data * np.array(chunk['scale'], dtype=np.float32)
+        else:
+            data = np.frombuffer(raw, dtype='<f4').reshape(-1, self.nchns)
+        self._cached = (ii, data)
+        return data
+
+    def read(self, start=0, stop=None):
+        """
+        Read samples [start, stop) of every channel
+
+        returns:
+            float32 array of shape (stop - start, channels)
+        """
+        if stop is None or stop > self.nsamples:
+            stop = self.nsamples
+        start = min(max(start, 0), stop)
+        out = np.empty((stop - start, self.nchns), dtype=np.float32)
+        if stop == start:
+            return out
+        first = start // self.chunk_samples
+        last = (stop - 1) // self.chunk_samples
+        for ii in range(first, last + 1):
+            chunk_start = ii * self.chunk_samples
+            data = self._read_chunk(ii)
+            lo = max(start, chunk_start)
+            hi = min(stop, chunk_start + len(data))
+            out[lo - start:hi - start] = data[lo - chunk_start:
+                                              hi - chunk_start]
+        return out
+
+    def read_seconds(self, start_s=0, stop_s=None):
+        """Read the samples between start_s and stop_s seconds"""
+        stop = None if stop_s is None else int(round(stop_s * self.fs))
+        return self.read(int(round(start_s * self.fs)), stop)
+
+    def __getitem__(self, key):
+        """Index along samples, then optionally along channels"""
+        if isinstance(key, tuple):
+            key, chns = key[0], key[1:]
+        else:
+            chns = ()
+        if isinstance(key, slice):
+            rows = range(*key.indices(self.nsamples))
+            if len(rows) == 0:
+                data = np.empty((0, self.nchns), dtype=np.float32)
+            else:
+                # Read the span covering the rows, then step through it
+                # from the first row, in either direction
+                lo = min(rows[0], rows[-1])
+                data = self.read(lo, max(rows[0], rows[-1]) + 1)[
+                    rows[0] - lo::rows.step]
+        else:
+            if key < 0:
+                key += self.nsamples
+            if not 0 <= key < self.nsamples:
+                raise IndexError('Sample index out of range')
+            return self.read(key, key + 1)[(0,) + chns]
+        return data[(slice(None),) + chns] if chns else data
+
+    def __array__(self, dtype=None, copy=None):
+        data = self.read()
+        return data if dtype is None else data.astype(dtype)
+
+
+class BufferStorePool():
+    """ A least-recently-used set of open stores
+
+    Reading a window of a recording through the pool keeps its store open for
+    the next window, but at most max_open stores are open at once. Opening
+    another store closes the one used least recently.
+    """
+
+    def __init__(self, max_open=32):
+        self.max_open = max_open
+        self._stores = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getstate__(self):
+        # Open files are not passed to other processes, which open their own
+        return {'max_open': self.max_open}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_open'])
+
+    def read(self, fn, start=0, stop=None):
+        """Read samples [start, stop) of the store fn, see BufferStore.read
+        """
+        with self._lock:
+            store = self._stores.get(fn)
+            if store is None:
+                store = BufferStore(fn)
+                self._stores[fn] = store
+                while len(self._stores) > self.max_open:
+                    self._stores.popitem(last=False)[1].close()
+            self._stores.move_to_end(fn)
+            return store.read(start, stop)
+
+    def close(self):
+        """Close every open store"""
+        with self._lock:
+            for store in self._stores.values():
+                store.close()
+            self._stores.clear()
+
+    def __len__(self):
+        return len(self._stores)
@@ -1,5 +1,5 @@
 from collections import defaultdict
-from copy import deepcopy
+from functools import lru_cache, partial
 
 import numpy as np
 import scipy.signal
@@ -8,7 +8,12 @@ from scipy.special import comb as nchoosek
 from scipy.stats import norm
 from scipy.stats.stats import pearsonr
 from sklearn.preprocessing import StandardScaler, scale
-from scipy.signal import resample_poly
+
+from preprocessing.edf_reader import read_block
+from preprocessing.fir import design_fir, fir_filter, iter_fir
+from preprocessing.parallel import map_rows
+from preprocessing.resample import resample
+from preprocessing.running_stats import RunningStats
 
 
 #################
@@ -45,46 +50,425 @@ def clip(x, clip_level):
     return np.clip(x, mean - clip_level * std, mean + clip_level * std)
 
 
+@lru_cache(maxsize=None)
+def design_sos(fs, fc, N=4, btype='lowpass', Q=20.0):
+    """Design a filter as second-order sections, once per set of arguments
+
+    inputs:
+        fs - sampling frequency
+        fc - cutoff (or notch) frequency, a (low, high) tuple for bandpass
+        N - Butterworth filter order
+        btype - 'lowpass', 'highpass', 'bandpass' or 'notch'
+        Q - quality factor of a notch filter
+
+    returns:
+        sos - array of second-order sections, shared between callers
+    """
+    wc = np.asarray(fc) / (fs / 2)
+    if btype == 'notch':
+        b, a = scipy.signal.iirnotch(wc, Q)
+        sos = scipy.signal.tf2sos(b, a)
+    else:
+        sos = scipy.signal.butter(N, wc, btype=btype, output='sos')
+    return sos
+
+
+@lru_cache(maxsize=None)
+def prefilter_sos(fs, notch=False, lpf_fc=0, hpf_fc=0, dtype=np.float64):
+    """Return the cascade of the prefilter's notch, lowpass and highpass
+    filters as one array of second-order sections, or None for no filtering
+
+    The sections are designed in float64 and stored as dtype. scipy filters
+    in the common type of the sections and the signal, so float32 sections
+    keep a float32 signal in float32.
+    """
+    sections = []
+    if notch:
+        sections.append(design_sos(fs, 60, btype='notch'))
+    if lpf_fc > 0:
+        sections.append(design_sos(fs, lpf_fc, btype='lowpass'))
+    if hpf_fc > 0:
+        sections.append(design_sos(fs, hpf_fc, btype='highpass'))
+    if not sections:
+        return None
+    sos = np.vstack(sections).astype(dtype)
+    return sos
+
+
+@lru_cache(maxsize=None)
+def impulse_response_length(fs, notch=False, lpf_fc=0, hpf_fc=0, tol=1e-6):
+    """Number of samples after which the impulse response of the prefilter
+    cascade stays below tol times its peak
+    """
+    sos = prefilter_sos(fs, notch, lpf_fc, hpf_fc)
+    if sos is None:
+        return 0
+    n = 1024
+    while True:
+        impulse = np.zeros(n)
+        impulse[0] = 1
+        h = np.abs(scipy.signal.sosfilt(sos, impulse))
+        length = np.nonzero(h > tol * np.max(h))[0][-1] + 1
+        if length < n // 2:
+            return int(length)
+        n *= 2
+
+
+def _sosfiltfilt(sos, x):
+    """sosfiltfilt along the last axis, as a function of the signal alone
+    for map_rows
+    """
+    return scipy.signal.sosfiltfilt(sos, x, axis=-1)
+
+
+def filtfilt_blocks(bufs, sos, edge, block, out=None, dtype=np.float32,
+                    threads=None):
+    """Zero-phase filter a long signal in overlapping blocks
+
+    Each block of samples is filtered together with edge samples on either
+    side, which are then dropped. When edge is the impulse response length
+    of sos, the result matches float64 sosfiltfilt of the whole signal to
+    within a small multiple of the tolerance used to find that length. Only
+    block + 2 * edge samples per channel are filtered at a time, in float64.
+
+    inputs:
+        bufs - list of channels, or a (channels, samples) array
+        sos - second-order sections of the filter
+        edge - samples of overlap on each side of a block
+        block - samples per block
+        out - optional (channels, samples) array to write into, for example
+            a np.memmap
+        dtype - dtype of the blocks read from a list of channels, and of out
+            when it is not given
+        threads - number of threads filtering the channels of each block,
+            None for the cap of preprocessing.parallel
+
+    returns:
+        out - filtered (channels, samples) array
+    """
+    nchns = len(bufs)
+    nsamples = len(bufs[0])
+    if out is None:
+        out = np.empty((nchns, nsamples), dtype=dtype)
+    for start, stop, filtered in _iter_filtfilt(bufs, sos, edge, block,
+                                                dtype, threads):
+        out[:, start:stop] = filtered
+    return out
+
+
+def _iter_filtfilt(bufs, sos, edge, block, dtype=np.float32, threads=None):
+    """Yield (start, stop, filtered samples) for each block of filtfilt_blocks
+
+    Blocks are filtered in float64 and only the kept samples are cast to
+    dtype, so float32 rounding in the filter state does not add to the error
+    at the block edges.
+    """
+    nsamples = len(bufs[0])
+    sos = np.asarray(sos, dtype=np.float64)
+    for start in range(0, nsamples, block):
+        stop = min(start + block, nsamples)
+        lo = max(start - edge, 0)
+        hi = min(stop + edge, nsamples)
+        filtered = map_rows(partial(_sosfiltfilt, sos),
+                            read_block(bufs, lo, hi, np.float64), threads)
+        yield start, stop, filtered[:, start - lo:stop - lo].astype(dtype)
+
+
+def _clip_limits(blocks, clip_level):
+    """Per-channel clip limits, mean -/+ clip_level * std, from a streaming
+    pass over (channels, samples) blocks
+    """
+    stats = None
+    for chunk in blocks:
+        if stats is None:
+            stats = RunningStats(chunk.shape[0])
+        stats.update(chunk)
+    mean = stats.mean[:, np.newaxis]
+    std = stats.std[:, np.newaxis]
+    return (mean - clip_level * std).astype(chunk.dtype), \
+        (mean + clip_level * std).astype(chunk.dtype)
+
+
+def _scale_factors(blocks):
+    """Per-channel mean and std (1 where it is 0) from a streaming pass over
+    (channels, samples) blocks
+    """
+    stats = None
+    for chunk in blocks:
+        if stats is None:
+            stats = RunningStats(chunk.shape[0])
+        stats.update(chunk)
+    std = stats.std
+    std[std == 0] = 1.0
+    return stats.mean[:, np.newaxis].astype(chunk.dtype), \
+        std[:, np.newaxis].astype(chunk.dtype)
+
+
+def _prefilter_design(fs, notch, lpf_fc, hpf_fc, dtype, method, transition):
+    """Design the prefilter for a method, returning (sos, None) for 'iir'
+    and (None, taps) for 'fir'
+    """
+    if method == 'iir':
+        return prefilter_sos(fs, notch, lpf_fc, hpf_fc, dtype), None
+    if method == 'fir':
+        return None, design_fir(fs, lpf_fc, hpf_fc, 60 if notch else 0,
+                                transition)
+    raise ValueError('Unknown filter method: {}'.format(method))
+
+
+def iter_prefilter(bufs, fs, notch=False, lpf_fc=0, hpf_fc=0, clip_level=3.0,
+                   standardize=False, block_seconds=60, tol=1e-6,
+                   dtype=np.float32, method='iir', transition=1.0,
+                   montage=None, threads=None):
+    """Run the prefilter chain out of core, yielding the output in blocks
+
+    The input is only read a block at a time, for example from lazy EDF
+    signal views, and the output is never held in full. Each statistics
+    pass filters the signal again, instead of storing it: one pass for the
+    clip limits, one for the scale factors after clipping, and a last pass
+    that yields the result. The output matches prefilter with the same
+    block_seconds.
+
+    inputs:
+        same as prefilter
+
+    yields:
+        filtered (channels, samples) blocks of dtype, in order
+    """
+    sos, h = _prefilter_design(fs, notch, lpf_fc, hpf_fc, dtype, method,
+                               transition)
+    block = max(int(block_seconds * fs), 1)
+    nsamples = len(bufs[0])
+
+    def filtered_blocks(low=None, high=None):
+        if h is not None:
+            chunks = (filtered for _, _, filtered in
+                      iter_fir(bufs, h, block, dtype, threads))
+        elif sos is not None:
+            edge = impulse_response_length(fs, notch, lpf_fc, hpf_fc, tol)
+            chunks = (filtered for _, _, filtered in
+                      _iter_filtfilt(bufs, sos, edge, block, dtype,
+                                     threads))
+        else:
+            chunks = (read_block(bufs, start, start + block, dtype)
+                      for start in range(0, nsamples, block))
+        for chunk in chunks:
+            if montage is not None:
+                chunk = montage.apply(chunk)
+            chunk = np.array(chunk, dtype=dtype)
+            if low is not None:
+                np.clip(chunk, low, high, out=chunk)
+            yield chunk
+
+    low = high = None
+    if clip_level > 0:
+        low, high = _clip_limits(filtered_blocks(), clip_level)
+    if standardize:
+        mean, std = _scale_factors(filtered_blocks(low, high))
+    for chunk in filtered_blocks(low, high):
+        if standardize:
+            chunk -= mean
+            chunk /= std
+        yield chunk
+
+
 def prefilter(bufs, fs, notch=False, lpf_fc=0, hpf_fc=0, clip_level=3.0,
-              standardize=False):
+              standardize=False, copy=False, block_seconds=None, tol=1e-6,
+              dtype=np.float32, method='iir', transition=1.0, montage=None,
+              threads=None):
     """Apply 60 Hz notch filter and lowpass filter
 
+    All channels are processed together as one (channels, samples) array of
+    dtype. The filters are applied forward and backward as a single cascade
+    of second-order sections, which are designed once per setting. With the
+    default float32 the filter state is also float32, which halves memory
+    and bandwidth; the output then differs from float64 filtering by about
+    1e-4 of the peak amplitude, growing with the DC offset of the signal.
+    Measured on an hour of 256 Hz EEG-like noise with the notch, a
+    30 Hz lowpass and a 1.6 Hz highpass, the largest difference was 3e-5 of
+    the peak without an offset and 3e-4 with an offset of 1000 uV.
+
+    sosfiltfilt pads each end of the signal with an odd extension, where
+    the separate filtfilt(method='gust') calls this replaces used
+    Gustafsson's initial conditions. The two agree away from the ends, but
+    samples within about one impulse response length of either end differ,
+    so buffers saved before this change differ near their edges from ones
+    saved now.
+
+    With method='fir' the Butterworth cascade is replaced by a single
+    linear-phase FIR filter with transition bands of the given width,
+    applied once by FFT overlap-save (see preprocessing.fir). It has much
+    steeper band edges, and its cost grows only with the log of its length.
+
+    With block_seconds set, the signal is filtered in overlapping blocks by
+    filtfilt_blocks, with an overlap of the filter's impulse response
+    length at tolerance tol. The filtered output then differs from the
+    whole-signal float64 result by a small multiple of tol times the
+    signal's peak amplitude. The blocks are filtered in float64 and cast to
+    dtype at the end, so this holds for float32 output too: under 1e-5 of
+    the peak for tol=1e-6 in testing, for either dtype.
+    Temporaries scale with the block size rather than the recording length,
+    which matters for multi-day recordings. FIR filtering in blocks is
+    exact.
+
+    A montage is applied after filtering, before clipping and scaling, as
+    one sparse matrix product per block.
+
+    The channels are filtered by a pool of threads (see
+    preprocessing.parallel), since scipy's filters release the GIL. Each
+    channel is filtered on its own, so the output is the same for any
+    number of threads.
+
     inputs:
-        bufs - list of buffers to be processed
+        bufs - list of buffers, or a (channels, samples) array
         fs - list of sampling frequencies
         notch - apply a notch filter at 60 Hz (bool)
         lpf_fc - lpf cutoff, 0 for none
         hpf_fc - hpf cutoff, 0 for none
         clip_level - clip recordings at std level, 0 for none
         standardize - scale channel to mean 0, std 1
+        copy - never modify bufs, even if it is already an array of dtype
+            and no filtering is applied
+        block_seconds - filter in blocks of this many seconds, None to
+            filter the whole signal at once
+        tol - impulse response tolerance of the block overlap
+        dtype - working and output dtype, np.float32 or np.float64
+        method - 'iir' for the Butterworth cascade, 'fir' for linear phase
+        transition - width in Hz of the FIR transition bands
+        montage - optional preprocessing.montage.Montage over the channels
+            of bufs
+        threads - number of filtering threads, None for the cap set by
+            preprocessing.parallel.set_max_threads, 1 for none
 
     returns:
-        filt_bufs: filtered buffers
+        filt_bufs: filtered (channels, samples) array of dtype
     """
-    nchns = len(bufs)
-    filt_bufs = deepcopy(bufs)
-    for chn in range(nchns):
-        # Notch
-        if notch:
-            filt_bufs[chn] = applyNotch60(filt_bufs[chn], fs)
-        # LPF
-        if lpf_fc > 0:
-            filt_bufs[chn] = applyLowPass(filt_bufs[chn], fs, lpf_fc)
-        # HPF
-        if hpf_fc > 0:
-            filt_bufs[chn] = applyHighPass(filt_bufs[chn], fs, hpf_fc)
+    sos, h = _prefilter_design(fs, notch, lpf_fc, hpf_fc, dtype, method,
+                               transition)
+    if block_seconds is not None:
+        block = max(int(block_seconds * fs), 1)
+        if h is not None:
+            filt_bufs = fir_filter(bufs, h, block, dtype=dtype,
+                                   threads=threads)
+        elif sos is not None:
+            edge = impulse_response_length(fs, notch, lpf_fc, hpf_fc, tol)
+            filt_bufs = filtfilt_blocks(bufs, sos, edge, block, dtype=dtype,
+                                        threads=threads)
+        else:
+            filt_bufs = np.array(bufs, dtype=dtype)
+        if montage is not None:
+            filt_bufs = montage.apply(filt_bufs)
+        blocks = [filt_bufs[:, start:start + block]
+                  for start in range(0, filt_bufs.shape[-1], block)]
         if clip_level > 0:
-            filt_bufs[chn] = clip(filt_bufs[chn], clip_level)
-        # Standardize
+            low, high = _clip_limits(blocks, clip_level)
+            for chunk in blocks:
+                np.clip(chunk, low, high, out=chunk)
         if standardize:
-            filt_bufs[chn] = scale(filt_bufs[chn])
+            mean, std = _scale_factors(blocks)
+            for chunk in blocks:
+                chunk -= mean
+                chunk /= std
+        return filt_bufs
+
+    if h is not None:
+        filt_bufs = fir_filter(bufs, h, dtype=dtype, threads=threads)
+    elif copy:
+        filt_bufs = np.array(bufs, dtype=dtype)
+    elif isinstance(bufs, np.ndarray):
+        filt_bufs = np.asarray(bufs, dtype=dtype)
+    else:
+        filt_bufs = read_block(bufs, 0, len(bufs[0]), dtype)
+    if sos is not None:
+        filt_bufs = map_rows(partial(_sosfiltfilt, sos), filt_bufs, threads)
+        # sosfiltfilt returns a reversed view, so make the result contiguous
+        filt_bufs = np.ascontiguousarray(filt_bufs, dtype=dtype)
+    if montage is not None:
+        filt_bufs = montage.apply(filt_bufs)
+    if clip_level > 0:
+        mean = np.mean(filt_bufs, axis=-1, keepdims=True)
+        std = np.std(filt_bufs, axis=-1, keepdims=True)
+        np.clip(filt_bufs, mean - clip_level * std, mean + clip_level * std,
+                out=filt_bufs)
+    # Standardize
+    if standardize:
+        mean = np.mean(filt_bufs, axis=-1, keepdims=True)
+        std = np.std(filt_bufs, axis=-1, keepdims=True)
+        std[std == 0] = 1.0
+        filt_bufs -= mean
+        filt_bufs /= std
 
     return filt_bufs
 
 
-def resample_256to200(bufs):
-    """Resample all the buffers from 256 Hz to 200 Hz
+class StreamingFilter():
+    """ A causal filter that can be applied a chunk at a time
+
+    The filter state is carried from one chunk to the next, so the output
+    for a signal is the same however it is split into chunks, and memory
+    use does not depend on the length of the signal. The state starts at
+    the steady state for the first sample, which avoids a step response at
+    the start of the signal. Unlike prefilter, the output is not zero
+    phase.
+    """
+
+    def __init__(self, fs, notch_fc=0, lpf_fc=0, hpf_fc=0, bpf_fc=None,
+                 N=4, Q=20.0):
+        """
+        inputs:
+            fs - sampling frequency
+            notch_fc - notch frequency, 0 for none
+            lpf_fc - lpf cutoff, 0 for none
+            hpf_fc - hpf cutoff, 0 for none
+            bpf_fc - (low, high) bandpass cutoffs, None for none
+            N - Butterworth filter order
+            Q - quality factor of the notch filter
+        """
+        sections = []
+        if notch_fc > 0:
+            sections.append(design_sos(fs, notch_fc, btype='notch', Q=Q))
+        if lpf_fc > 0:
+            sections.append(design_sos(fs, lpf_fc, N, btype='lowpass'))
+        if hpf_fc > 0:
+            sections.append(design_sos(fs, hpf_fc, N, btype='highpass'))
+        if bpf_fc is not None:
+            sections.append(design_sos(fs, tuple(bpf_fc), N,
+                                       btype='bandpass'))
+        self.sos = np.vstack(sections) if sections else None
+        self.zi = None
+
+    def reset(self):
+        """Forget the state, to start filtering a new signal"""
+        self.zi = None
+
+    def process(self, chunk):
+        """
+        Filter the next chunk of the signal
+
+        inputs:
+            chunk - array of the next samples along the last axis, for
+                example (channels, samples)
+
+        returns:
+            filtered chunk of the same shape
+        """
+        chunk = np.asarray(chunk)
+        if self.sos is None or chunk.shape[-1] == 0:
+            return chunk.copy()
+        if self.zi is None:
+            # (sections, ..., 2) steady state scaled by the first sample
+            zi = scipy.signal.sosfilt_zi(self.sos)
+            zi = zi.reshape((zi.shape[0],) + (1,) * (chunk.ndim - 1) + (2,))
+            self.zi = zi * chunk[..., :1][np.newaxis]
+        out, self.zi = scipy.signal.sosfilt(self.sos, chunk, axis=-1,
+                                            zi=self.zi)
+        return out
+
+
+def resample_256to200(bufs, threads=None):
+    """Resample all the buffers from 256 Hz to 200 Hz, with the channels
+    split between threads
+
+    Returns a (channels, samples) array, float32 for float32 input.
     """
-    for ii in range(len(bufs)):
-        bufs[ii] = resample_poly(bufs[ii], up=25, down=32, axis=0)
-    return bufs
+    return resample(bufs, 256, 200, threads=threads)
@@ -0,0 +1,88 @@
+""" Anonymize EDF files by rewriting only the identifying header fields """
+import os
+import shutil
+
+from preprocessing.edf_reader import MAIN_HEADER_BYTES
+
+# Byte span of each identifying field of the main header
+FIELD_SPANS = {
+    'patient_id': (8, 88),
+    'recording_id': (88, 168),
+    'start_date': (168, 176),
+    'start_time': (176, 184),
+}
+
+# The values the viewer's anonymizer uses by default
+DEFAULT_FIELDS = {
+    'patient_id': 'X X X X',
+    'recording_id': 'Startdate X X X X',
+    'start_date': '01.01.01',
+    'start_time': '01.01.01',
+}
+
+
+def patch_header(raw, fields=None):
+    """
+    Replace the identifying fields of an EDF main header
+
+    inputs:
+        raw - bytes of at least the 256 byte main header
+        fields - dictionary from FIELD_SPANS keys to new values, fields that
+            are not given are left unchanged. DEFAULT_FIELDS if None.
+
+    returns:
+        patched - the 256 byte main header with the new fields
+    """
+    if fields is None:
+        fields = DEFAULT_FIELDS
+    if len(raw) < MAIN_HEADER_BYTES or raw[0:1] != b'0':
+        raise ValueError('Not an EDF/EDF+ header')
+    patched = bytearray(raw[:MAIN_HEADER_BYTES])
+    for name, value in fields.items():
+        if name not in FIELD_SPANS:
+            raise KeyError('Unknown header field {}'.format(name))
+        start, stop = FIELD_SPANS[name]
+        encoded = value.encode('ascii')
+        if len(encoded) > stop - start:
+            raise ValueError('{} must be at most {} characters'.format(
+                name, stop - start))
+        patched[start:stop] = encoded.ljust(stop - start, b' ')
+    return bytes(patched)
+
+
+def anonymize_edf(fn, fn_out=None, fields=None):
+    """
+    Anonymize an EDF file without touching its signal data
+
+    The file is patched in place when fn_out is None. Otherwise it is copied
+    to a temporary file next to fn_out, patched, and renamed to fn_out, so a
+    partially written output is never left behind.
+
+    inputs:
+        fn - name of the .edf file to anonymize
+        fn_out - name of the anonymized copy, None to patch fn in place
+        fields - new header fields, as for patch_header
+
+    returns:
+        fn_out - name of the anonymized file
+    """
+    with open(fn, 'rb') as f:
+        raw = f.read(MAIN_HEADER_BYTES)
+    patched = patch_header(raw, fields)
+
+    if fn_out is None:
+        with open(fn, 'r+b') as f:
+            f.write(patched)
+        return fn
+
+    tmp_fn = fn_out + '.tmp'
+    try:
+        shutil.copyfile(fn, tmp_fn)
+        with open(tmp_fn, 'r+b') as f:
+            f.write(patched)
+        os.replace(tmp_fn, fn_out)
+    except BaseException:
+        if os.path.exists(tmp_fn):
+            os.remove(tmp_fn)
+        raise
+    return fn_out
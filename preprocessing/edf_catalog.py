@@ -0,0 +1,182 @@
+""" An incremental catalog of EDF header information stored in SQLite """
+import json
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+from preprocessing.edf_reader import read_header
+from preprocessing.eeg_info import EegInfo
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS edfs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    nchns INTEGER NOT NULL,
+    labels TEXT NOT NULL,
+    fs TEXT NOT NULL,
+    nsamples TEXT NOT NULL
+)
+"""
+
+
+def scan_header(fn):
+    """
+    Read the fixed-size header of an EDF file into a catalog record
+
+    inputs:
+        fn - absolute name of .edf file
+
+    returns:
+        record - dictionary with the catalog columns, or None if the file
+            cannot be read
+    """
+    try:
+        stat = os.stat(fn)
+        header = read_header(fn)
+    except (OSError, ValueError):
+        return None
+    chns = header.data_chns
+    # Keep integral sample rates as ints so manifests stay parseable
+    fs = [float(header.fs[chn]) for chn in chns]
+    fs = [int(rate) if rate.is_integer() else rate for rate in fs]
+    return {
+        'path': fn,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'duration': float(header.file_duration),
+        'nchns': len(chns),
+        'labels': [header.labels[chn] for chn in chns],
+        'fs': fs,
+        'nsamples': [int(header.nsamples[chn]) for chn in chns],
+    }
+
+
+class EdfCatalog():
+    """ A local SQLite catalog of EDF headers
+
+    update() reads the headers of new or changed files (by mtime and size)
+    with a process pool and stores the results, so reruns only touch files
+    that are not already up to date in the catalog.
+    """
+
+    def __init__(self, db_fn):
+        self.db_fn = db_fn
+        self.conn = sqlite3.connect(db_fn)
+        self.conn.execute(_SCHEMA)
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def update(self, fns, workers=None):
+        """
+        Bring the catalog up to date for a list of EDF files
+
+        inputs:
+            fns - list of .edf file names
+            workers - number of processes used to read headers, None for
+                the number of CPUs
+
+        returns:
+            scanned - list of files whose headers were read
+            failed - set of the absolute paths of files that could not be
+                read
+        """
+        stale = []
+        failed = set()
+        for fn in fns:
+            path = os.path.abspath(fn)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                failed.add(path)
+                continue
+            row = self.conn.execute(
+                'SELECT mtime_ns, size FROM edfs WHERE path = ?',
+                (path,)).fetchone()
+            if row != (stat.st_mtime_ns, stat.st_size):
+                stale.append(path)
+        if not stale:
+            return [], failed
+
+        if workers == 1 or len(stale) == 1:
+            records = [scan_header(fn) for fn in stale]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                chunksize = max(1, len(stale) // (4 * (workers or
+                                                       os.cpu_count())))
+                records = list(executor.map(scan_header, stale,
+                                            chunksize=chunksize))
+
+        with self.conn:
+            for fn, record in zip(stale, records):
+                if record is None:
+                    failed.add(fn)
+                    continue
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO edfs '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (record['path'], record['mtime_ns'], record['size'],
+                     record['duration'], record['nchns'],
+                     json.dumps(record['labels']), json.dumps(record['fs']),
+                     json.dumps(record['nsamples'])))
+        return stale, failed
+
+    def get(self, fn):
+        """Return the catalog record of an EDF file, or None"""
+        row = self.conn.execute(
+            'SELECT path, mtime_ns, size, duration, nchns, labels, fs, '
+            'nsamples FROM edfs WHERE path = ?',
+            (os.path.abspath(fn),)).fetchone()
+        if row is None:
+            return None
+        return {
+            'path': row[0],
+            'mtime_ns': row[1],
+            'size': row[2],
+            'duration': row[3],
+            'nchns': row[4],
+            'labels': json.loads(row[5]),
+            'fs': json.loads(row[6]),
+            'nsamples': json.loads(row[7]),
+        }
+
+    def load_metadata(self, fn):
+        """
+        Build an EegInfo from the catalog, as EdfLoader().load_metadata
+        would for a loader without a label list. Annotations are not part of
+        the catalog and are left empty.
+        """
+        record = self.get(fn)
+        if record is None:
+            raise KeyError('{} is not in the catalog'.format(fn))
+        eeg_info = EegInfo()
+        eeg_info.edf_fn = fn
+        eeg_info.name = fn.split('/')[-1].split('.')[0]
+        eeg_info.file_duration = record['duration']
+        eeg_info.nchns = record['nchns']
+        eeg_info.nsamples = record['nsamples']
+        eeg_info.fs = record['fs']
+        eeg_info.label_list = [label.upper() for label in record['labels']]
+        for chn, label in enumerate(eeg_info.label_list):
+            eeg_info.labels2chns[label] = chn
+            eeg_info.chns2labels[chn] = label
+        if len(set(eeg_info.fs)) == 1:
+            eeg_info.fs = eeg_info.fs[0]
+        return eeg_info
+
+    def channel_intersection(self, fns):
+        """Return the set of (upper case) labels present in every file"""
+        label_set = None
+        for fn in fns:
+            labels = set(self.load_metadata(fn).label_list)
+            label_set = labels if label_set is None else label_set & labels
+        return set() if label_set is None else label_set
@@ -1,5 +1,6 @@
-import pyedflib
+import numpy as np
 
+from preprocessing.edf_pool import BACKENDS, EdfHandlePool
 from preprocessing.eeg_info import EegInfo
 
 
@@ -18,10 +19,29 @@ def _check_label(label, label_list):
 
 
 class EdfLoader():
-    """ A class for loading info and buffers from EDF files """
+    """ A class for loading info and buffers from EDF files
 
-    def __init__(self, label_list=None):
+    The 'pyedflib' backend decodes each channel into a float64 array. The
+    'memmap' backend maps the file and returns lazily scaled EdfSignal views,
+    so samples are only read and converted when they are accessed.
+
+    Files are opened through an EdfHandlePool. By default each call opens
+    and closes the file. Given a pool, which the caller closes when done,
+    loading the metadata and then the buffers of a file parses its header
+    only once.
+    """
+
+    def __init__(self, label_list=None, backend='pyedflib', pool=None):
+        if backend not in BACKENDS:
+            raise ValueError('Unknown EDF backend: {}'.format(backend))
         self.label_list = label_list
+        self.backend = backend
+        # A pool that keeps nothing open closes each file after each call
+        self.pool = EdfHandlePool(max_open=0) if pool is None else pool
+
+    def _open(self, fn):
+        """Borrow an open handle for an EDF file from the pool"""
+        return self.pool.open(fn, self.backend)
 
     def load_metadata(self, fn):
         """
@@ -40,13 +60,14 @@ class EdfLoader():
         eeg_info.label_list = self.label_list
 
         """Load the metadata"""
-        f = pyedflib.EdfReader(fn)
-        nsignals = f.signals_in_file
-        signal_labels = f.getSignalLabels()
-        nsamples = f.getNSamples()
-        sample_frequencies = f.getSampleFrequencies()
-        eeg_info.file_duration = f.getFileDuration()
-        eeg_info.annotations = f.readAnnotations()
+        with self._open(fn) as handle:
+            f = handle.reader
+            nsignals = f.signals_in_file
+            signal_labels = f.getSignalLabels()
+            nsamples = f.getNSamples()
+            sample_frequencies = f.getSampleFrequencies()
+            eeg_info.file_duration = f.getFileDuration()
+            eeg_info.annotations = handle.annotations()
 
         # If a label list is provided, load info for the channels
         if self.label_list:
@@ -81,36 +102,121 @@ class EdfLoader():
                 eeg_info.label_list.append(label.upper())
                 eeg_info.labels2chns[label.upper()] = edf_chn
                 eeg_info.chns2labels[edf_chn] = label.upper()
-        # Close the edf file
-        f._close()
-        del f
 
         if len(set(eeg_info.fs)) == 1:
             eeg_info.fs = eeg_info.fs[0]
 
         return eeg_info
 
-    def load_buffers(self, eeg_info):
+    def _channel_ranges(self, f, eeg_info, start_s, stop_s, channels):
         """
-        Load the information from the edf file
-
-        inputs:
-            eeg_info - info for eeg file to load
+        Find the signals of an open reader to load and their sample ranges
 
         returns:
-            bufs - list of channel buffers from the EDF file
+            list of (chn, edf_chn, start, stop), with chn the index of the
+            signal in the output
         """
-        bufs = [0] * eeg_info.nchns
-
-        f = pyedflib.EdfReader(eeg_info.edf_fn)
+        ranges = []
         nsignals = f.signals_in_file
         signal_labels = f.getSignalLabels()
+        nsamples = f.getNSamples()
         # Loop over the signals in the edf file
         for edf_chn in range(nsignals):
             # Check the label and load
             curr_label = _check_label(signal_labels[edf_chn],
                                       eeg_info.label_list)
-            if curr_label:
+            if not curr_label:
+                continue
+            if channels is None:
                 chn = eeg_info.labels2chns[curr_label]
-                bufs[chn] = f.readSignal(edf_chn)
+            elif curr_label in channels:
+                chn = channels.index(curr_label)
+            else:
+                continue
+            # Convert the time range to samples for this channel
+            fs = f.getSampleFrequency(edf_chn)
+            start = min(int(round(start_s * fs)), nsamples[edf_chn])
+            if stop_s is None:
+                stop = nsamples[edf_chn]
+            else:
+                stop = min(int(round(stop_s * fs)), nsamples[edf_chn])
+            stop = max(stop, start)
+            ranges.append((chn, edf_chn, start, stop))
+        return ranges
+
+    def load_buffers(self, eeg_info, start_s=0, stop_s=None, channels=None):
+        """
+        Load the buffers from the edf file, optionally for a time range
+
+        Only the samples (and, for the memmap backend, the data records)
+        covering [start_s, stop_s) are read.
+
+        inputs:
+            eeg_info - info for eeg file to load
+            start_s - start of the range in seconds
+            stop_s - end of the range in seconds, None for the end of file
+            channels - list of labels to load, None for all channels in
+                eeg_info.label_list. Buffers are returned in this order.
+
+        returns:
+            bufs - list of channel buffers from the EDF file, as arrays for
+                the pyedflib backend and EdfSignal views for memmap
+        """
+        if channels is None:
+            bufs = [0] * eeg_info.nchns
+        else:
+            channels = [label.upper() for label in channels]
+            bufs = [0] * len(channels)
+
+        with self._open(eeg_info.edf_fn) as handle:
+            f = handle.reader
+            for chn, edf_chn, start, stop in self._channel_ranges(
+                    f, eeg_info, start_s, stop_s, channels):
+                if self.backend == 'memmap':
+                    bufs[chn] = f.signal(edf_chn, start, stop)
+                else:
+                    bufs[chn] = f.readSignal(edf_chn, start, stop - start)
+        return bufs
+
+    def load_array(self, eeg_info, start_s=0, stop_s=None, channels=None,
+                   dtype=np.float32):
+        """
+        Load the buffers into one preallocated (channels, samples) array
+
+        Each channel is decoded straight into its row of the array, so
+        there is no list of per-channel arrays to copy afterwards. With the
+        memmap backend the digital samples are scaled in place in dtype and
+        never exist as float64. All loaded channels must have the same
+        number of samples in the range; channels missing from the file are
+        left as zeros.
+
+        inputs:
+            same as load_buffers
+            dtype - dtype of the array
+
+        returns:
+            bufs - (channels, samples) array of dtype
+        """
+        if channels is None:
+            nchns = eeg_info.nchns
+        else:
+            channels = [label.upper() for label in channels]
+            nchns = len(channels)
+
+        with self._open(eeg_info.edf_fn) as handle:
+            f = handle.reader
+            ranges = self._channel_ranges(f, eeg_info, start_s, stop_s,
+                                          channels)
+            lengths = set(stop - start for _, _, start, stop in ranges)
+            if len(lengths) > 1:
+                raise ValueError('Channels of {} have different numbers of '
+                                 'samples, use load_buffers'.format(
+                                     eeg_info.edf_fn))
+            bufs = np.zeros((nchns, lengths.pop() if lengths else 0),
+                            dtype=dtype)
+            for chn, edf_chn, start, stop in ranges:
+                if self.backend == 'memmap':
+                    f.signal(edf_chn).read(start, stop, out=bufs[chn])
+                else:
+                    bufs[chn] = f.readSignal(edf_chn, start, stop - start)
         return bufs
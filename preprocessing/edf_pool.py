@@ -0,0 +1,143 @@
+""" Pools of open EDF readers shared by the loaders of a file """
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pyedflib
+
+from preprocessing.edf_reader import EdfReader
+
+BACKENDS = {
+    'pyedflib': pyedflib.EdfReader,
+    'memmap': EdfReader,
+}
+
+
+class EdfHandle():
+    """ An open EDF reader along with the data decoded from it so far """
+
+    def __init__(self, key, reader):
+        self.key = key
+        self.reader = reader
+        self.users = 0
+        self.evicted = False
+        self._annotations = None
+
+    def annotations(self):
+        """Return the file's annotations, decoding them only once"""
+        if self._annotations is None:
+            self._annotations = self.reader.readAnnotations()
+        return self._annotations
+
+    def close(self):
+        self.reader._close()
+        self.reader = None
+
+
+class EdfHandlePool():
+    """ A least-recently-used pool of open EDF readers
+
+    Readers are keyed by path, modification time and backend, so a file that
+    changes on disk is reopened. At most max_open readers are kept open. A
+    reader that is in use when it is evicted is closed as soon as the last
+    user releases it.
+
+    pyedflib refuses to open a file that is already open, so while a pool
+    holds a file it cannot be opened by another reader or pool, for example
+    to write it. Use a pool as a context manager around the work that reads
+    the files, so that they are closed when it is done:
+
+        with EdfHandlePool() as pool:
+            loader = EdfLoader(label_list, pool=pool)
+    """
+
+    def __init__(self, max_open=32):
+        self.max_open = max_open
+        self._handles = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @contextmanager
+    def open(self, fn, backend='pyedflib'):
+        """
+        Borrow an open reader for an EDF file
+
+        usage:
+            with pool.open(fn) as handle:
+                labels = handle.reader.getSignalLabels()
+                annotations = handle.annotations()
+        """
+        handle = self._acquire(fn, backend)
+        try:
+            yield handle
+        finally:
+            self._release(handle)
+
+    def _acquire(self, fn, backend):
+        path = os.path.abspath(fn)
+        key = (path, os.stat(path).st_mtime_ns, backend)
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is None:
+                # Drop readers for older versions of the same file
+                for old_key in list(self._handles):
+                    if old_key[0] == path and old_key[2] == backend:
+                        self._evict(old_key)
+                handle = EdfHandle(key, BACKENDS[backend](path))
+                self._handles[key] = handle
+            self._handles.move_to_end(key)
+            handle.users += 1
+            self._trim()
+            return handle
+
+    def _release(self, handle):
+        with self._lock:
+            handle.users -= 1
+            if handle.evicted and handle.users == 0:
+                handle.close()
+            self._trim()
+
+    def _evict(self, key):
+        handle = self._handles.pop(key)
+        handle.evicted = True
+        if handle.users == 0:
+            handle.close()
+
+    def _trim(self):
+        """Close least recently used readers that are not in use"""
+        for key in list(self._handles):
+            if len(self._handles) <= self.max_open:
+                break
+            if self._handles[key].users == 0:
+                self._evict(key)
+
+    def close(self, fn=None):
+        """Close the readers for fn, or every reader if fn is None"""
+        path = None if fn is None else os.path.abspath(fn)
+        with self._lock:
+            for key in list(self._handles):
+                if path is None or key[0] == path:
+                    self._evict(key)
+
+    def __len__(self):
+        return len(self._handles)
+
+
+@contextmanager
+def open_edf(fn, backend='pyedflib'):
+    """
+    Open an EDF file for a with block, closing it when the block ends
+
+    usage:
+        with open_edf(fn) as handle:
+            signal = handle.reader.readSignal(0)
+    """
+    # A pool that keeps nothing open closes the reader when it is released
+    with EdfHandlePool(max_open=0).open(fn, backend) as handle:
+        yield handle
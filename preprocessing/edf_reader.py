@@ -0,0 +1,520 @@
+""" A native, memory-mapped reader for EDF and EDF+ files """
+import copy
+import os
+import re
+
+import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
+
+ANNOTATIONS_LABEL = 'EDF Annotations'
+MAIN_HEADER_BYTES = 256
+SIGNAL_HEADER_BYTES = 256
+
+# (name, width) of each per-signal header field, in file order
+_SIGNAL_FIELDS = [
+    ('label', 16),
+    ('transducer', 80),
+    ('dimension', 8),
+    ('physical_min', 8),
+    ('physical_max', 8),
+    ('digital_min', 8),
+    ('digital_max', 8),
+    ('prefilter', 80),
+    ('samples_per_record', 8),
+    ('reserved', 32),
+]
+
+_TAL_REGEX = re.compile(
+    '([+-]\\d+\\.?\\d*)(\x15(\\d+\\.?\\d*))?((\x14[^\x00]*)?)\x14\x00')
+
+
+def _decode(raw):
+    """Decode an ascii header field and strip the padding"""
+    return raw.decode('ascii', errors='replace').strip()
+
+
+class EdfHeader():
+    """ Data structure holding the parsed header of an EDF/EDF+ file """
+
+    def __init__(self):
+        self.version = ''
+        self.patient_id = ''
+        self.recording_id = ''
+        self.start_date = ''
+        self.start_time = ''
+        self.header_bytes = 0
+        self.reserved = ''
+        self.nrecords = 0
+        self.record_duration = 0.0
+        self.nsignals = 0
+        self.labels = []
+        self.transducers = []
+        self.dimensions = []
+        self.physical_min = np.zeros(0)
+        self.physical_max = np.zeros(0)
+        self.digital_min = np.zeros(0)
+        self.digital_max = np.zeros(0)
+        self.prefilters = []
+        self.samples_per_record = np.zeros(0, dtype=np.int64)
+
+    @property
+    def is_edfplus(self):
+        return self.reserved.startswith('EDF+')
+
+    @property
+    def annotation_chns(self):
+        """Indices of the EDF+ annotation signals"""
+        return [chn for chn, label in enumerate(self.labels)
+                if label == ANNOTATIONS_LABEL]
+
+    @property
+    def data_chns(self):
+        """Indices of the ordinary (non-annotation) signals"""
+        return [chn for chn, label in enumerate(self.labels)
+                if label != ANNOTATIONS_LABEL]
+
+    @property
+    def record_samples(self):
+        """Number of 2-byte samples in one data record"""
+        return int(np.sum(self.samples_per_record))
+
+    @property
+    def record_offsets(self):
+        """Sample offset of each signal within a data record"""
+        return np.concatenate(
+            ([0], np.cumsum(self.samples_per_record)[:-1])).astype(np.int64)
+
+    @property
+    def fs(self):
+        """Sample frequency of each signal"""
+        return self.samples_per_record / self.record_duration
+
+    @property
+    def nsamples(self):
+        """Total number of samples in each signal"""
+        return self.samples_per_record * self.nrecords
+
+    @property
+    def file_duration(self):
+        return self.nrecords * self.record_duration
+
+    @property
+    def gain(self):
+        """Physical units per digital step for each signal"""
+        dig_range = self.digital_max - self.digital_min
+        dig_range[dig_range == 0] = 1
+        return (self.physical_max - self.physical_min) / dig_range
+
+    @property
+    def offset(self):
+        """Physical value of digital zero for each signal"""
+        return self.physical_min - self.digital_min * self.gain
+
+
+def parse_header(raw):
+    """
+    Parse the header of an EDF file
+
+    inputs:
+        raw - bytes containing at least the complete header
+
+    returns:
+        header - an EdfHeader
+    """
+    if len(raw) < MAIN_HEADER_BYTES:
+        raise ValueError('File is too short to be an EDF file')
+    if raw[0:1] != b'0':
+        raise ValueError('Only 16-bit EDF/EDF+ files are supported')
+
+    header = EdfHeader()
+    header.version = _decode(raw[0:8])
+    header.patient_id = _decode(raw[8:88])
+    header.recording_id = _decode(raw[88:168])
+    header.start_date = _decode(raw[168:176])
+    header.start_time = _decode(raw[176:184])
+    header.header_bytes = int(_decode(raw[184:192]))
+    header.reserved = _decode(raw[192:236])
+    header.nrecords = int(_decode(raw[236:244]))
+    header.record_duration = float(_decode(raw[244:252]))
+    header.nsignals = ns = int(_decode(raw[252:256]))
+
+    if len(raw) < MAIN_HEADER_BYTES + ns * SIGNAL_HEADER_BYTES:
+        raise ValueError('Signal headers are truncated')
+
+    # The signal headers are stored field by field for all signals
+    fields = {}
+    pos = MAIN_HEADER_BYTES
+    for name, width in _SIGNAL_FIELDS:
+        fields[name] = [_decode(raw[pos + ii * width:pos + (ii + 1) * width])
+                        for ii in range(ns)]
+        pos += ns * width
+
+    header.labels = fields['label']
+    header.transducers = fields['transducer']
+    header.dimensions = fields['dimension']
+    header.prefilters = fields['prefilter']
+    header.physical_min = np.array(fields['physical_min'], dtype=np.float64)
+    header.physical_max = np.array(fields['physical_max'], dtype=np.float64)
+    header.digital_min = np.array(fields['digital_min'], dtype=np.float64)
+    header.digital_max = np.array(fields['digital_max'], dtype=np.float64)
+    header.samples_per_record = np.array(
+        fields['samples_per_record'], dtype=np.int64)
+    return header
+
+
+def read_header(fn):
+    """
+    Read only the fixed-size header of an EDF file
+
+    inputs:
+        fn - name of .edf file
+
+    returns:
+        header - an EdfHeader, with nrecords checked against the file size
+    """
+    with open(fn, 'rb') as f:
+        raw = f.read(MAIN_HEADER_BYTES)
+        ns = int(_decode(raw[252:256]))
+        raw += f.read(ns * SIGNAL_HEADER_BYTES)
+        f.seek(0, 2)
+        file_size = f.tell()
+    header = parse_header(raw)
+    _check_nrecords(header, file_size)
+    return header
+
+
+def _check_nrecords(header, file_size):
+    """Fix up the number of records for unknown (-1) or truncated files"""
+    record_bytes = 2 * header.record_samples
+    if record_bytes == 0:
+        header.nrecords = 0
+        return
+    available = (file_size - header.header_bytes) // record_bytes
+    if header.nrecords < 0 or header.nrecords > available:
+        header.nrecords = int(max(available, 0))
+
+
+def parse_tals(raw):
+    """
+    Parse the time-stamped annotation lists of one EDF+ data record
+
+    inputs:
+        raw - bytes of the annotation signal of a single data record
+
+    returns:
+        record_onset - onset of the data record from its time-keeping TAL,
+            None if the record has no TALs
+        annotations - list of (onset, duration, text), duration is -1 when
+            it is not given
+    """
+    text = raw.decode('utf-8', errors='replace')
+    record_onset = None
+    annotations = []
+    for onset, _, duration, texts, _ in _TAL_REGEX.findall(text):
+        onset = float(onset)
+        if record_onset is None:
+            record_onset = onset
+        duration = float(duration) if duration else -1.0
+        for description in texts.split('\x14')[1:]:
+            if description:
+                annotations.append((onset, duration, description))
+    return record_onset, annotations
+
+
+class EdfSignal(NDArrayOperatorsMixin):
+    """ A lazily scaled view of one signal of a memory-mapped EDF file
+
+    Indexing with an integer or a slice decodes only the data records that
+    are touched. Converting to an array (np.asarray) decodes the whole view,
+    as do arithmetic and numpy functions, which return arrays.
+    A view can cover a sample range [start, stop) of the signal, in which
+    case all indices are relative to start.
+    """
+
+    def __init__(self, reader, edf_chn, start=0, stop=None):
+        self.reader = reader
+        # Hold the map itself so the view outlives closing the reader
+        self.records = reader.records
+        self.edf_chn = edf_chn
+        header = reader.header
+        self.label = header.labels[edf_chn]
+        self.spr = int(header.samples_per_record[edf_chn])
+        self.fs = float(header.fs[edf_chn])
+        self.gain = header.gain[edf_chn]
+        self.offset = header.offset[edf_chn]
+        self._start = int(header.record_offsets[edf_chn])
+        total = self.spr * header.nrecords
+        if stop is None or stop > total:
+            stop = total
+        self.first = min(max(start, 0), total)
+        self.nsamples = max(stop - self.first, 0)
+
+    @property
+    def shape(self):
+        return (self.nsamples,)
+
+    @property
+    def ndim(self):
+        return 1
+
+    @property
+    def size(self):
+        return self.nsamples
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float64)
+
+    def __len__(self):
+        return self.nsamples
+
+    def digital(self, start=0, stop=None):
+        """
+        Return the raw digital samples in [start, stop)
+
+        Only the data records covering the range are read from disk.
+        """
+        if stop is None or stop > self.nsamples:
+            stop = self.nsamples
+        start = max(start, 0)
+        if stop <= start:
+            return np.zeros(0, dtype=np.int16)
+        start += self.first
+        stop += self.first
+        first_record = start // self.spr
+        last_record = (stop - 1) // self.spr + 1
+        records = self.records[first_record:last_record,
+                               self._start:self._start + self.spr]
+        skip = start - first_record * self.spr
+        return records.reshape(-1)[skip:skip + stop - start]
+
+    def read(self, start=0, stop=None, dtype=np.float64, out=None):
+        """Return the physical samples in [start, stop)
+
+        The samples are scaled in place in out, a 1-D array of the right
+        length, when it is given, for example a row of a preallocated
+        (channels, samples) array.
+        """
+        digital = self.digital(start, stop)
+        if out is None:
+            out = np.empty(len(digital), dtype=dtype)
+        out[:] = digital
+        out *= self.gain
+        out += self.offset
+        return out
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.nsamples)
+            if step == 1:
+                return self.read(start, stop)
+            if step > 0:
+                return self.read(start, stop)[::step]
+            return self.read(stop + 1, start + 1)[::-1][::-step]
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += self.nsamples
+            if not 0 <= key < self.nsamples:
+                raise IndexError('Sample index out of range')
+            return self.read(key, key + 1)[0]
+        return np.asarray(self)[key]
+
+    def __array__(self, dtype=None, copy=None):
+        samples = self.read()
+        if dtype is not None:
+            samples = samples.astype(dtype, copy=False)
+        return samples
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        # Views are read-only, so they can be inputs but not outputs
+        if any(isinstance(x, EdfSignal) for x in kwargs.get('out', ())):
+            return NotImplemented
+        inputs = [np.asarray(x) if isinstance(x, EdfSignal) else x
+                  for x in inputs]
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __deepcopy__(self, memo):
+        # The underlying file is read-only, so a copy can share the mapping,
+        # which stays valid after the reader is closed
+        signal = copy.copy(self)
+        memo[id(self)] = signal
+        return signal
+
+
+class EdfReader():
+    """ A native EDF/EDF+ reader backed by a memory map of the data records
+
+    The header is parsed once on open. Each signal is exposed as an EdfSignal
+    view, and conversion from digital to physical values happens only for
+    the samples that are requested. The subset of the pyedflib.EdfReader
+    interface used in this repository is provided so that either reader can
+    be used interchangeably.
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.header = read_header(fn)
+        self._annotations = None
+        header = self.header
+        if header.nrecords > 0 and header.record_samples > 0:
+            self.records = np.memmap(
+                fn, dtype='<i2', mode='r', offset=header.header_bytes,
+                shape=(header.nrecords, header.record_samples))
+        else:
+            self.records = np.zeros((0, header.record_samples), dtype='<i2')
+        # Mirror pyedflib, which hides the annotation signals
+        self.data_chns = header.data_chns
+        self.signals_in_file = len(self.data_chns)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Release the memory map"""
+        self.records = None
+
+    # pyedflib calls its close method _close
+    _close = close
+
+    def signal(self, chn, start=0, stop=None):
+        """Return a lazy EdfSignal view of samples [start, stop) of chn"""
+        return EdfSignal(self, self.data_chns[chn], start, stop)
+
+    def signals(self):
+        """Return lazy views of all data signals"""
+        return [self.signal(chn) for chn in range(self.signals_in_file)]
+
+    def getSignalLabels(self):
+        return [self.header.labels[chn] for chn in self.data_chns]
+
+    def getNSamples(self):
+        return self.header.nsamples[self.data_chns]
+
+    def getSampleFrequencies(self):
+        return self.header.fs[self.data_chns]
+
+    def getSampleFrequency(self, chn):
+        return self.header.fs[self.data_chns[chn]]
+
+    def getFileDuration(self):
+        return self.header.file_duration
+
+    def readSignal(self, chn, start=0, n=None, digital=False):
+        """Read n samples of data signal chn, starting at sample start"""
+        stop = None if n is None else start + n
+        if digital:
+            return self.signal(chn).digital(start, stop).astype(np.int32)
+        return self.signal(chn).read(start, stop)
+
+    def annotation_bytes(self):
+        """Return the raw annotation signal bytes of every data record, as
+        read_annotation_bytes
+        """
+        return read_annotation_bytes(self.fn, self.header)
+
+    def readAnnotations(self):
+        """
+        Read the EDF+ annotations
+
+        returns:
+            (onsets, durations, descriptions) as arrays, with onsets relative
+            to the start of the file and durations of -1 when not given
+        """
+        if self._annotations is None:
+            self._annotations = _annotations_from_records(
+                self.annotation_bytes())
+        return self._annotations
+
+
+def _annotations_from_records(records):
+    """Parse the annotation bytes of all records into three arrays"""
+    onsets = []
+    durations = []
+    descriptions = []
+    start_offset = None
+    for raw in records:
+        record_onset, annotations = parse_tals(raw)
+        if start_offset is None and record_onset is not None:
+            start_offset = record_onset
+        for onset, duration, description in annotations:
+            onsets.append(onset)
+            durations.append(duration)
+            descriptions.append(description)
+    onsets = np.array(onsets, dtype=np.float64)
+    if start_offset:
+        onsets -= start_offset
+    return (onsets, np.array(durations, dtype=np.float64),
+            np.array(descriptions, dtype=str))
+
+
+def read_annotation_bytes(fn, header=None):
+    """
+    Read only the bytes of the annotation signals of every data record
+
+    The signal data is never read, which makes this much cheaper than
+    opening the file with a full reader when only annotations are needed.
+
+    inputs:
+        fn - name of .edf file
+        header - EdfHeader of the file, read from fn if not given
+
+    returns:
+        list with one bytes object per data record, empty for plain EDF
+    """
+    if header is None:
+        header = read_header(fn)
+    chns = header.annotation_chns
+    if not chns:
+        return []
+    record_bytes = 2 * header.record_samples
+    offsets = header.record_offsets
+    # (byte offset within a record, length) of each annotation signal
+    spans = [(2 * int(offsets[chn]), 2 * int(header.samples_per_record[chn]))
+             for chn in chns]
+    records = []
+    with open(fn, 'rb') as f:
+        fd = f.fileno()
+        for record in range(header.nrecords):
+            base = header.header_bytes + record * record_bytes
+            if hasattr(os, 'pread'):
+                raw = b''.join(os.pread(fd, length, base + start)
+                               for start, length in spans)
+            else:
+                raw = b''
+                for start, length in spans:
+                    f.seek(base + start)
+                    raw += f.read(length)
+            records.append(raw)
+    return records
+
+
+def read_annotations(fn):
+    """
+    Read the EDF+ annotations of a file without reading any signal data
+
+    inputs:
+        fn - name of .edf file
+
+    returns:
+        (onsets, durations, descriptions) as EdfReader.readAnnotations
+    """
+    return _annotations_from_records(read_annotation_bytes(fn))
+
+
+def read_block(bufs, start, stop, dtype=np.float32):
+    """Return samples [start, stop) of every channel as a 2-D array
+
+    Channels in a list, for example EdfSignal views, are copied straight
+    into a preallocated array of dtype, without an intermediate list of
+    arrays. Only the data records covering the block are read.
+    """
+    if isinstance(bufs, np.ndarray):
+        return bufs[..., start:stop]
+    stop = min(stop, len(bufs[0]))
+    block = np.empty((len(bufs), max(stop - start, 0)), dtype=dtype)
+    for chn, buf in enumerate(bufs):
+        block[chn] = buf[start:stop]
+    return block
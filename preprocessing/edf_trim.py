@@ -0,0 +1,210 @@
+""" Trim EDF/EDF+ files by copying data records without decoding them """
+import datetime
+
+import numpy as np
+
+from preprocessing.edf_reader import (EdfReader, _TAL_REGEX,
+                                      _annotations_from_records)
+
+# Number of data records copied at a time
+RECORDS_PER_BLOCK = 256
+# Month abbreviations of EDF+ dates, which do not depend on the locale
+_MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN',
+           'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+
+
+def _field(value, width):
+    """Encode a header field, padded with spaces"""
+    raw = str(value).encode('ascii')[:width]
+    return raw.ljust(width, b' ')
+
+
+def _format_seconds(seconds, sign=True):
+    """Format a TAL onset or duration without trailing zeros"""
+    text = '{:+.7f}'.format(seconds) if sign else '{:.7f}'.format(seconds)
+    return text.rstrip('0').rstrip('.')
+
+
+def _start_datetime(header):
+    """Return the start of the recording from the header as a datetime"""
+    day, month, year = [int(x) for x in header.start_date.split('.')]
+    hour, minute, second = [int(x) for x in header.start_time.split('.')]
+    # EDF years 85-99 are 1985-1999, all others are in the 2000s
+    year += 1900 if year >= 85 else 2000
+    return datetime.datetime(year, month, day, hour, minute, second)
+
+
+def _shift_recording_id(recording_id, start):
+    """Shift the EDF+ 'Startdate dd-MMM-yyyy' subfield of the recording id"""
+    parts = recording_id.split(' ')
+    if len(parts) < 2 or parts[0] != 'Startdate' or parts[1] == 'X':
+        return recording_id
+    parts[1] = '{:02d}-{}-{:04d}'.format(start.day, _MONTHS[start.month - 1],
+                                          start.year)
+    return ' '.join(parts)
+
+
+def _encode_annotations(onsets, durations, descriptions):
+    """Encode one TAL per annotation"""
+    tals = []
+    for onset, duration, description in zip(onsets, durations, descriptions):
+        tal = _format_seconds(onset)
+        if duration >= 0:
+            tal += '\x15' + _format_seconds(duration, sign=False)
+        tal += '\x14' + description + '\x14\x00'
+        tals.append(tal.encode('utf-8'))
+    return tals
+
+
+def _annotation_records(header, nrecords, first_onset, tals):
+    """
+    Lay out the annotation signals of every output data record
+
+    The first annotation signal of each record starts with its time-keeping
+    TAL. The annotation TALs fill the remaining space in record order.
+
+    returns:
+        array of shape (nrecords, annotation samples per record) of int16
+    """
+    chns = header.annotation_chns
+    widths = [2 * int(header.samples_per_record[chn]) for chn in chns]
+    out = bytearray()
+    pending = list(tals)
+    for record in range(nrecords):
+        for ii, width in enumerate(widths):
+            raw = b''
+            if ii == 0:
+                onset = first_onset + record * header.record_duration
+                raw = (_format_seconds(onset) + '\x14\x14\x00').encode('ascii')
+            while pending and len(raw) + len(pending[0]) <= width:
+                raw += pending.pop(0)
+            out += raw.ljust(width, b'\x00')
+    if pending:
+        raise ValueError('Annotations do not fit in the trimmed file, '
+                         'use the decode mode instead')
+    return np.frombuffer(bytes(out), dtype='<i2').reshape(nrecords, -1)
+
+
+def trim_edf(fn_in, fn_out, start, end):
+    """
+    Copy the data records between start and end seconds into a new file
+
+    The signals are copied as stored, without converting them to physical
+    values, so the trimmed signals are bit-for-bit those of the source. Only
+    the header fields for the number of records and the start date and time
+    are rewritten, along with the EDF+ annotation signal, whose annotations
+    are shifted to the new start. When start is on a data record boundary
+    whole records are copied. Otherwise the records are reassembled from the
+    stored samples of the records on either side of each boundary. Samples
+    after end in the last record are set to the stored value closest to
+    zero.
+
+    inputs:
+        fn_in - name of the .edf file to trim
+        fn_out - name of the .edf file to write
+        start - start of the trimmed signal in seconds
+        end - end of the trimmed signal in seconds
+    """
+    reader = EdfReader(fn_in)
+    header = reader.header
+    if header.reserved.startswith('EDF+D'):
+        raise ValueError('Discontinuous EDF+ files are not supported')
+    duration = header.record_duration
+    spr = header.samples_per_record
+    start = max(start, 0)
+    end = min(end, header.file_duration)
+    nrecords = max(int(np.ceil((end - start) / duration - 1e-9)), 0)
+
+    # First stored sample of the trimmed signal and number of samples kept
+    chns = header.data_chns
+    first = start * header.fs
+    if np.any(np.abs(first[chns] - np.round(first[chns])) > 1e-6):
+        raise ValueError('Start is not on a sample of every signal, '
+                         'use the decode mode instead')
+    first = np.round(first).astype(np.int64)
+    keep = np.minimum(np.round(end * header.fs).astype(np.int64),
+                      header.nsamples) - first
+    first_record = int(np.floor(start / duration + 1e-9))
+    aligned = abs(start / duration - first_record) < 1e-9
+
+    # Stored value closest to zero, used to pad the last record
+    pad = {}
+    for chn in chns:
+        zero = header.digital_min[chn]
+        if header.gain[chn] != 0:
+            zero = np.round(-header.offset[chn] / header.gain[chn])
+        pad[chn] = np.clip(zero, header.digital_min[chn],
+                           header.digital_max[chn])
+
+    # Shift the start date and time, keeping fractions of a second for the
+    # time-keeping TALs
+    annotation_chns = header.annotation_chns
+    annotation_bytes = reader.annotation_bytes() if annotation_chns else []
+    if annotation_bytes:
+        record_onset = _TAL_REGEX.search(
+            annotation_bytes[0].decode('utf-8', errors='replace'))
+        record_onset = float(record_onset.group(1)) if record_onset else 0.0
+    else:
+        record_onset = 0.0
+    offset = record_onset + start
+    new_start = (_start_datetime(header)
+                 + datetime.timedelta(seconds=int(np.floor(offset))))
+    first_onset = offset - np.floor(offset)
+
+    if annotation_chns:
+        onsets, durations, descriptions = _annotations_from_records(
+            annotation_bytes)
+        idx = np.where((onsets >= start) * (onsets <= end))
+        tals = _encode_annotations(onsets[idx] - start + first_onset,
+                                   durations[idx], descriptions[idx])
+        annotations = _annotation_records(header, nrecords, first_onset, tals)
+        annotation_columns = np.concatenate([
+            np.arange(header.record_offsets[chn],
+                      header.record_offsets[chn] + spr[chn])
+            for chn in annotation_chns])
+
+    with open(fn_in, 'rb') as f:
+        raw_header = bytearray(f.read(header.header_bytes))
+    raw_header[88:168] = _field(
+        _shift_recording_id(header.recording_id, new_start), 80)
+    raw_header[168:176] = _field(new_start.strftime('%d.%m.%y'), 8)
+    raw_header[176:184] = _field(new_start.strftime('%H.%M.%S'), 8)
+    raw_header[236:244] = _field(nrecords, 8)
+
+    with open(fn_out, 'wb') as f:
+        f.write(bytes(raw_header))
+        for block in range(0, nrecords, RECORDS_PER_BLOCK):
+            n = min(RECORDS_PER_BLOCK, nrecords - block)
+            lo = first_record + block
+            if aligned and lo + n <= header.nrecords:
+                records = np.array(reader.records[lo:lo + n])
+            else:
+                records = np.empty((n, header.record_samples), dtype='<i2')
+                # One extra source record covers a start inside a record
+                src = reader.records[lo:lo + n + 1]
+                for chn in chns:
+                    samples = src[:, header.record_offsets[chn]:
+                                  header.record_offsets[chn] + spr[chn]]
+                    skip = first[chn] - first_record * spr[chn]
+                    samples = samples.reshape(-1)[skip:]
+                    samples = samples[:n * spr[chn]]
+                    column = np.full(n * spr[chn], pad[chn], dtype='<i2')
+                    column[:len(samples)] = samples
+                    records[:, header.record_offsets[chn]:
+                            header.record_offsets[chn] + spr[chn]] = \
+                        column.reshape(n, spr[chn])
+            # Pad any samples after the end of the trimmed signal
+            for chn in chns:
+                stop = keep[chn] - block * spr[chn]
+                if stop < n * spr[chn]:
+                    column = records[:, header.record_offsets[chn]:
+                                     header.record_offsets[chn] + spr[chn]]
+                    column = column.reshape(-1)
+                    column[max(stop, 0):] = pad[chn]
+                    records[:, header.record_offsets[chn]:
+                            header.record_offsets[chn] + spr[chn]] = \
+                        column.reshape(n, spr[chn])
+            if annotation_chns:
+                records[:, annotation_columns] = annotations[block:block + n]
+            f.write(records.tobytes())
+    reader.close()
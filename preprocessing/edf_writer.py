@@ -0,0 +1,281 @@
+""" Streaming writers for EDF+ files """
+import math
+import warnings
+from fractions import Fraction
+
+import numpy as np
+import pyedflib
+import pyedflib.highlevel
+
+# Data records are one second long when every sample rate allows it
+RECORD_DURATION = 1
+# Longest data record allowed, in seconds, as in pyedflib
+MAX_RECORD_DURATION = 60
+# The record duration field of the EDF header is 8 characters
+_DURATION_CHARS = 8
+
+
+def sample_rate(signal_header):
+    """Return the sample rate of a pyedflib signal header dictionary"""
+    if 'sample_frequency' in signal_header:
+        return signal_header['sample_frequency']
+    return signal_header['sample_rate']
+
+
+def set_sample_rate(signal_header, fs):
+    """Set the sample rate using the key of this pyedflib version"""
+    if 'sample_frequency' in signal_header:
+        signal_header['sample_frequency'] = fs
+    else:
+        signal_header['sample_rate'] = fs
+
+
+def make_signal_header(label, fs, physical_min, physical_max):
+    """Make a pyedflib signal header for a signal in uV"""
+    # Positional arguments, as the name of the sample rate argument
+    # differs between pyedflib versions
+    return pyedflib.highlevel.make_signal_header(
+        label, 'uV', fs, physical_min, physical_max)
+
+
+def _format_duration(duration):
+    return '{:f}'.format(float(duration)).rstrip('0').rstrip('.')
+
+
+def record_duration(signal_headers):
+    """
+    Choose a data record duration holding whole samples of every signal
+
+    The duration is the shortest one of at least RECORD_DURATION seconds
+    for which every sample rate gives an integer number of samples per
+    record, and which fits exactly in the header. Signals whose rates are
+    all integers keep one second records.
+
+    inputs:
+        signal_headers - pyedflib signal headers for the channels
+
+    returns:
+        duration in seconds, as a Fraction
+
+    raises:
+        ValueError - for a rate that is not positive, or rates that no
+            record of at most MAX_RECORD_DURATION seconds can hold
+    """
+    rates = []
+    for sheader in signal_headers:
+        fs = sample_rate(sheader)
+        if not fs > 0:
+            raise ValueError('Cannot write a sample rate of {} Hz to an '
+                             'EDF file'.format(fs))
+        rates.append(Fraction(fs).limit_denominator(10 ** 7))
+    # Durations giving whole samples for every rate n / d are the multiples
+    # of lcm(d) / gcd(n * lcm(d) / d)
+    denominator = 1
+    for rate in rates:
+        denominator = denominator * rate.denominator // math.gcd(
+            denominator, rate.denominator)
+    numerator = 0
+    for rate in rates:
+        numerator = math.gcd(numerator,
+                             rate.numerator * denominator // rate.denominator)
+    step = Fraction(denominator, numerator)
+    multiple = max(math.ceil(RECORD_DURATION / step), 1)
+    while multiple * step <= MAX_RECORD_DURATION:
+        duration = multiple * step
+        text = _format_duration(duration)
+        if len(text) <= _DURATION_CHARS and Fraction(text) == duration:
+            return duration
+        multiple += 1
+    raise ValueError('No data record of at most {} s holds whole samples at '
+                     'sample rates {} Hz'.format(
+                         MAX_RECORD_DURATION,
+                         [sample_rate(sheader) for sheader in signal_headers]))
+
+
+def samples_per_record(signal_headers, duration=None):
+    """
+    Return the number of samples per data record for each signal
+
+    inputs:
+        signal_headers - pyedflib signal headers for the channels
+        duration - data record duration in seconds, by default the one
+            chosen by record_duration
+    """
+    if duration is None:
+        duration = record_duration(signal_headers)
+    return [int(round(Fraction(sample_rate(sheader)).limit_denominator(
+                10 ** 7) * duration))
+            for sheader in signal_headers]
+
+
+def iter_record_chunks(signals, signal_headers, records_per_chunk=60):
+    """
+    Split in-memory signals into chunks of whole data records
+
+    inputs:
+        signals - list of per-channel arrays (or a channels-first array)
+        signal_headers - pyedflib signal headers for the channels
+        records_per_chunk - number of data records in each chunk
+
+    yields:
+        list of per-channel array views covering the same records
+    """
+    spr = samples_per_record(signal_headers)
+    nrecords = max(int(np.ceil(len(signal) / n))
+                   for signal, n in zip(signals, spr))
+    for record in range(0, nrecords, records_per_chunk):
+        yield [signal[record * n:(record + records_per_chunk) * n]
+               for signal, n in zip(signals, spr)]
+
+
+class StreamingEdfWriter():
+    """ Write an EDF+ file a block of data records at a time
+
+    The physical minimum and maximum of each channel must be known before the
+    first record is written. Either give them in the signal headers, or pass
+    every chunk to scan() in a first pass before calling write() on the same
+    chunks in a second pass. Samples that do not fill a whole data record
+    are held back until the next chunk, and the final partial record is
+    zero padded on close. Memory use depends only on the chunk size.
+    """
+
+    def __init__(self, fn, signal_headers, header=None, annotations=None,
+                 file_type=pyedflib.FILETYPE_EDFPLUS):
+        """
+        inputs:
+            fn - name of the .edf file to write
+            signal_headers - list of pyedflib signal header dictionaries
+            header - pyedflib main header dictionary
+            annotations - (onsets, durations, descriptions) to write
+            file_type - pyedflib file type
+        """
+        self.fn = fn
+        self.signal_headers = [dict(sheader) for sheader in signal_headers]
+        self.header = header
+        self.annotations = annotations
+        self.file_type = file_type
+        self.nchns = len(self.signal_headers)
+        self.duration = record_duration(self.signal_headers)
+        self.spr = samples_per_record(self.signal_headers, self.duration)
+        self.physical_min = np.full(self.nchns, np.inf)
+        self.physical_max = np.full(self.nchns, -np.inf)
+        self._pending = [np.zeros(0)] * self.nchns
+        self._writer = None
+        self.nrecords = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def scan(self, chunk):
+        """First pass: track the physical range of a chunk of samples"""
+        for chn, signal in enumerate(chunk):
+            if len(signal) > 0:
+                self.physical_min[chn] = min(self.physical_min[chn],
+                                             np.min(signal))
+                self.physical_max[chn] = max(self.physical_max[chn],
+                                             np.max(signal))
+
+    def _open(self):
+        """Set the headers from the scanned range and open the file"""
+        for chn, sheader in enumerate(self.signal_headers):
+            if np.isfinite(self.physical_min[chn]):
+                sheader['physical_min'] = float(self.physical_min[chn])
+                sheader['physical_max'] = float(self.physical_max[chn])
+            # pyedflib rejects an empty physical range
+            if sheader['physical_min'] == sheader['physical_max']:
+                sheader['physical_max'] = sheader['physical_min'] + 1
+        signal_headers = self.signal_headers
+        self._writer = pyedflib.EdfWriter(self.fn, self.nchns,
+                                          file_type=self.file_type)
+        if self.header is not None:
+            self._writer.setHeader(self.header)
+        if self.duration != 1:
+            if hasattr(pyedflib.EdfWriter, 'get_smp_per_record'):
+                # The duration is in seconds, and pyedflib warns that
+                # forcing it may change the rates read back
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    self._writer.setDatarecordDuration(float(self.duration))
+            else:
+                # Older versions take units of 10 us and write sample_rate
+                # samples per record
+                self._writer.setDatarecordDuration(
+                    int(round(self.duration * 100000)))
+                signal_headers = [dict(sheader) for sheader in signal_headers]
+                for sheader, n in zip(signal_headers, self.spr):
+                    set_sample_rate(sheader, n)
+        self._writer.setSignalHeaders(signal_headers)
+
+    def write(self, chunk):
+        """Second pass: write every complete data record of a chunk"""
+        if self._writer is None:
+            self._open()
+        if len(chunk) == 0:
+            return
+        self._pending = [np.concatenate((pending, signal))
+                         for pending, signal in zip(self._pending, chunk)]
+        nrecords = min(len(pending) // n
+                       for pending, n in zip(self._pending, self.spr))
+        if nrecords > 0:
+            self._writer.writeSamples(
+                [np.ascontiguousarray(pending[:nrecords * n], dtype=np.float64)
+                 for pending, n in zip(self._pending, self.spr)])
+            self._pending = [pending[nrecords * n:]
+                             for pending, n in zip(self._pending, self.spr)]
+            self.nrecords += nrecords
+
+    def close(self):
+        """Flush the last partial record, write annotations and close
+
+        A recording without any samples gets one data record of zeros, as
+        EDF readers reject files without data records.
+        """
+        if self._writer is None:
+            self._open()
+        if (self.nrecords == 0
+                or any(len(pending) > 0 for pending in self._pending)):
+            padded = []
+            for pending, n in zip(self._pending, self.spr):
+                record = np.zeros(n)
+                record[:min(len(pending), n)] = pending[:n]
+                padded.append(record)
+            self._writer.writeSamples(padded)
+            self._pending = [np.zeros(0)] * self.nchns
+            self.nrecords += 1
+        if self.annotations is not None:
+            for onset, duration, description in zip(*self.annotations):
+                self._writer.writeAnnotation(float(onset), float(duration),
+                                             description)
+        self._writer.close()
+
+
+def write_edf(fn, chunks, signal_headers, header=None, annotations=None,
+              file_type=pyedflib.FILETYPE_EDFPLUS):
+    """
+    Write an EDF+ file from chunks of data records
+
+    The physical range in the signal headers is kept. If a header does not
+    give one, the range of every channel is found in a first pass over the
+    chunks before they are written in a second pass.
+
+    inputs:
+        fn - name of the .edf file to write
+        chunks - function returning a new iterable over the chunks, each a
+            list of per-channel arrays. It is called once to write, and
+            before that once to scan the physical range if it is needed.
+        signal_headers - list of pyedflib signal header dictionaries
+        header - pyedflib main header dictionary
+        annotations - (onsets, durations, descriptions) to write
+    """
+    writer = StreamingEdfWriter(fn, signal_headers, header, annotations,
+                                file_type)
+    if any('physical_min' not in sheader or 'physical_max' not in sheader
+           for sheader in signal_headers):
+        for chunk in chunks():
+            writer.scan(chunk)
+    for chunk in chunks():
+        writer.write(chunk)
+    writer.close()
@@ -0,0 +1,117 @@
+""" Extract several features in one pass, sharing their intermediate results
+
+Many features start with the same work on a batch of windows: tapering and
+transforming them, estimating their spectrum, or taking their wavelet
+decomposition. Each feature and intermediate result here declares the
+intermediates it depends on, and a FeatureGraph computes every requested
+feature of a batch from one set of intermediates, each computed at most
+once. Batches are processed a chunk of windows at a time, so the
+intermediates of a whole recording are never held at once.
+
+Every node is a function of its dependencies' values, and of fs if it has
+an fs argument. Features without a node are computed by their function in
+preprocessing.features from the (T, C, L) tensor of windows, and every
+feature gives the same result, with the same dtype, as calling its function
+in preprocessing.features directly.
+"""
+import inspect
+from functools import lru_cache
+
+import torch
+
+import preprocessing.features as features
+
+# The (T, C, L) tensor of windows, and the same windows as an array
+BUFFERS = 'buffers'
+WINDOWS = 'windows'
+
+
+def _as_array(buffers):
+    return buffers.numpy()
+
+
+@lru_cache(maxsize=None)
+def _takes_fs(func):
+    """Whether a node function has an fs argument"""
+    return 'fs' in inspect.signature(func).parameters
+
+
+# Intermediate results: name -> (function, dependencies)
+INTERMEDIATES = {
+    WINDOWS: (_as_array, (BUFFERS,)),
+    'tapered': (features.tapered, (WINDOWS,)),
+    'psd': (features.welch_psd, (WINDOWS,)),
+    'wavelet coefficients': (features.wavelet_coefficients, (WINDOWS,)),
+}
+
+# Features computed from intermediates: name -> (function, dependencies)
+FEATURES = {
+    'fft': (features.fft_magnitude, ('tapered',)),
+    'bandpass': (features.band_power, (WINDOWS,)),
+    'bandpass_welch': (features.psd_band_power, ('psd',)),
+    'kaleem_features': (features.kaleem_from_wavelets,
+                        ('wavelet coefficients',)),
+}
+
+
+class FeatureGraph():
+    """ Computes a list of features of batches of windows in one pass
+    """
+
+    def __init__(self, feat_names, chunk_windows=1024):
+        """
+        inputs:
+            feat_names - names of features in preprocessing.features
+            chunk_windows - number of windows whose intermediates are held
+                at once
+        """
+        for feat_name in feat_names:
+            if feat_name not in FEATURES and \
+                    not hasattr(features, feat_name):
+                raise ValueError('Unknown feature: {}'.format(feat_name))
+        self.feat_names = list(feat_names)
+        self.chunk_windows = max(int(chunk_windows), 1)
+
+    def _compute_chunk(self, buffers, fs):
+        """Compute the features of one chunk of windows"""
+        values = {BUFFERS: buffers}
+
+        def evaluate(name, nodes):
+            if name not in values:
+                func, deps = nodes[name]
+                kwargs = {'fs': fs} if _takes_fs(func) else {}
+                values[name] = func(
+                    *[evaluate(dep, INTERMEDIATES) for dep in deps], **kwargs)
+            return values[name]
+
+        feats = {}
+        for feat_name in self.feat_names:
+            if feat_name in FEATURES:
+                # Converted as the feature's own function converts it
+                feats[feat_name] = features.feature_tensor(
+                    evaluate(feat_name, FEATURES))
+            else:
+                feats[feat_name] = torch.as_tensor(
+                    getattr(features, feat_name)(buffers, fs=fs))
+        return feats
+
+    def compute(self, windowed_buffers, fs=200):
+        """
+        Compute every feature of a batch of windows
+
+        inputs:
+            windowed_buffers - (T, C, L) tensor of windows
+            fs - sample rate of the windows
+
+        returns:
+            dict from feature name to its (T, C, F) tensor
+        """
+        T = windowed_buffers.shape[0]
+        chunks = []
+        for start in range(0, max(T, 1), self.chunk_windows):
+            chunk = windowed_buffers[start:start + self.chunk_windows]
+            chunks.append(self._compute_chunk(chunk, fs))
+        if len(chunks) == 1:
+            return chunks[0]
+        return {feat_name: torch.cat([chunk[feat_name] for chunk in chunks])
+                for feat_name in self.feat_names}
@@ -0,0 +1,153 @@
+""" Extract features from batches of windows with a pool of processes
+
+Features such as sampen and lle are computed one window at a time and are
+CPU bound, so a FeaturePool splits the window axis of a (T, C, L) batch
+into chunks that are computed by worker processes. The windows are copied
+once into a shared memory block that every worker maps, and each worker
+writes its chunk of the features straight into a second shared block, so
+no tensors are pickled between processes. Each chunk is written at its
+window offset, so the result is in window order however the chunks
+finish.
+
+Features must treat windows independently, which is true of every feature
+in preprocessing.features.
+"""
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+import torch
+
+import preprocessing.features as features
+import preprocessing.parallel as parallel
+
+
+def _share(x):
+    """Copy an array into a new shared memory block
+
+    returns:
+        shm - the SharedMemory, to be closed and unlinked by the caller
+        spec - (name, shape, dtype) of the array, for _attach
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(x.nbytes, 1))
+    np.ndarray(x.shape, dtype=x.dtype, buffer=shm.buf)[...] = x
+    return shm, (shm.name, x.shape, x.dtype.str)
+
+
+def _attach(spec):
+    """Map the shared array described by spec, returning (shm, array)"""
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _init_worker(threads):
+    # Split the cores between the workers rather than each using them all
+    torch.set_num_threads(threads)
+    parallel.set_max_threads(threads)
+
+
+def _compute_chunk(feat_name, fs, windows, out, start, stop):
+    feat = getattr(features, feat_name)(
+        torch.from_numpy(windows[start:stop]), fs=fs)
+    out[start:stop] = np.asarray(feat)
+
+
+def _extract_chunk(task):
+    """Compute a feature for windows [start, stop) of the shared input"""
+    feat_name, fs, in_spec, out_spec, start, stop = task
+    shm_in, windows = _attach(in_spec)
+    shm_out, out = _attach(out_spec)
+    try:
+        _compute_chunk(feat_name, fs, windows, out, start, stop)
+    finally:
+        del windows, out
+        for shm in (shm_in, shm_out):
+            try:
+                shm.close()
+            except BufferError:
+                # A failed chunk's traceback still holds a view; the block
+                # is unmapped when it is collected
+                pass
+    return start, stop
+
+
+class FeaturePool():
+    """ Worker processes extracting a feature from chunks of windows
+
+    The pool is started on the first batch that needs it and is reused for
+    later batches, so it can be kept open while looping over files.
+    """
+
+    def __init__(self, workers=None, chunk_windows=64):
+        """
+        inputs:
+            workers - number of processes, 0 or None for every core, 1 to
+                compute in the calling process
+            chunk_windows - number of windows per task
+        """
+        self.workers = workers or parallel.cpu_count()
+        self.chunk_windows = max(int(chunk_windows), 1)
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Stop the worker processes"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            threads = max(parallel.cpu_count() // self.workers, 1)
+            self._pool = Pool(self.workers, initializer=_init_worker,
+                              initargs=(threads,))
+        return self._pool
+
+    def extract(self, feat_name, windowed_buffers, fs=200):
+        """
+        Compute a feature of a batch of windows
+
+        inputs:
+            feat_name - name of a function in preprocessing.features
+            windowed_buffers - (T, C, L) tensor of windows
+            fs - sample rate of the windows
+
+        returns:
+            (T, C, F) tensor, the same as calling the feature directly
+        """
+        feature = getattr(features, feat_name)
+        T = windowed_buffers.shape[0]
+        if self.workers == 1 or T <= self.chunk_windows:
+            return feature(windowed_buffers, fs=fs)
+
+        windows = np.ascontiguousarray(windowed_buffers.numpy())
+        # The shape and dtype of the output come from the first window
+        first = np.asarray(feature(windowed_buffers[:1], fs=fs))
+        shm_in, in_spec = _share(windows)
+        shm_out = None
+        try:
+            out_shape = (T,) + first.shape[1:]
+            shm_out = shared_memory.SharedMemory(
+                create=True, size=max(first.itemsize * int(np.prod(
+                    out_shape)), 1))
+            out_spec = (shm_out.name, out_shape, first.dtype.str)
+            tasks = [(feat_name, fs, in_spec, out_spec, start,
+                      min(start + self.chunk_windows, T))
+                     for start in range(0, T, self.chunk_windows)]
+            for _ in self._get_pool().imap_unordered(_extract_chunk, tasks):
+                pass
+            out = np.ndarray(out_shape, dtype=first.dtype, buffer=shm_out.buf)
+            feat = torch.from_numpy(out.copy())
+            del out
+        finally:
+            for shm in (shm_in, shm_out):
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
+        return feat
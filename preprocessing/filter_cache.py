@@ -0,0 +1,240 @@
+""" A disk cache of filtered signals shared by the scripts and the viewer
+
+Each entry is one filtered channel, stored as a .npy file in the dtype it
+was filtered in, and named by a hash of everything the result depends on:
+the source (an EDF file's path, size and modification time, its contents,
+or the samples themselves), the channel, the sample rate and the filter
+settings. A changed input or setting therefore gives a new key, and stale
+entries are never read; they are simply evicted.
+
+The cache is bounded by max_bytes. Reading an entry updates its
+modification time, and when the cache grows past its limit the least
+recently used entries are deleted. Several processes can share a cache
+directory: entries are written atomically, and the size is recounted from
+the directory before evicting.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+ENTRY_EXT = '.npy'
+# Configuration settings that change the filtered channels, before clipping
+# and scaling
+FILTER_PARAMS = ('notch', 'lpf fc', 'hpf fc', 'filter method',
+                 'fir transition', 'sample dtype')
+
+
+def make_key(*parts):
+    """Hash the repr of any number of key parts into a hex key"""
+    return hashlib.blake2b(repr(parts).encode('utf-8'),
+                           digest_size=20).hexdigest()
+
+
+def source_key(fn, content=False):
+    """
+    Identify a source file for use in a key
+
+    inputs:
+        fn - name of the file
+        content - hash the whole file instead of using its path, size and
+            modification time, so that copies and touched files still hit
+
+    returns:
+        string identifying the file's current contents
+    """
+    if not content:
+        st = os.stat(fn)
+        return '{}:{}:{}'.format(os.path.abspath(fn), st.st_size,
+                                 st.st_mtime_ns)
+    h = hashlib.blake2b(digest_size=20)
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def array_key(x):
+    """Hash the samples of an array, for keys of data with no source file"""
+    x = np.ascontiguousarray(x)
+    h = hashlib.blake2b(digest_size=20)
+    h.update(repr((x.dtype.str, x.shape)).encode('utf-8'))
+    h.update(x.data)
+    return h.hexdigest()
+
+
+class FilterCache():
+    """ A size-limited, least-recently-used directory of filtered channels
+    """
+
+    def __init__(self, cache_dir, max_bytes=1 << 30):
+        """
+        inputs:
+            cache_dir - directory of the cache, created when first written
+            max_bytes - total size of the entries to keep
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # Bytes in the cache, counted on the first write
+        self._size = None
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ENTRY_EXT)
+
+    def get(self, key):
+        """Return the entry for key, or None if it is not cached"""
+        path = self._path(key)
+        try:
+            x = np.load(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return x
+
+    def put(self, key, x):
+        """Store an array as the entry for key, keeping its dtype"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_fn = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp_fn, 'wb') as f:
+                np.save(f, np.asarray(x))
+            nbytes = os.path.getsize(tmp_fn)
+            os.replace(tmp_fn, path)
+        except BaseException:
+            if os.path.exists(tmp_fn):
+                os.remove(tmp_fn)
+            raise
+        if self._size is None:
+            self._size = self._scan()[1]
+        else:
+            self._size += nbytes
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _scan(self):
+        """List the entries as (mtime, nbytes, path), and their total size
+        """
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries, 0
+        for sub in os.scandir(self.cache_dir):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if not entry.name.endswith(ENTRY_EXT):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries, sum(entry[1] for entry in entries)
+
+    def evict(self, target=None):
+        """
+        Delete least recently used entries until the cache is at most
+        target bytes, 90% of max_bytes by default so that eviction does not
+        run on every write
+        """
+        if target is None:
+            target = int(0.9 * self.max_bytes)
+        entries, size = self._scan()
+        for _, nbytes, path in sorted(entries):
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= nbytes
+        self._size = size
+
+    def clear(self):
+        """Delete every entry"""
+        self.evict(0)
+
+    @property
+    def size(self):
+        """Total bytes of the entries"""
+        return self._scan()[1]
+
+
+def cached_rows(cache, keys, compute):
+    """
+    Assemble a (rows, samples) array from cached rows, computing the rest
+
+    inputs:
+        cache - a FilterCache, or None to compute every row
+        keys - key of each row
+        compute - function from a list of row indices to a (len(rows),
+            samples) array of those rows
+
+    returns:
+        (rows, samples) array in the dtype compute returns, or that the
+        cached rows were computed in when all of them are cached. Without
+        a cache, compute's result as it is.
+    """
+    if cache is None:
+        return compute(list(range(len(keys))))
+    rows = [cache.get(key) for key in keys]
+    missing = [row for row, x in enumerate(rows) if x is None]
+    dtype = np.float32
+    if missing:
+        computed = np.asarray(compute(missing))
+        dtype = computed.dtype
+        for row, x in zip(missing, computed):
+            cache.put(keys[row], x)
+            rows[row] = x
+    elif rows:
+        dtype = rows[0].dtype
+    out = np.empty((len(rows), len(rows[0]) if rows else 0),
+                   dtype=dtype)
+    for row, x in enumerate(rows):
+        out[row] = x
+    return out
+
+
+def config_cache(params):
+    """The FilterCache set by 'filter cache dir' and 'filter cache size',
+    or None if the cache directory is empty
+    """
+    if not params['filter cache dir']:
+        return None
+    return FilterCache(params['filter cache dir'],
+                       int(params['filter cache size'] * (1 << 30)))
+
+
+def channel_keys(params, edf_fn, labels, fs, *extra):
+    """
+    Keys of the filtered channels of an EDF file
+
+    inputs:
+        params - configuration holding the FILTER_PARAMS settings
+        edf_fn - name of the .edf file
+        labels - channel labels
+        fs - sample rate of the filtered channels
+        extra - any other settings the result depends on
+
+    returns:
+        list with the key of each channel
+    """
+    source = source_key(edf_fn)
+    settings = tuple(params[key] for key in FILTER_PARAMS)
+    return [make_key(source, label, fs, settings, extra) for label in labels]
+
+
+def env_cache():
+    """The FilterCache in the directory named by the JHU_EEG_FILTER_CACHE
+    environment variable, limited to JHU_EEG_FILTER_CACHE_GB (1 by
+    default), or None if it is not set
+    """
+    cache_dir = os.environ.get('JHU_EEG_FILTER_CACHE')
+    if not cache_dir:
+        return None
+    size = float(os.environ.get('JHU_EEG_FILTER_CACHE_GB', 1))
+    return FilterCache(cache_dir, int(size * (1 << 30)))
+
+
+# Cache of the viewer, off unless JHU_EEG_FILTER_CACHE is set
+default_cache = env_cache()
@@ -0,0 +1,232 @@
+""" Linear-phase FIR filtering by FFT overlap-save convolution
+
+FIR filters give steep band edges with no phase distortion, at the cost of
+hundreds to thousands of taps. Direct convolution with that many taps is
+slow, so the filters here are applied with overlap-save: the signal is cut
+into overlapping segments, and each segment is filtered by multiplying its
+FFT with the filter's. Segments of every channel are transformed together
+in batches, and the filter's spectrum is computed once per FFT length.
+
+Filtering is zero phase: the output is aligned with the input by dropping
+the filter's group delay of (numtaps - 1) / 2 samples. The ends of the
+signal are extended by odd reflection, as filtfilt does.
+"""
+from functools import lru_cache, partial
+
+import numpy as np
+import scipy.signal
+from numpy.lib.stride_tricks import as_strided
+from scipy.fftpack import next_fast_len
+
+from preprocessing.edf_reader import read_block
+from preprocessing.parallel import map_rows
+
+METHODS = ('firwin', 'remez')
+# Number of samples transformed per batch of segments
+_BATCH_SAMPLES = 1 << 22
+
+
+@lru_cache(maxsize=None)
+def design_fir(fs, lpf_fc=0, hpf_fc=0, notch_fc=0, transition=1.0,
+               atten=60.0, notch_width=4.0, method='firwin'):
+    """
+    Design a linear-phase filter combining lowpass, highpass and notch
+    bands, once per set of arguments
+
+    The number of taps is set by the transition width and stopband
+    attenuation (Kaiser's formula), so halving the transition width doubles
+    the length of the filter.
+
+    inputs:
+        fs - sampling frequency
+        lpf_fc - lowpass cutoff, 0 for none
+        hpf_fc - highpass cutoff, 0 for none
+        notch_fc - centre of a band-stop, 0 for none
+        transition - width of each transition band in Hz
+        atten - stopband attenuation in dB
+        notch_width - width of the band-stop, measured between the centres
+            of its transition bands
+        method - 'firwin' (Kaiser window) or 'remez' (equiripple)
+
+    returns:
+        h - odd-length array of filter taps, shared between callers, or None
+            if there is nothing to filter
+    """
+    if method not in METHODS:
+        raise ValueError('method must be one of {}'.format(METHODS))
+    nyq = fs / 2
+    cutoffs = []
+    if 0 < hpf_fc < nyq:
+        cutoffs.append(hpf_fc)
+    if 0 < notch_fc < nyq and notch_fc > hpf_fc and \
+            (lpf_fc <= 0 or notch_fc < lpf_fc):
+        cutoffs += [notch_fc - notch_width / 2, notch_fc + notch_width / 2]
+    if 0 < lpf_fc < nyq:
+        cutoffs.append(lpf_fc)
+    if not cutoffs:
+        return None
+    pass_zero = not 0 < hpf_fc < nyq
+
+    numtaps, beta = scipy.signal.kaiserord(atten, transition / nyq)
+    # An odd length gives a type I filter, which can pass nyquist
+    numtaps |= 1
+    if method == 'firwin':
+        return scipy.signal.firwin(numtaps, cutoffs, window=('kaiser', beta),
+                                   pass_zero=pass_zero, fs=fs)
+
+    bands = [0]
+    for cutoff in cutoffs:
+        bands += [cutoff - transition / 2, cutoff + transition / 2]
+    bands.append(nyq)
+    if any(np.diff(bands) <= 0):
+        raise ValueError('Transition bands overlap, use a smaller transition')
+    gains = [float((ii % 2 == 0) == pass_zero)
+             for ii in range(len(bands) // 2)]
+    return scipy.signal.remez(numtaps, bands, gains, fs=fs, maxiter=100)
+
+
+def fft_length(numtaps):
+    """A fast FFT length for overlap-save with numtaps taps, long enough
+    that most of each segment is output
+    """
+    return next_fast_len(max(8 * numtaps, 256))
+
+
+@lru_cache(maxsize=32)
+def _spectrum(taps, nfft):
+    """FFT of the filter taps (given as bytes) at length nfft"""
+    return np.fft.rfft(np.frombuffer(taps), nfft)
+
+
+def overlap_save(x, h, out=None, nfft=None):
+    """
+    Convolve each row of x with h, keeping only the fully overlapped part
+
+    This is np.convolve(row, h, 'valid') for every row, computed with FFTs.
+
+    inputs:
+        x - (channels, samples) array
+        h - filter taps, shorter than the rows of x
+        out - optional (channels, samples - len(h) + 1) array to write into
+        nfft - FFT length, fft_length(len(h)) if None
+
+    returns:
+        out - filtered array, with the dtype of x if it is floating point
+    """
+    x = np.asarray(x)
+    nchns, nsamples = x.shape
+    numtaps = len(h)
+    nout = nsamples - numtaps + 1
+    if out is None:
+        dtype = x.dtype if x.dtype.kind == 'f' else np.float64
+        out = np.empty((nchns, nout), dtype=dtype)
+    if nfft is None:
+        nfft = fft_length(numtaps)
+    step = nfft - numtaps + 1
+    H = _spectrum(np.asarray(h, dtype=np.float64).tobytes(), nfft)
+
+    # Segments that lie entirely within x, transformed in batches
+    nfull = (nsamples - nfft) // step + 1 if nsamples >= nfft else 0
+    batch = max(_BATCH_SAMPLES // (nfft * nchns), 1)
+    for first in range(0, nfull, batch):
+        last = min(first + batch, nfull)
+        segments = as_strided(
+            x[:, first * step:], shape=(nchns, last - first, nfft),
+            strides=(x.strides[0], step * x.strides[1], x.strides[1]),
+            writeable=False)
+        y = np.fft.irfft(np.fft.rfft(segments, axis=-1) * H, nfft, axis=-1)
+        out[:, first * step:last * step] = \
+            y[..., numtaps - 1:].reshape(nchns, -1)
+    # The remaining, shorter segments are zero padded by the FFT
+    for start in range(nfull * step, nout, step):
+        y = np.fft.irfft(np.fft.rfft(x[:, start:start + nfft], nfft,
+                                     axis=-1) * H, nfft, axis=-1)
+        stop = min(start + step, nout)
+        out[:, start:stop] = y[:, numtaps - 1:numtaps - 1 + stop - start]
+    return out
+
+
+def _odd_extension(edge, first, length):
+    """
+    Extend a signal past one end by odd reflection about its end sample
+
+    inputs:
+        edge - (channels, samples) block at the end of the signal
+        first - True to extend before the start of edge, False after its end
+        length - number of samples to add
+
+    returns:
+        (channels, length) extension, padded with its outermost value when
+        the signal is shorter than length
+    """
+    if not first:
+        return _odd_extension(edge[:, ::-1], True, length)[:, ::-1]
+    k = min(length, edge.shape[1] - 1)
+    ext = 2 * edge[:, :1] - edge[:, k:0:-1]
+    if k < length:
+        pad = ext[:, :1] if k > 0 else edge[:, :1]
+        ext = np.concatenate(
+            (np.repeat(pad, length - k, axis=1), ext), axis=1)
+    return ext
+
+
+def iter_fir(bufs, h, block, dtype=np.float32, threads=None):
+    """
+    Zero-phase filter a signal in blocks, yielding (start, stop, filtered)
+
+    Each block is read with (len(h) - 1) / 2 samples of context on either
+    side, so the output is exactly that of filtering the whole signal.
+
+    inputs:
+        bufs - list of channels, or a (channels, samples) array
+        h - odd-length filter taps
+        block - samples per block
+        dtype - dtype of the blocks read from a list of channels
+        threads - number of threads filtering the channels of each block,
+            None for the cap of preprocessing.parallel
+    """
+    half = len(h) // 2
+    nsamples = len(bufs[0])
+    head = read_block(bufs, 0, half + 1, dtype)
+    tail = read_block(bufs, max(nsamples - half - 1, 0), nsamples, dtype)
+    for start in range(0, nsamples, block):
+        stop = min(start + block, nsamples)
+        lo = max(start - half, 0)
+        hi = min(stop + half, nsamples)
+        parts = [read_block(bufs, lo, hi, dtype)]
+        if start - half < 0:
+            parts.insert(0, _odd_extension(head, True, half)[
+                :, start:])
+        if stop + half > nsamples:
+            parts.append(_odd_extension(tail, False, half)[
+                :, :stop + half - nsamples])
+        segment = np.concatenate(parts, axis=1) if len(parts) > 1 \
+            else parts[0]
+        yield start, stop, map_rows(partial(overlap_save, h=h), segment,
+                                    threads)
+
+
+def fir_filter(bufs, h, block=1 << 20, out=None, dtype=np.float32,
+               threads=None):
+    """
+    Zero-phase filter every channel with a linear-phase FIR filter
+
+    inputs:
+        bufs - list of channels, or a (channels, samples) array
+        h - odd-length filter taps, for example from design_fir
+        block - samples per block, which bounds the temporaries
+        out - optional (channels, samples) array to write into
+        dtype - dtype of out when it is not given
+        threads - number of threads, None for the cap of
+            preprocessing.parallel
+
+    returns:
+        out - filtered (channels, samples) array
+    """
+    if len(h) % 2 == 0:
+        raise ValueError('Zero-phase filtering needs an odd number of taps')
+    if out is None:
+        out = np.empty((len(bufs), len(bufs[0])), dtype=dtype)
+    for start, stop, filtered in iter_fir(bufs, h, block, dtype, threads):
+        out[:, start:stop] = filtered
+    return out
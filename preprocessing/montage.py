@@ -0,0 +1,205 @@
+""" Montages as sparse derivation matrices over the loaded channels
+
+A montage derives each output channel as a weighted sum of input channels.
+Bipolar channels are the difference of two electrodes, referential channels
+select one, and common average channels subtract the mean of a set of
+electrodes. Writing every montage as a (outputs, inputs) sparse matrix lets
+any of them be applied to a (channels, samples) chunk with one matrix
+product.
+
+Montage text files list one output channel per line:
+    FP1-F7      bipolar, FP1 minus F7
+    CZ          referential
+    CZ-AVG      CZ minus the average of every input channel
+Blank lines and lines starting with # are ignored.
+"""
+import os
+
+import numpy as np
+import scipy.sparse
+
+# Old and new names of the same 10-20 electrodes
+_ALIASES = {'T3': 'T7', 'T4': 'T8', 'T5': 'P7', 'T6': 'P8'}
+_SUFFIXES = ('-REF', '-LE', '-AR')
+AVERAGE = 'AVG'
+
+LABELS_AR1020 = ['O2', 'O1', 'PZ', 'CZ', 'FZ', 'P8', 'P7', 'T8', 'T7', 'F8',
+                 'F7', 'P4', 'P3', 'C4', 'C3', 'F4', 'F3', 'FP2', 'FP1']
+LABELS_BIP1020 = ['CZ-PZ', 'FZ-CZ', 'P4-O2', 'C4-P4', 'F4-C4', 'FP2-F4',
+                  'P3-O1', 'C3-P3', 'F3-C3', 'FP1-F3', 'P8-O2', 'T8-P8',
+                  'F8-T8', 'FP2-F8', 'P7-O1', 'T7-P7', 'F7-T7', 'FP1-F7']
+LABELS_AR1010 = ['IZ', 'O2', 'O1', 'OZ', 'POZ', 'PZ', 'CPZ', 'CZ', 'FCZ',
+                 'FZ', 'AFZ', 'FPZ', 'P10', 'P9', 'TP10', 'TP9', 'A2', 'A1',
+                 'T10', 'T9', 'FT10', 'FT9', 'F10', 'F9', 'PO8', 'PO7', 'P8',
+                 'P7', 'TP8', 'TP7', 'T8', 'T7', 'FT8', 'FT7', 'F8', 'F7',
+                 'AF8', 'AF7', 'FP2', 'FP1', 'P6', 'P5', 'CP6', 'CP5', 'C6',
+                 'C5', 'FC6', 'FC5', 'F6', 'F5', 'PO4', 'PO3', 'P4', 'P3',
+                 'CP4', 'CP3', 'C4', 'C3', 'FC4', 'FC3', 'F4', 'F3', 'AF4',
+                 'AF3', 'P2', 'P1', 'CP2', 'CP1', 'C2', 'C1', 'FC2', 'FC1',
+                 'F2', 'F1', 'NZ']
+LABELS_BIP1010 = ['F10-T10', 'FP2-F10', 'P8-O2', 'T8-P8', 'F8-T8', 'FP2-F8',
+                  'P4-O2', 'C4-P4', 'F4-C4', 'FP2-F4', 'CZ-PZ', 'FZ-CZ',
+                  'P3-O1', 'C3-P3', 'F3-C3', 'FP1-F3', 'P7-O1', 'T7-P7',
+                  'F7-T7', 'FP1-F7', 'F9-T9', 'FP1-F9']
+
+# Built in montages: (derivations, electrodes averaged for AVG)
+MONTAGES = {
+    'ref1020': (LABELS_AR1020, None),
+    'ref1010': (LABELS_AR1010, None),
+    'car1020': ([label + '-' + AVERAGE for label in LABELS_AR1020],
+                LABELS_AR1020),
+    'car1010': ([label + '-' + AVERAGE for label in LABELS_AR1010],
+                LABELS_AR1010),
+    'bip1020': (LABELS_BIP1020, None),
+    'bip1010': (LABELS_BIP1010, None),
+}
+
+
+def canonical_label(label):
+    """Upper case electrode name without 'EEG ' or reference suffixes, using
+    the 10-10 names of T3/T4/T5/T6
+    """
+    label = label.strip().upper()
+    if label.startswith('EEG '):
+        label = label[4:]
+    for suffix in _SUFFIXES:
+        if label.endswith(suffix):
+            label = label[:-len(suffix)]
+    return _ALIASES.get(label, label)
+
+
+class Montage():
+    """ A montage over a fixed list of input channels
+
+    Attributes:
+        labels - labels of the output channels
+        input_labels - labels of the input channels, in the order of the
+            rows of the data the montage is applied to
+        matrix - (outputs, inputs) scipy.sparse.csr_matrix of weights
+    """
+
+    def __init__(self, labels, input_labels, matrix):
+        self.labels = list(labels)
+        self.input_labels = list(input_labels)
+        self.matrix = scipy.sparse.csr_matrix(matrix)
+        self._matrices = {}
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __repr__(self):
+        coo = self.matrix.tocoo()
+        return 'Montage({}, {}, {})'.format(
+            self.labels, self.input_labels,
+            list(zip(coo.row.tolist(), coo.col.tolist(), coo.data.tolist())))
+
+    def apply(self, x, axis=0):
+        """
+        Derive the montage channels from a chunk of input channels
+
+        inputs:
+            x - array with the input channels along axis, in the order of
+                input_labels
+            axis - channel axis of x, 0 for (channels, samples) and -1 for
+                (samples, channels)
+
+        returns:
+            array of the same layout and floating point dtype as x, with
+            len(self) channels
+        """
+        x = np.asarray(x)
+        if x.dtype.kind != 'f':
+            x = x.astype(np.float64)
+        matrix = self._matrices.get(x.dtype)
+        if matrix is None:
+            matrix = self.matrix.astype(x.dtype)
+            self._matrices[x.dtype] = matrix
+        if axis in (-1, x.ndim - 1) and x.ndim > 1:
+            return np.asarray(matrix.dot(x.T).T)
+        return np.asarray(matrix.dot(x))
+
+
+def derivation_matrix(derivations, input_labels, average=None):
+    """
+    Build the sparse derivation matrix of a list of derivations
+
+    inputs:
+        derivations - output labels, 'A' for referential, 'A-B' for bipolar
+            and 'A-AVG' for A minus the average of the average electrodes
+        input_labels - labels of the input channels
+        average - electrodes averaged for AVG, all inputs if None
+
+    returns:
+        (len(derivations), len(input_labels)) scipy.sparse.csr_matrix
+    """
+    index = {}
+    for chn, label in enumerate(input_labels):
+        index.setdefault(canonical_label(label), chn)
+    if average is None:
+        average_chns = list(range(len(input_labels)))
+    else:
+        average_chns = [index[canonical_label(label)] for label in average
+                        if canonical_label(label) in index]
+
+    rows, cols, weights = [], [], []
+    missing = []
+    for row, derivation in enumerate(derivations):
+        derivation = canonical_label(derivation)
+        terms = [(derivation, 1.0)]
+        if '-' in derivation:
+            first, second = derivation.split('-', 1)
+            terms = [(canonical_label(first), 1.0),
+                     (canonical_label(second), -1.0)]
+        for label, sign in terms:
+            if label == AVERAGE:
+                if not average_chns:
+                    missing.append(AVERAGE)
+                for chn in average_chns:
+                    rows.append(row)
+                    cols.append(chn)
+                    weights.append(sign / len(average_chns))
+            elif label in index:
+                rows.append(row)
+                cols.append(index[label])
+                weights.append(sign)
+            else:
+                missing.append(label)
+    if missing:
+        raise ValueError('Montage channels not in the input: {}'.format(
+            ', '.join(sorted(set(missing)))))
+    # Duplicate entries (such as A-AVG's own channel) are summed
+    return scipy.sparse.csr_matrix(
+        (weights, (rows, cols)),
+        shape=(len(derivations), len(input_labels)))
+
+
+def read_montage_file(fn):
+    """Read the derivations listed in a montage text file"""
+    derivations = []
+    with open(fn, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                derivations.append(line.upper())
+    return derivations
+
+
+def load_montage(name, input_labels):
+    """
+    Build a built in montage or one from a text file
+
+    inputs:
+        name - a key of MONTAGES or the name of a montage text file
+        input_labels - labels of the channels the montage will be applied to
+
+    returns:
+        a Montage
+    """
+    if name in MONTAGES:
+        derivations, average = MONTAGES[name]
+    elif os.path.isfile(name):
+        derivations, average = read_montage_file(name), None
+    else:
+        raise ValueError('Unknown montage: {}'.format(name))
+    matrix = derivation_matrix(derivations, input_labels, average)
+    return Montage(derivations, input_labels, matrix)
@@ -0,0 +1,236 @@
+""" Thread-parallel processing of the channels of a signal
+
+SciPy's filtering and resampling kernels release the GIL, so the channels
+of a recording can be filtered by several threads at once, sharing the
+signal without copies. The rows of a (channels, samples) array are split
+into one group per thread, each group is processed by the same function,
+and the results are put back together in channel order. Every channel is
+processed independently, so the result does not depend on the number of
+threads.
+
+All DSP threads come from one pool whose size is a process-wide cap, set
+by set_max_threads. Calls made from inside a pool thread run serially
+rather than starting more threads. While the pool is busy, BLAS, OpenMP
+and torch threads are limited so that the total stays within the cap, and
+torch's setting is restored once no call is using the pool. A forked
+child process starts its own pool, since the threads of the parent's pool
+do not exist in it.
+"""
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+_lock = threading.Lock()
+_local = threading.local()
+_executor = None
+_executor_pid = None
+_max_threads = None
+# Number of calls limiting inner threads, the threadpoolctl limits of the
+# first, and torch's setting before them
+_inner_users = 0
+_limiter = None
+_torch_threads = None
+
+
+def _after_fork():
+    # A lock held by another thread of the parent is never released in the
+    # child, so start with a new one. The calls of the parent that limit
+    # inner threads do not run in the child, so undo their limits.
+    global _lock, _executor, _executor_pid, _inner_users
+    _lock = threading.Lock()
+    _executor = None
+    _executor_pid = None
+    if _inner_users > 0:
+        _inner_users = 0
+        _restore_inner_threads()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def cpu_count():
+    """Number of cores this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def set_max_threads(n):
+    """Set the process-wide cap on DSP threads, 0 or None for every core"""
+    global _executor, _max_threads
+    with _lock:
+        n = int(n) if n else None
+        if n == _max_threads:
+            return
+        _max_threads = n
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+def get_max_threads():
+    """The cap on DSP threads"""
+    return _max_threads or cpu_count()
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _lock:
+        # The pool of a parent process has no threads in a forked child
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=get_max_threads(), thread_name_prefix='dsp',
+                initializer=_mark_worker)
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _mark_worker():
+    _local.in_worker = True
+
+
+def num_threads(threads=None, nrows=None):
+    """
+    Number of threads to use for a call
+
+    inputs:
+        threads - requested number of threads, None for the cap
+        nrows - number of rows to split between the threads
+
+    returns:
+        number of threads, 1 inside a DSP thread, never more than the cap
+        or the number of rows
+    """
+    if getattr(_local, 'in_worker', False):
+        return 1
+    n = get_max_threads() if threads is None else min(threads,
+                                                      get_max_threads())
+    if nrows is not None:
+        n = min(n, nrows)
+    return max(n, 1)
+
+
+@contextmanager
+def limit_inner_threads(nthreads):
+    """Limit BLAS, OpenMP and torch threads while nthreads DSP threads run,
+    so that together they use at most the cap
+
+    The limits are process-wide, so overlapping calls share them: each call
+    lowers them to its own limit, the first saves the settings before any
+    limit and the last to exit restores them.
+    """
+    global _inner_users, _torch_threads, _limiter
+    inner = max(get_max_threads() // nthreads, 1)
+    # Only adjust torch if it is already loaded, it is slow to import
+    torch = sys.modules.get('torch')
+    with _lock:
+        if torch is not None:
+            if _torch_threads is None:
+                _torch_threads = torch.get_num_threads()
+            if torch.get_num_threads() > inner:
+                torch.set_num_threads(inner)
+        if threadpool_limits is not None:
+            limiter = threadpool_limits(limits=inner)
+            if _limiter is None:
+                _limiter = limiter
+        _inner_users += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _inner_users -= 1
+            if _inner_users == 0:
+                _restore_inner_threads()
+
+
+def _restore_inner_threads():
+    """Restore the settings saved by the first of limit_inner_threads"""
+    global _limiter, _torch_threads
+    if _limiter is not None:
+        _limiter.__exit__(None, None, None)
+        _limiter = None
+    torch = sys.modules.get('torch')
+    if torch is not None and _torch_threads is not None:
+        torch.set_num_threads(_torch_threads)
+    _torch_threads = None
+
+
+def row_groups(nrows, ngroups):
+    """Split range(nrows) into ngroups contiguous slices of near equal size
+    """
+    bounds = np.linspace(0, nrows, ngroups + 1).round().astype(int)
+    return [slice(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])
+            if hi > lo]
+
+
+def imap_rows(func, rows, threads=None):
+    """
+    Apply a function to each row of a signal, yielding results in order
+
+    inputs:
+        func - function of a single row
+        rows - (channels, samples) array or list of channels
+        threads - number of threads, None for the cap
+
+    yields:
+        func(row) for every row, in the order of rows, each as soon as it
+        and the rows before it are done
+    """
+    n = num_threads(threads, len(rows))
+    if n == 1:
+        for row in rows:
+            yield func(row)
+        return
+    executor = _get_executor()
+    with limit_inner_threads(n):
+        futures = [executor.submit(func, row) for row in rows]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            # Stop the rows that have not started when the caller stops
+            for future in futures:
+                future.cancel()
+
+
+def map_rows(func, x, threads=None, out=None):
+    """
+    Apply a function to groups of rows of a signal in parallel
+
+    inputs:
+        func - function from a (rows, samples) array, or a list of
+            channels, to a (rows, ...) array of results for those rows
+        x - (channels, samples) array or list of channels
+        threads - number of threads, None for the cap
+        out - optional array to write the results into
+
+    returns:
+        (channels, ...) array of the results, in the order of x
+    """
+    n = num_threads(threads, len(x))
+    if n == 1:
+        if out is None:
+            return func(x)
+        out[...] = func(x)
+        return out
+    groups = row_groups(len(x), n)
+    executor = _get_executor()
+    with limit_inner_threads(n):
+        futures = [executor.submit(func, x[group]) for group in groups]
+        for group, future in zip(groups, futures):
+            result = np.asarray(future.result())
+            if out is None:
+                out = np.empty((len(x),) + result.shape[1:],
+                               dtype=result.dtype)
+            out[group] = result
+    return out
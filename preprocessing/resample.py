@@ -0,0 +1,148 @@
+""" Rational-rate resampling of multichannel signals """
+from fractions import Fraction
+from functools import lru_cache, partial
+
+import numpy as np
+from scipy.signal import firwin, resample_poly
+
+from preprocessing.parallel import map_rows
+
+
+def resample_ratio(fs_in, fs_out):
+    """
+    Find the up and down factors that take fs_in to fs_out
+
+    inputs:
+        fs_in - source sample rate
+        fs_out - target sample rate
+
+    returns:
+        up, down - coprime integers with fs_out / fs_in == up / down
+    """
+    ratio = (Fraction(fs_out).limit_denominator(1000)
+             / Fraction(fs_in).limit_denominator(1000))
+    return ratio.numerator, ratio.denominator
+
+
+@lru_cache(maxsize=None)
+def polyphase_filter(up, down):
+    """
+    Design the anti-aliasing filter used by resample_poly for a ratio
+
+    The design is the same as resample_poly's default (a Kaiser window with
+    beta 5.0), but is only computed once per (up, down) pair.
+
+    returns:
+        h - read-only FIR filter taps, not yet scaled by up
+    """
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    h = firwin(2 * half_len + 1, 1. / max_rate, window=('kaiser', 5.0))
+    h.flags.writeable = False
+    return h
+
+
+def _window(up, down, dtype):
+    """The filter taps in the precision of the signal, so that float32
+    signals are filtered in float32 rather than promoted to float64
+    """
+    h = polyphase_filter(up, down)
+    if dtype == np.float32:
+        h = h.astype(np.float32)
+    return h
+
+
+def resample(x, fs_in, fs_out, axis=-1, threads=None):
+    """
+    Resample signals from fs_in to fs_out
+
+    inputs:
+        x - array of signals, or a list of equal length channels
+        fs_in - source sample rate
+        fs_out - target sample rate
+        axis - time axis of x, the last axis by default so that a
+            (channels, samples) array is processed in one call
+        threads - number of threads resampling the rows of x when axis is
+            not 0, None for the cap of preprocessing.parallel
+
+    returns:
+        y - resampled array with the same layout as x, float32 if x is
+    """
+    x = np.asarray(x)
+    up, down = resample_ratio(fs_in, fs_out)
+    if up == down:
+        return x.copy()
+    resample_rows = partial(resample_poly, up=up, down=down, axis=axis,
+                            window=_window(up, down, x.dtype))
+    if x.ndim > 1 and axis % x.ndim != 0:
+        return map_rows(resample_rows, x, threads)
+    return resample_rows(x)
+
+
+class StreamingResampler():
+    """ Resample (channels, samples) chunks of a signal as they arrive
+
+    The concatenated output of process() for every chunk followed by
+    flush() equals resample() of the whole signal. Enough past input is
+    kept between calls to filter across chunk boundaries, and an output
+    sample is only returned once all of the input it depends on has
+    arrived.
+    """
+
+    def __init__(self, fs_in, fs_out):
+        self.up, self.down = resample_ratio(fs_in, fs_out)
+        self.half_len = 10 * max(self.up, self.down)
+        # Input sample index of the start of the buffer, always a multiple
+        # of down so that the buffer's outputs line up with the full signal
+        self._start = 0
+        self._buffer = None
+        self._received = 0
+        self._emitted = 0
+
+    def _resample_buffer(self):
+        if self.up == self.down:
+            return self._buffer.copy()
+        return resample_poly(self._buffer, self.up, self.down, axis=-1,
+                             window=_window(self.up, self.down,
+                                            self._buffer.dtype))
+
+    def process(self, chunk):
+        """
+        Add a chunk of input and return the output that is now complete
+
+        inputs:
+            chunk - (channels, samples) array of the next input samples
+
+        returns:
+            (channels, samples) array of the next output samples
+        """
+        chunk = np.asarray(chunk)
+        if self._buffer is None:
+            self._buffer = chunk.copy()
+        else:
+            self._buffer = np.concatenate((self._buffer, chunk), axis=-1)
+        self._received += chunk.shape[-1]
+
+        # Outputs whose filter support lies within the received input
+        ready = ((self._received - 1) * self.up - self.half_len) // self.down
+        ready = max(ready, self._emitted)
+        first = self._emitted - self._start * self.up // self.down
+        out = self._resample_buffer()[..., first:first + ready - self._emitted]
+        self._emitted = ready
+
+        # Drop input that no future output depends on
+        needed = (self._emitted * self.down - self.half_len) // self.up - 1
+        start = max(needed // self.down * self.down, self._start)
+        self._buffer = self._buffer[..., start - self._start:]
+        self._start = start
+        return out
+
+    def flush(self):
+        """Return the remaining output at the end of the signal"""
+        if self._buffer is None:
+            return np.zeros((0, 0))
+        first = self._emitted - self._start * self.up // self.down
+        out = self._resample_buffer()[..., first:]
+        self._emitted += out.shape[-1]
+        self._buffer = self._buffer[..., :0]
+        return out
@@ -0,0 +1,50 @@
+""" Per-channel statistics accumulated one chunk of samples at a time """
+import numpy as np
+
+
+class RunningStats():
+    """ Streaming per-channel mean and variance
+
+    The mean and variance are updated with Welford's method, merging the
+    statistics of each chunk (Chan et al.), which is numerically stable in a
+    single pass.
+    """
+
+    def __init__(self, nchns):
+        """
+        inputs:
+            nchns - number of channels
+        """
+        self.nchns = nchns
+        self.count = 0
+        self._mean = np.zeros(nchns)
+        self._m2 = np.zeros(nchns)
+
+    def update(self, chunk):
+        """Add a (channels, samples) chunk to the statistics"""
+        chunk = np.asarray(chunk)
+        n = chunk.shape[-1]
+        if n == 0:
+            return
+        chunk_mean = np.mean(chunk, axis=-1, dtype=np.float64)
+        chunk_m2 = np.sum((chunk - chunk_mean[:, np.newaxis]) ** 2, axis=-1,
+                          dtype=np.float64)
+        total = self.count + n
+        delta = chunk_mean - self._mean
+        self._mean += delta * n / total
+        self._m2 += chunk_m2 + delta ** 2 * self.count * n / total
+        self.count = total
+
+    @property
+    def mean(self):
+        return self._mean.copy()
+
+    @property
+    def var(self):
+        if self.count == 0:
+            return np.zeros(self.nchns)
+        return self._m2 / self.count
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
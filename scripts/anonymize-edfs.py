@@ -0,0 +1,64 @@
+import argparse
+import glob
+import os
+import time
+from functools import partial
+from multiprocessing import Pool
+
+from preprocessing.edf_anonymize import DEFAULT_FIELDS, anonymize_edf
+
+
+def anonymize(edf_fn, out_dir, fields):
+    """Anonymize one file, returning an error message if it fails
+    """
+    fn_out = None
+    if out_dir is not None:
+        fn_out = os.path.join(out_dir, os.path.basename(edf_fn))
+    try:
+        anonymize_edf(edf_fn, fn_out, fields)
+    except (OSError, ValueError) as e:
+        return edf_fn, str(e)
+    return edf_fn, None
+
+
+def main():
+    """Load the command line args and parse"""
+    parser = argparse.ArgumentParser(
+        description='Anonymize the headers of every EDF in a folder')
+    parser.add_argument('edf_dir')
+    parser.add_argument('--out_dir', default=None,
+                        help='Write anonymized copies to this folder')
+    parser.add_argument('--in_place', action='store_true',
+                        help='Patch the files in edf_dir instead of copying')
+    parser.add_argument('--workers', type=int, default=None)
+    for name, value in DEFAULT_FIELDS.items():
+        parser.add_argument('--' + name, default=value,
+                            help='New value (default: {})'.format(value))
+    args = parser.parse_args()
+
+    if (args.out_dir is None) == (not args.in_place):
+        parser.error('give exactly one of --out_dir and --in_place')
+    if args.out_dir is not None:
+        os.makedirs(args.out_dir, exist_ok=True)
+    fields = {name: getattr(args, name) for name in DEFAULT_FIELDS}
+
+    edf_fns = sorted(glob.glob(os.path.join(args.edf_dir, '*.edf')))
+    start = time.time()
+    nbytes = 0
+    failed = 0
+    with Pool(args.workers) as pool:
+        for edf_fn, error in pool.imap_unordered(
+                partial(anonymize, out_dir=args.out_dir, fields=fields),
+                edf_fns, chunksize=4):
+            if error is not None:
+                print('{}: {}'.format(edf_fn, error))
+                failed += 1
+            else:
+                nbytes += os.path.getsize(edf_fn)
+    elapsed = time.time() - start
+    print('Anonymized {} of {} files ({:.1f} MB) in {:.1f} s'.format(
+        len(edf_fns) - failed, len(edf_fns), nbytes / 1e6, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,44 +1,41 @@
+import argparse
 import os
 import sys
 
-import torch
-
-import preprocessing.dsp as dsp
 import utils.pathmanager as pm
 import utils.read_files as read
 import utils.testconfiguration as tc
-from preprocessing.edf_loader import EdfLoader
-from preprocessing.eeg_info import EegInfo
+from preprocessing.edf_catalog import EdfCatalog
 
 
 def main():
     """Load the command line args and parse"""
+    # Split off the catalog options before reading the configuration
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--catalog', default='edf_catalog.sqlite')
+    parser.add_argument('--workers', type=int, default=None)
+    args, argv = parser.parse_known_args(sys.argv[1:])
+
     # Load the configuration files
-    argv = sys.argv[1:]
     params = tc.TestConfiguration('default.ini', argv)
     paths = pm.PathManager(params)
     paths.initialize_folder('buffers')
 
-    # Initialize the loader
-    loader = EdfLoader()
-
     # Load the manifest files
     manifest_files = read.read_manifest(params['train manifest'])
-
-    # Load the edf file
-    edf_fn = os.path.join(paths['raw data'], manifest_files[0]['fn'])
-    print(edf_fn)
-    eeg_info = loader.load_metadata(edf_fn)
-    label_lists = [eeg_info.label_list]
-    label_set = set(eeg_info.label_list)
-
-    for eeg in manifest_files[1:]:
-        # Load the edf file
-        edf_fn = os.path.join(paths['raw data'], eeg['fn'])
-        print(edf_fn)
-        eeg_info = loader.load_metadata(edf_fn)
-        label_lists.append(eeg_info.label_list)
-        label_set = label_set & set(eeg_info.label_list)
+    edf_fns = [os.path.join(paths['raw data'], eeg['fn'])
+               for eeg in manifest_files]
+
+    # Read the headers of any files missing from the catalog
+    catalog = EdfCatalog(args.catalog)
+    _, failed = catalog.update(edf_fns, workers=args.workers)
+    for edf_fn in sorted(failed):
+        print('Could not read {}'.format(edf_fn))
+
+    label_set = catalog.channel_intersection(
+        [edf_fn for edf_fn in edf_fns
+         if os.path.abspath(edf_fn) not in failed])
+    catalog.close()
 
     print(len(label_set))
     print(label_set)
@@ -3,10 +3,11 @@ import sys
 
 import torch
 
-import preprocessing.features as features
 import utils.pathmanager as pm
 import utils.read_files as read
 import utils.testconfiguration as tc
+from preprocessing.feature_graph import FeatureGraph
+from preprocessing.feature_pool import FeaturePool
 from utils.dataset import EpilepsyDataset
 
 
@@ -28,22 +29,40 @@ def main():
     )
     train_dataset.set_as_sequences(True)
 
+    # Load the manifest files
+    manifest_files = read.read_manifest(params['train manifest'])
+    fs = int(manifest_files[0]['fs'])
+
+    # Features listed in 'feature workers' are split between processes, the
+    # rest are computed together, sharing their intermediate results
+    pools = {}
+    graph_feats = []
     for feat_name in params['features']:
         print("Extracting {}".format(feat_name))
         paths.add_feature_folder(feat_name)
+        workers = params['feature workers'].get(feat_name, 1)
+        if workers == 1:
+            graph_feats.append(feat_name)
+        else:
+            pools[feat_name] = FeaturePool(
+                workers, params['feature chunk windows'].get(feat_name, 64))
+    graph = FeatureGraph(graph_feats)
 
-        # Load the manifest files
-        manifest_files = read.read_manifest(params['train manifest'])
-        fs = int(manifest_files[0]['fs'])
-
-        # Loop over files and create windowed versions
+    try:
+        # Loop over files once, windowing each for every feature
         for sample in train_dataset:
             fn = sample['filename'].split('/')[-1].split('.')[0] + '.pt'
             windowed_buffers = sample['buffers']
-            feat = eval('features.'
-                        + feat_name + '(windowed_buffers, fs=fs)')
-            feat_fn = os.path.join(paths[feat_name], fn)
-            torch.save(feat, feat_fn)
+            feats = graph.compute(windowed_buffers, fs=fs)
+            for feat_name, pool in pools.items():
+                feats[feat_name] = pool.extract(feat_name, windowed_buffers,
+                                                fs=fs)
+            for feat_name, feat in feats.items():
+                feat_fn = os.path.join(paths[feat_name], fn)
+                torch.save(feat, feat_fn)
+    finally:
+        for pool in pools.values():
+            pool.close()
 
 
 if __name__ == '__main__':
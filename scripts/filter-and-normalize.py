@@ -1,45 +1,211 @@
+import argparse
+import hashlib
+import json
 import os
 import sys
+import time
+from functools import partial
+from multiprocessing import Pool
+import numpy as np
 sys.path.append("..")
 from preprocessing.eeg_info import EegInfo
 from preprocessing.edf_loader import EdfLoader
+from preprocessing.edf_pool import EdfHandlePool
 import utils.testconfiguration as tc
 import utils.read_files as read
 import utils.pathmanager as pm
 import preprocessing.dsp as dsp
+import preprocessing.parallel as parallel
+from preprocessing.buffer_store import STORE_EXT, BufferStoreWriter
+from preprocessing.filter_cache import cached_rows, channel_keys, config_cache
+from preprocessing.montage import load_montage
 import torch
 
+# Parameters that change the contents of the output buffers
+HASHED_PARAMS = ['notch', 'lpf fc', 'hpf fc', 'filter method',
+                 'fir transition', 'montage', 'clip level', 'normalize',
+                 'sample dtype', 'buffer format', 'buffer dtype',
+                 'buffer compression', 'buffer chunk seconds']
+# Parameters passed to the workers that do not change the outputs
+WORKER_PARAMS = ['filter cache dir', 'filter cache size']
+PARAMS_EXT = '.params'
+
+
+def params_hash(params, label_list, montage=None):
+    """Hash of the preprocessing parameters, the channel list and the
+    montage's derivations, which can change with its text file
+    """
+    settings = {key: params[key] for key in HASHED_PARAMS}
+    settings['channel list'] = list(label_list)
+    settings['montage derivations'] = repr(montage)
+    raw = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def output_fn(edf_fn, buffers_dir, chunked):
+    """Name of the buffers written for an edf file"""
+    fn_out = edf_fn.split('/')[-1].split('.')[0]
+    fn_out += STORE_EXT if chunked else '.pt'
+    return os.path.join(buffers_dir, fn_out)
+
+
+def is_fresh(edf_fn, fn_out, digest):
+    """Check if fn_out is newer than edf_fn and made with the same params"""
+    try:
+        if os.path.getmtime(fn_out) < os.path.getmtime(edf_fn):
+            return False
+        with open(fn_out + PARAMS_EXT, 'r') as f:
+            return f.read().strip() == digest
+    except OSError:
+        return False
+
+
+def process_file(edf_fn, fn_out, params, label_list, digest, montage=None):
+    """
+    Filter and normalize one edf file and save its buffers, re-referenced
+    to montage if it is given
+
+    The buffers are written to a temporary file that is renamed to fn_out
+    once complete, so an interrupted run never leaves a partial output that
+    looks fresh. The parameter hash is written next to the output last.
+
+    returns:
+        edf_fn, duration of the recording in seconds, error message or None
+    """
+    chunked = params['buffer format'] == 'chunked'
+    # Chunked stores are written out of core from lazily read signals
+    # Keep the file open from loading its metadata until it is done
+    pool = EdfHandlePool(max_open=1)
+    loader = EdfLoader(label_list, backend='memmap' if chunked else 'pyedflib',
+                       pool=pool)
+    tmp_fn = fn_out + '.tmp'
+    try:
+        eeg_info = loader.load_metadata(edf_fn)
+
+        if chunked:
+            buffers = loader.load_buffers(eeg_info)
+            compression = params['buffer compression']
+            labels = label_list if montage is None else montage.labels
+            with BufferStoreWriter(
+                    tmp_fn, eeg_info.fs, len(labels),
+                    chunk_seconds=params['buffer chunk seconds'],
+                    dtype=params['buffer dtype'],
+                    compression=(None if compression == 'none'
+                                 else compression),
+                    labels=labels) as writer:
+                for block in dsp.iter_prefilter(
+                        buffers, eeg_info.fs, params['notch'],
+                        params['lpf fc'], params['hpf fc'],
+                        params['clip level'], params['normalize'],
+                        dtype=params['sample dtype'],
+                        method=params['filter method'],
+                        transition=params['fir transition'],
+                        montage=montage):
+                    writer.write(block.T)
+        else:
+            def filter_channels(rows):
+                bufs = loader.load_array(
+                    eeg_info, channels=[label_list[row] for row in rows],
+                    dtype=params['sample dtype'])
+                return dsp.prefilter(bufs, eeg_info.fs, params['notch'],
+                                     params['lpf fc'], params['hpf fc'], 0,
+                                     dtype=params['sample dtype'],
+                                     method=params['filter method'],
+                                     transition=params['fir transition'])
+
+            # Only channels missing from the filter cache are filtered
+            buffers = cached_rows(
+                config_cache(params),
+                channel_keys(params, edf_fn, label_list, eeg_info.fs),
+                filter_channels)
+            buffers = dsp.prefilter(buffers, eeg_info.fs,
+                                    clip_level=params['clip level'],
+                                    standardize=params['normalize'],
+                                    dtype=params['sample dtype'],
+                                    montage=montage)
+            # Wrap the filtered array without copying it
+            buffers = torch.from_numpy(
+                buffers.astype(np.float32, copy=False)).transpose(0, 1)
+            with open(tmp_fn, 'wb') as f:
+                torch.save(buffers, f)
+        os.replace(tmp_fn, fn_out)
+        with open(fn_out + PARAMS_EXT, 'w') as f:
+            f.write(digest)
+    except Exception as e:
+        if os.path.exists(tmp_fn):
+            os.remove(tmp_fn)
+        return edf_fn, 0, '{}: {}'.format(type(e).__name__, e)
+    finally:
+        pool.close()
+    return edf_fn, eeg_info.file_duration, None
+
+
+def _process_job(job, params, label_list, digest, montage):
+    return process_file(job[0], job[1], params, label_list, digest, montage)
+
+
 def main():
     """Load the command line args and parse"""
+    # Split off the batch options before reading the configuration
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of processes, all cores by default')
+    parser.add_argument('--force', action='store_true',
+                        help='Reprocess files whose output is up to date')
+    args, argv = parser.parse_known_args(sys.argv[1:])
+
     # Load the configuration files
-    argv = sys.argv[1:]
     params = tc.TestConfiguration('default.ini', argv)
     paths = pm.PathManager(params)
     paths.initialize_folder('buffers')
 
     # Read in the channel list
     label_list = read.read_channel_list(params['channel list'])
-    loader = EdfLoader(label_list)
+    chunked = params['buffer format'] == 'chunked'
+    montage = None
+    if params['montage'] != 'none':
+        montage = load_montage(params['montage'], label_list)
+    digest = params_hash(params, label_list, montage)
+    worker_params = {key: params[key]
+                     for key in HASHED_PARAMS + WORKER_PARAMS}
 
-    # Load the manifest files
+    # Load the manifest files and find the outputs that are out of date
     manifest_files = read.read_manifest(params['train manifest'])
-
+    jobs = []
     for file in manifest_files:
-        # Load the edf file
         edf_fn = os.path.join(paths['raw data'], file['fn'])
-        print(edf_fn)
-        eeg_info = loader.load_metadata(edf_fn)
-        buffers = loader.load_buffers(eeg_info)
-        print(eeg_info.fs)
-        buffers = dsp.prefilter(buffers, eeg_info.fs,
-                                params['notch'], params['lpf fc'],
-                                params['hpf fc'], params['clip level'],
-                                params['normalize'])
-        buffers = torch.tensor(buffers, dtype=torch.float32).transpose(0, 1)
-
-        fn_out = edf_fn.split('/')[-1].split('.')[0] + '.pt'
-        fn_out = os.path.join(paths['buffers'], fn_out)
-        torch.save(buffers, fn_out)
+        fn_out = output_fn(edf_fn, paths['buffers'], chunked)
+        if args.force or not is_fresh(edf_fn, fn_out, digest):
+            jobs.append((edf_fn, fn_out))
+    skipped = len(manifest_files) - len(jobs)
+
+    start = time.time()
+    duration = 0
+    failed = 0
+    if jobs:
+        workers = min(args.workers or os.cpu_count(), len(jobs))
+        # Each process gets its share of the DSP threads
+        threads = params['dsp threads'] or max(
+            parallel.cpu_count() // workers, 1)
+        with Pool(workers, initializer=parallel.set_max_threads,
+                  initargs=(threads,)) as pool:
+            for edf_fn, file_duration, error in pool.imap_unordered(
+                    partial(_process_job, params=worker_params,
+                            label_list=label_list, digest=digest,
+                            montage=montage), jobs):
+                if error is not None:
+                    print('{}: {}'.format(edf_fn, error))
+                    failed += 1
+                else:
+                    print(edf_fn)
+                    duration += file_duration
+    elapsed = time.time() - start
+
+    hours = duration / 3600
+    print('Processed {} files, skipped {} up to date, {} failed'.format(
+        len(jobs) - failed, skipped, failed))
+    print('{:.2f} recording-hours in {:.1f} s ({:.3f} hours/s)'.format(
+        hours, elapsed, hours / elapsed if elapsed > 0 else 0))
 
 
 if __name__ == '__main__':
@@ -1,7 +1,7 @@
 import glob
 import os
 import argparse
-from preprocessing.edf_loader import EdfLoader
+from preprocessing.edf_catalog import EdfCatalog
 
 
 def main():
@@ -9,18 +9,27 @@ def main():
     parser = argparse.ArgumentParser(
         description='Get metadata for a set of EDFs')
     parser.add_argument('EDFfolder', help='Folder containing EDF files')
+    parser.add_argument('--catalog', default='edf_catalog.sqlite',
+                        help='SQLite file caching the EDF headers')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Processes used to read new headers')
     args = vars(parser.parse_args())
     EDFfolder = args['EDFfolder']
 
     EDFfiles = glob.glob(os.path.join(EDFfolder, '*.edf'))
     EDFfiles.sort()
 
-    loader = EdfLoader()
+    # Only new or changed files have their headers read
+    catalog = EdfCatalog(args['catalog'])
+    _, failed = catalog.update(EDFfiles, workers=args['workers'])
+
     header = 'fn;fs;duration;nsamples;nchns;nsz;sz_starts;sz_ends;pt_num;onset_zone'
     print(header)
     for edffile in EDFfiles:
+        if os.path.abspath(edffile) in failed:
+            continue
         fn = edffile.split('/')[-1]
-        eeg_info = loader.load_metadata(edffile)
+        eeg_info = catalog.load_metadata(edffile)
         str = '{};{};{};{};{};0;[];[];-1;-1'.format(
             fn,
             eeg_info.fs,
@@ -29,6 +38,7 @@ def main():
             eeg_info.nchns
         )
         print(str)
+    catalog.close()
 
 
 if __name__ == '__main__':
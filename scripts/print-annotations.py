@@ -1,46 +1,65 @@
+import argparse
+import glob
 import os
 import sys
+from multiprocessing import Pool
 
-import torch
-
-import preprocessing.dsp as dsp
 import utils.pathmanager as pm
 import utils.read_files as read
 import utils.testconfiguration as tc
-from preprocessing.edf_loader import EdfLoader
-from preprocessing.eeg_info import EegInfo
+from preprocessing.edf_reader import read_annotations
 
 DONT_WRITE = ["Segment", "A1+A2 OFF", "+", "Schedule"]
 
 
+def load_annotations(edf_fn):
+    """Read the annotations of one file, returning None if it is unreadable
+    """
+    try:
+        onsets, _, descriptions = read_annotations(edf_fn)
+    except (OSError, ValueError):
+        return edf_fn, None
+    return edf_fn, list(zip(onsets, descriptions))
+
+
 def main():
     """Load the command line args and parse"""
-    # Load the configuration files
-    argv = sys.argv[1:]
-    params = tc.TestConfiguration('default.ini', argv)
-    paths = pm.PathManager(params)
-
-    # Read in the connections and make a label list
-    label_list = read.read_channel_list(params['channel list'])
-    loader = EdfLoader(label_list)
-
-    # Load the manifest files
-    manifest_files = read.read_manifest(params['train manifest'])
-
-    for file in manifest_files:
-        # Load the edf file
-        edf_fn = os.path.join(paths['raw data'], file['fn'])
-        print(edf_fn)
-        eeg_info = loader.load_metadata(edf_fn)
-        for time, annotation in zip(eeg_info.annotations[0],
-                                    eeg_info.annotations[2]):
-            printable = True
-            for word in DONT_WRITE:
-                if annotation.startswith(word):
-                    printable = False
-            if printable:
-                print("{0:<7}{1:<50}".format(time, annotation))
-        print('')
+    # Split off the options of this script before reading the configuration
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--edf_dir', default=None,
+                        help='Print every EDF in this folder instead of '
+                             'the train manifest')
+    parser.add_argument('--workers', type=int, default=None)
+    args, argv = parser.parse_known_args(sys.argv[1:])
+
+    if args.edf_dir is not None:
+        edf_fns = sorted(glob.glob(os.path.join(args.edf_dir, '*.edf')))
+    else:
+        # Load the configuration files
+        params = tc.TestConfiguration('default.ini', argv)
+        paths = pm.PathManager(params)
+
+        # Load the manifest files
+        manifest_files = read.read_manifest(params['train manifest'])
+        edf_fns = [os.path.join(paths['raw data'], file['fn'])
+                   for file in manifest_files]
+
+    # Results are streamed out in order as the workers finish them
+    with Pool(args.workers) as pool:
+        for edf_fn, annotations in pool.imap(load_annotations, edf_fns,
+                                              chunksize=4):
+            print(edf_fn)
+            if annotations is None:
+                print('Could not read annotations')
+                annotations = []
+            for time, annotation in annotations:
+                printable = True
+                for word in DONT_WRITE:
+                    if annotation.startswith(word):
+                        printable = False
+                if printable:
+                    print("{0:<7}{1:<50}".format(time, annotation))
+            print('', flush=True)
 
 
 if __name__ == '__main__':
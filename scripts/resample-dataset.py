@@ -1,28 +1,42 @@
+import argparse
 import os
 import sys
 
+import numpy as np
 import torch
 
 import preprocessing.dsp as dsp
+import preprocessing.parallel as parallel
 import utils.pathmanager as pm
 import utils.read_files as read
 import utils.testconfiguration as tc
 from preprocessing.edf_loader import EdfLoader
+from preprocessing.edf_pool import EdfHandlePool
 from preprocessing.eeg_info import EegInfo
+from preprocessing.filter_cache import cached_rows, channel_keys, config_cache
+from preprocessing.resample import resample
 
 
 def main():
     """Load the command line args and parse"""
     # Load the configuration files
-    argv = sys.argv[1:]
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fs', type=float, default=200,
+                        help='target sample rate')
+    args, argv = parser.parse_known_args(sys.argv[1:])
+    fs_out = int(args.fs) if args.fs.is_integer() else args.fs
     params = tc.TestConfiguration('default.ini', argv)
     paths = pm.PathManager(params)
-    paths['buffers'] = paths['buffers'] + '_200'
+    paths['buffers'] = paths['buffers'] + '_' + str(fs_out)
     paths.initialize_folder('buffers')
 
     # Read in the channel list
     label_list = read.read_channel_list(params['channel list'])
-    loader = EdfLoader(label_list)
+    # Keep each file open from loading its metadata until it is resampled
+    pool = EdfHandlePool(max_open=1)
+    loader = EdfLoader(label_list, pool=pool)
+    cache = config_cache(params)
+    parallel.set_max_threads(params['dsp threads'])
 
     # Load the manifest files
     manifest_files = read.read_manifest(params['train manifest'])
@@ -32,20 +46,39 @@ def main():
         edf_fn = os.path.join(paths['raw data'], file['fn'])
         print(edf_fn)
         eeg_info = loader.load_metadata(edf_fn)
-        buffers = loader.load_buffers(eeg_info)
         print(eeg_info.fs)
-        buffers = dsp.resample_256to200(buffers)
-        eeg_info.fs = 200
+
+        def resample_and_filter(rows):
+            bufs = loader.load_array(
+                eeg_info, channels=[label_list[row] for row in rows],
+                dtype=params['sample dtype'])
+            bufs = resample(bufs, eeg_info.fs, fs_out)
+            return dsp.prefilter(bufs, fs_out, params['notch'],
+                                 params['lpf fc'], params['hpf fc'], 0,
+                                 dtype=params['sample dtype'],
+                                 method=params['filter method'],
+                                 transition=params['fir transition'])
+
+        # Only channels missing from the filter cache are resampled
+        buffers = cached_rows(
+            cache,
+            channel_keys(params, edf_fn, label_list, fs_out,
+                         'resampled from', eeg_info.fs),
+            resample_and_filter)
+        eeg_info.fs = fs_out
         print(eeg_info.fs)
         buffers = dsp.prefilter(buffers, eeg_info.fs,
-                                params['notch'], params['lpf fc'],
-                                params['hpf fc'], params['clip level'],
-                                params['normalize'])
-        buffers = torch.tensor(buffers, dtype=torch.float32).transpose(0, 1)
+                                clip_level=params['clip level'],
+                                standardize=params['normalize'],
+                                dtype=params['sample dtype'])
+        # Wrap the filtered array without copying it
+        buffers = torch.from_numpy(
+            buffers.astype(np.float32, copy=False)).transpose(0, 1)
 
         fn_out = edf_fn.split('/')[-1].split('.')[0] + '.pt'
         fn_out = os.path.join(paths['buffers'], fn_out)
         torch.save(buffers, fn_out)
+    pool.close()
 
 
 if __name__ == '__main__':
@@ -1,57 +1,72 @@
 import argparse
+import numpy as np
 import pyedflib
-from scipy.signal import resample_poly
 
+from preprocessing.edf_writer import sample_rate, set_sample_rate, write_edf
+from preprocessing.resample import StreamingResampler
 
-def read_edf(fn):
+# Input seconds read at a time
+CHUNK_SECONDS = 60
+
+
+def read_edf_info(fn):
     f = pyedflib.EdfReader(fn)
     annotations = f.readAnnotations()
     header = f.getHeader()
 
     ch_nrs = range(f.signals_in_file)
     signal_headers = [f.getSignalHeaders()[c] for c in ch_nrs]
-    # Read signals
-    signals = []
-    for c in ch_nrs:
-        signal = f.readSignal(c, digital=False)
-        signals.append(signal)
-    return signals, signal_headers, header, annotations
-
-
-def write_edf(edf_file, signals, signal_headers, header, annotations):
-    n_channels = len(signal_headers)
-    with pyedflib.EdfWriter(edf_file, n_channels=n_channels) as f:
-        f.setSignalHeaders(signal_headers)
-        f.setHeader(header)
-        f.writeSamples(signals)
-        for ii in range(len(annotations[0])):
-            f.writeAnnotation(annotations[0][ii],
-                              annotations[1][ii],
-                              annotations[2][ii])
-    del f
+    nsamples = f.getNSamples()[0]
+    f.close()
+    return signal_headers, header, annotations, nsamples
+
+
+def resampled_chunks(fn, nsamples, fs_in, fs_out):
+    """Read and resample a file chunk by chunk
+
+    The resampler keeps the input it needs across chunk boundaries, so the
+    output is the same as resampling the whole file at once.
+    """
+    f = pyedflib.EdfReader(fn)
+    resampler = StreamingResampler(fs_in, fs_out)
+    chunk_samples = int(CHUNK_SECONDS * fs_in)
+    try:
+        for start in range(0, nsamples, chunk_samples):
+            n = min(chunk_samples, nsamples - start)
+            signals = np.array([f.readSignal(c, start, n)
+                                for c in range(f.signals_in_file)])
+            yield list(resampler.process(signals))
+        yield list(resampler.flush())
+    finally:
+        f.close()
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('fn_in')
     parser.add_argument('fn_out')
+    parser.add_argument('--fs', type=float, default=200,
+                        help='target sample rate')
     args = vars(parser.parse_args())
     fn_in = args['fn_in']
     fn_out = args['fn_out']
+    fs_out = args['fs']
 
-    signals, signal_headers, header, annotations = read_edf(fn_in)
+    signal_headers, header, annotations, nsamples = read_edf_info(fn_in)
 
     # Check for the same sample rate
+    fs_in = sample_rate(signal_headers[0])
     SampleRateCheck = True
     for sheader in signal_headers:
-        if sheader['sample_rate'] != 256:
+        if sample_rate(sheader) != fs_in:
             SampleRateCheck = False
-        sheader['sample_rate'] = 200
+        set_sample_rate(sheader, fs_out)
 
     assert SampleRateCheck, "Channels with different sample rate"
 
-    new_signals = resample_poly(signals, up=25, down=32, axis=1)
-    write_edf(fn_out, new_signals, signal_headers, header, annotations)
+    write_edf(fn_out,
+              lambda: resampled_chunks(fn_in, nsamples, fs_in, fs_out),
+              signal_headers, header, annotations)
 
 
 if __name__ == '__main__':
@@ -1,35 +1,40 @@
 import argparse
 import pyedflib
-from scipy.signal import resample_poly
 import numpy as np
 
+from preprocessing.edf_trim import trim_edf
+from preprocessing.edf_writer import sample_rate, write_edf
 
-def read_edf(fn):
+# Seconds of signal read and written at a time
+CHUNK_SECONDS = 60
+
+
+def read_edf_info(fn):
     f = pyedflib.EdfReader(fn)
     annotations = f.readAnnotations()
     header = f.getHeader()
 
     ch_nrs = range(f.signals_in_file)
     signal_headers = [f.getSignalHeaders()[c] for c in ch_nrs]
-    # Read signals
-    signals = []
-    for c in ch_nrs:
-        signal = f.readSignal(c, digital=False)
-        signals.append(signal)
-    return signals, signal_headers, header, annotations
+    nsamples = f.getNSamples()
+    f.close()
+    return signal_headers, header, annotations, nsamples
 
 
-def write_edf(edf_file, signals, signal_headers, header, annotations):
-    n_channels = len(signal_headers)
-    with pyedflib.EdfWriter(edf_file, n_channels=n_channels) as f:
-        f.setSignalHeaders(signal_headers)
-        f.setHeader(header)
-        f.writeSamples(signals)
-        for ii in range(len(annotations[0])):
-            f.writeAnnotation(annotations[0][ii],
-                              annotations[1][ii],
-                              annotations[2][ii])
-    del f
+def trimmed_chunks(fn, signal_headers, nsamples, start, end):
+    """Read the signals between start and end seconds a chunk at a time"""
+    f = pyedflib.EdfReader(fn)
+    try:
+        for t in range(start, end, CHUNK_SECONDS):
+            chunk = []
+            for c, signal_header in enumerate(signal_headers):
+                fs = int(sample_rate(signal_header))
+                first = min(t * fs, nsamples[c])
+                last = min(min(t + CHUNK_SECONDS, end) * fs, nsamples[c])
+                chunk.append(f.readSignal(c, first, last - first))
+            yield chunk
+    finally:
+        f.close()
 
 
 def main():
@@ -38,13 +43,20 @@ def main():
     parser.add_argument('start', type=int)
     parser.add_argument('end', type=int)
     parser.add_argument('fn_out')
+    parser.add_argument('--mode', choices=['copy', 'decode'], default='copy',
+                        help='copy the stored data records, or decode and '
+                        're-encode the signals')
     args = vars(parser.parse_args())
     fn_in = args['fn_in']
     fn_out = args['fn_out']
     start = args['start']
     end = args['end']
 
-    signals, signal_headers, header, annotations = read_edf(fn_in)
+    if args['mode'] == 'copy':
+        trim_edf(fn_in, fn_out, start, end)
+        return
+
+    signal_headers, header, annotations, nsamples = read_edf_info(fn_in)
 
     # Get the new annotations
     aidx = np.where((annotations[0] >= start) * (annotations[0] <= end))
@@ -54,18 +66,11 @@ def main():
         annotations[2][aidx],
     ]
 
-    # Trim the signals
-    if isinstance(signals, np.ndarray):
-        fs = signal_headers[0]['sample_rate']
-        new_signals = signals[:, start*fs:end*fs]
-    if isinstance(signals, list):
-        new_signals = []
-        for signal, signal_header in zip(signals, signal_headers):
-            fs = signal_header['sample_rate']
-            new_signals.append(signal[start*fs:end*fs])
-
-    # Write
-    write_edf(fn_out, new_signals, signal_headers, header, new_annotations)
+    # Trim and write the signals a chunk at a time
+    write_edf(fn_out,
+              lambda: trimmed_chunks(fn_in, signal_headers, nsamples,
+                                     start, end),
+              signal_headers, header, new_annotations)
 
 
 if __name__ == '__main__':
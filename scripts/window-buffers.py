@@ -5,21 +5,23 @@ import numpy as np
 import utils.read_files as read
 import utils.pathmanager as pm
 import utils.testconfiguration as tc
+from preprocessing.buffer_store import STORE_EXT, BufferStore
 
 
 def apply_window(buffers, fs, window_length, overlap):
-    """Create windows from a buffered recording
+    """Create windows from a buffered recording, either a (L, C) tensor or
+    a BufferStore, which is read a window at a time
     """
     window_length_samples = int(np.floor(fs * window_length))
     overlap_samples = int(np.floor(fs * overlap))
     advance_samples = int(window_length_samples - overlap_samples)
     start_sample = 0
     end_sample = window_length_samples
-    L = buffers.size(0)
+    L = len(buffers)
     data = []
     while end_sample <= L:
-        data.append(buffers[start_sample:end_sample,
-                            :].transpose(0, 1).unsqueeze(0))
+        data.append(torch.as_tensor(buffers[start_sample:end_sample,
+                                            :]).transpose(0, 1).unsqueeze(0))
         start_sample += advance_samples
         end_sample += advance_samples
     data = torch.cat(data, dim=0)
@@ -42,10 +44,17 @@ def main():
     for file in manifest_files:
         fn = file['fn'].split('/')[-1].split('.')[0] + '.pt'
         fn_buf = os.path.join(paths['buffers'], fn)
-        buffers = torch.load(fn_buf)
-        data = apply_window(buffers, fs=fs,
-                            window_length=params['window length'],
-                            overlap=params['overlap'])
+        fn_store = os.path.splitext(fn_buf)[0] + STORE_EXT
+        if os.path.exists(fn_store):
+            with BufferStore(fn_store) as store:
+                data = apply_window(store, fs=fs,
+                                    window_length=params['window length'],
+                                    overlap=params['overlap'])
+        else:
+            buffers = torch.load(fn_buf)
+            data = apply_window(buffers, fs=fs,
+                                window_length=params['window length'],
+                                overlap=params['overlap'])
         fn_win_buf = os.path.join(paths['data'], fn)
         torch.save(data, fn_win_buf)
 
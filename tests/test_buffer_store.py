@@ -0,0 +1,46 @@
+import pickle
+
+import numpy as np
+
+from preprocessing.buffer_store import (BufferStore, BufferStorePool,
+                                        write_store)
+
+
+def _store(tmp_path, name='rec.bufs', nsamples=1000):
+    buffers = np.random.default_rng(0).standard_normal(
+        (nsamples, 3)).astype(np.float32)
+    fn = str(tmp_path / name)
+    write_store(fn, buffers, fs=100, chunk_seconds=1.5)
+    return fn, buffers
+
+
+def test_slices_match_array(tmp_path):
+    fn, buffers = _store(tmp_path)
+    with BufferStore(fn) as store:
+        for key in (slice(10, 500), slice(None, None, 3), slice(420, 90, -7),
+                    slice(None, None, -1), slice(5, 5), slice(-20, None),
+                    slice(200, 100)):
+            np.testing.assert_array_equal(store[key], buffers[key])
+        np.testing.assert_array_equal(store[50:10:-2, 1], buffers[50:10:-2, 1])
+        np.testing.assert_array_equal(store[-1], buffers[-1])
+
+
+def test_pool_keeps_at_most_max_open(tmp_path):
+    stores = [_store(tmp_path, 'rec{}.bufs'.format(ii)) for ii in range(4)]
+    with BufferStorePool(max_open=2) as pool:
+        for fn, buffers in stores + stores[::-1]:
+            np.testing.assert_array_equal(pool.read(fn, 100, 250),
+                                          buffers[100:250])
+            assert len(pool) <= 2
+    assert len(pool) == 0
+
+
+def test_pool_pickles_without_open_stores(tmp_path):
+    fn, buffers = _store(tmp_path)
+    pool = BufferStorePool(max_open=3)
+    pool.read(fn, 0, 10)
+    copy = pickle.loads(pickle.dumps(pool))
+    assert len(copy) == 0 and copy.max_open == 3
+    np.testing.assert_array_equal(copy.read(fn, 0, 10), buffers[:10])
+    pool.close()
+    copy.close()
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+import scipy.signal
+
+import preprocessing.dsp as dsp
+
+
+def _eeg(fs=200, seconds=300):
+    rng = np.random.default_rng(0)
+    t = np.arange(fs * seconds) / fs
+    return (20 * rng.standard_normal((3, len(t)))
+            + 50 * np.sin(2 * np.pi * 60 * t) + 1000)
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_block_filtering_matches_whole_signal(dtype):
+    x = _eeg()
+    whole = dsp.prefilter(x, 200, True, 30, 1.6, 0, dtype=np.float64)
+    blocks = dsp.prefilter(x, 200, True, 30, 1.6, 0, block_seconds=60,
+                           dtype=dtype)
+    assert blocks.dtype == dtype
+    assert np.max(np.abs(blocks - whole)) < 1e-5 * np.max(np.abs(whole))
+
+
+def test_streaming_filter_matches_one_call():
+    fs = 200
+    x = _eeg(fs=fs, seconds=60)
+    stream = dsp.StreamingFilter(fs, notch_fc=60, lpf_fc=30, hpf_fc=1.6)
+    zi = scipy.signal.sosfilt_zi(stream.sos)[:, np.newaxis, :] * x[:, :1]
+    whole, _ = scipy.signal.sosfilt(stream.sos, x, axis=-1, zi=zi)
+
+    rng = np.random.default_rng(1)
+    for _ in range(3):
+        # Random boundaries, with 1-sample and empty chunks among them
+        bounds = np.sort(np.concatenate((
+            rng.integers(0, x.shape[1], 50), [0, 0, 1, 2, 2, x.shape[1]])))
+        stream.reset()
+        chunks = [stream.process(x[:, start:stop])
+                  for start, stop in zip(bounds[:-1], bounds[1:])]
+        assert any(chunk.shape[1] == 0 for chunk in chunks)
+        assert any(chunk.shape[1] == 1 for chunk in chunks)
+        np.testing.assert_allclose(np.concatenate(chunks, axis=1), whole,
+                                   rtol=0, atol=1e-9 * np.max(np.abs(whole)))
+
+
+@pytest.mark.parametrize('method', ['iir', 'fir'])
+@pytest.mark.parametrize('standardize', [False, True])
+def test_iter_prefilter_matches_prefilter(method, standardize):
+    x = _eeg()
+    kwargs = dict(notch=True, lpf_fc=30, hpf_fc=1.6, clip_level=3.0,
+                  standardize=standardize, block_seconds=60, method=method)
+    expected = dsp.prefilter(x, 200, **kwargs)
+    blocks = list(dsp.iter_prefilter(x, 200, **kwargs))
+    assert all(block.dtype == np.float32 for block in blocks)
+    np.testing.assert_allclose(np.concatenate(blocks, axis=1), expected,
+                               rtol=0, atol=1e-6 * np.max(np.abs(expected)))
@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pytest
+
+from preprocessing.edf_catalog import EdfCatalog
+from preprocessing.edf_writer import make_signal_header, write_edf
+
+
+def _write(fn, labels, seconds=10, fs=100):
+    rng = np.random.default_rng(0)
+    signals = [rng.uniform(-100, 100, seconds * fs) for _ in labels]
+    headers = [make_signal_header(label, fs, -100, 100) for label in labels]
+    write_edf(fn, lambda: [signals], headers)
+    return fn
+
+
+@pytest.fixture
+def edf_fns(tmp_path):
+    return [_write(str(tmp_path / 'a.edf'), ['EEG FP1-REF', 'EEG CZ-REF']),
+            _write(str(tmp_path / 'b.edf'), ['EEG CZ-REF', 'EEG O1-REF'],
+                   seconds=20)]
+
+
+def test_rerun_skips_unchanged_files(tmp_path, edf_fns):
+    with EdfCatalog(str(tmp_path / 'catalog.db')) as catalog:
+        scanned, failed = catalog.update(edf_fns, workers=2)
+        assert sorted(scanned) == sorted(os.path.abspath(fn)
+                                         for fn in edf_fns)
+        assert failed == set()
+        record = catalog.get(edf_fns[1])
+        assert record['labels'] == ['EEG CZ-REF', 'EEG O1-REF']
+        assert record['fs'] == [100, 100]
+        assert record['nsamples'] == [2000, 2000]
+        assert record['duration'] == 20
+        assert catalog.update(edf_fns, workers=1) == ([], set())
+
+    # The catalog is kept on disk between runs
+    with EdfCatalog(str(tmp_path / 'catalog.db')) as catalog:
+        assert catalog.update(edf_fns, workers=1) == ([], set())
+
+
+def test_changed_files_are_rescanned(tmp_path, edf_fns):
+    with EdfCatalog(str(tmp_path / 'catalog.db')) as catalog:
+        catalog.update(edf_fns, workers=1)
+
+        # A new modification time alone
+        stat = os.stat(edf_fns[0])
+        os.utime(edf_fns[0], ns=(stat.st_atime_ns,
+                                 stat.st_mtime_ns + 10 ** 9))
+        scanned, _ = catalog.update(edf_fns, workers=1)
+        assert scanned == [os.path.abspath(edf_fns[0])]
+
+        # A new size, with the modification time put back
+        stat = os.stat(edf_fns[1])
+        _write(edf_fns[1], ['EEG CZ-REF', 'EEG O1-REF'], seconds=30)
+        os.utime(edf_fns[1], ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        scanned, _ = catalog.update(edf_fns, workers=1)
+        assert scanned == [os.path.abspath(edf_fns[1])]
+        assert catalog.get(edf_fns[1])['duration'] == 30
+
+
+def test_unreadable_files_fail(tmp_path, edf_fns):
+    missing = str(tmp_path / 'missing.edf')
+    invalid = str(tmp_path / 'invalid.edf')
+    with open(invalid, 'w') as f:
+        f.write('not an edf file')
+    with EdfCatalog(str(tmp_path / 'catalog.db')) as catalog:
+        scanned, failed = catalog.update(edf_fns + [missing, invalid],
+                                         workers=1)
+        assert failed == {os.path.abspath(missing), os.path.abspath(invalid)}
+        assert len(scanned) == 3
+        assert catalog.get(invalid) is None
+
+
+def test_channel_intersection(tmp_path, edf_fns):
+    with EdfCatalog(str(tmp_path / 'catalog.db')) as catalog:
+        catalog.update(edf_fns, workers=1)
+        assert catalog.channel_intersection(edf_fns) == {'EEG CZ-REF'}
+        assert catalog.channel_intersection(edf_fns[:1]) == {
+            'EEG FP1-REF', 'EEG CZ-REF'}
+        assert catalog.channel_intersection([]) == set()
+        info = catalog.load_metadata(edf_fns[0])
+        assert info.fs == 100
+        assert info.labels2chns == {'EEG FP1-REF': 0, 'EEG CZ-REF': 1}
@@ -0,0 +1,57 @@
+import copy
+
+import numpy as np
+import pyedflib
+
+from preprocessing.edf_loader import EdfLoader
+from preprocessing.edf_pool import EdfHandlePool, open_edf
+from preprocessing.edf_writer import make_signal_header, write_edf
+
+
+def _write(tmp_path):
+    fn = str(tmp_path / 'rec.edf')
+    signals = np.random.default_rng(0).uniform(-100, 100, (2, 1000))
+    headers = [make_signal_header(label, 100, -100, 100)
+               for label in ('EEG FP1-REF', 'EEG FP2-REF')]
+    write_edf(fn, lambda: [list(signals)], headers)
+    return fn
+
+
+def _can_reopen(fn):
+    # pyedflib refuses to open a file that is still open
+    with pyedflib.EdfReader(fn) as f:
+        return f.signals_in_file == 2
+
+
+def test_deepcopy_after_close(tmp_path):
+    fn = _write(tmp_path)
+    with EdfHandlePool() as pool:
+        with pool.open(fn, 'memmap') as handle:
+            signal = handle.reader.signal(1, 100, 300)
+            expected = np.asarray(signal)
+    assert handle.reader is None
+    copied = copy.deepcopy(signal)
+    np.testing.assert_array_equal(np.asarray(copied), expected)
+    np.testing.assert_array_equal(copied[10:20], expected[10:20])
+
+
+def test_pool_closes_files_on_exit(tmp_path):
+    fn = _write(tmp_path)
+    with EdfHandlePool() as pool:
+        with pool.open(fn) as handle:
+            handle.reader.readSignal(0)
+        assert len(pool) == 1
+    assert len(pool) == 0
+    assert _can_reopen(fn)
+
+
+def test_loader_without_pool_keeps_nothing_open(tmp_path):
+    fn = _write(tmp_path)
+    loader = EdfLoader()
+    eeg_info = loader.load_metadata(fn)
+    bufs = loader.load_buffers(eeg_info)
+    assert len(bufs) == 2
+    assert _can_reopen(fn)
+    with open_edf(fn) as handle:
+        handle.reader.readSignal(0)
+    assert _can_reopen(fn)
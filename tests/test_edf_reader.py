@@ -0,0 +1,136 @@
+import copy
+
+import numpy as np
+import pyedflib
+import pytest
+
+from preprocessing.edf_reader import (EdfReader, read_annotation_bytes,
+                                      read_annotations, read_header)
+from preprocessing.edf_writer import make_signal_header, write_edf
+
+
+@pytest.fixture
+def edf_fn(tmp_path):
+    fn = str(tmp_path / 'rec.edf')
+    rng = np.random.default_rng(0)
+    signals = [rng.uniform(-150, 80, 2000), rng.uniform(-10, 10, 1000)]
+    headers = [make_signal_header('EEG FP1-REF', 200, -150, 80),
+               make_signal_header('EEG FP2-REF', 100, -10, 10)]
+    annotations = ([1.0, 2.5, 7.25], [-1, 0.5, 2.0],
+                   ['start', 'spike', 'seizure'])
+    write_edf(fn, lambda: [signals], headers, annotations=annotations)
+    return fn
+
+
+def test_matches_pyedflib(edf_fn):
+    with pyedflib.EdfReader(edf_fn) as expected, EdfReader(edf_fn) as f:
+        assert f.signals_in_file == expected.signals_in_file
+        assert f.getSignalLabels() == expected.getSignalLabels()
+        np.testing.assert_array_equal(f.getNSamples(),
+                                      expected.getNSamples())
+        np.testing.assert_array_equal(f.getSampleFrequencies(),
+                                      expected.getSampleFrequencies())
+        assert f.getFileDuration() == expected.getFileDuration()
+        for chn in range(f.signals_in_file):
+            np.testing.assert_allclose(f.readSignal(chn),
+                                       expected.readSignal(chn))
+            np.testing.assert_array_equal(
+                f.readSignal(chn, digital=True),
+                expected.readSignal(chn, digital=True))
+            np.testing.assert_allclose(f.readSignal(chn, 150, 300),
+                                       expected.readSignal(chn, 150, 300))
+        for actual, wanted in zip(f.readAnnotations(),
+                                  expected.readAnnotations()):
+            np.testing.assert_array_equal(actual, wanted)
+        for actual, wanted in zip(read_annotations(edf_fn),
+                                  expected.readAnnotations()):
+            np.testing.assert_array_equal(actual, wanted)
+
+
+def test_signal_views_act_as_arrays(edf_fn):
+    with EdfReader(edf_fn) as f:
+        signal = f.signal(0, 100, 1100)
+        samples = f.readSignal(0, 100, 1000)
+    np.testing.assert_array_equal(np.asarray(signal), samples)
+    np.testing.assert_array_equal(signal[::-3], samples[::-3])
+    np.testing.assert_array_equal(signal[500:10:-7], samples[500:10:-7])
+    assert signal[-1] == samples[-1]
+    np.testing.assert_array_equal(signal * 2 + 1, samples * 2 + 1)
+    np.testing.assert_array_equal(signal - signal, np.zeros(1000))
+    np.testing.assert_array_equal(np.abs(signal), np.abs(samples))
+    assert np.mean(signal) == np.mean(samples)
+    np.testing.assert_array_equal(copy.deepcopy(signal), samples)
+
+
+def _write_tals(fn, record_tals, record_onset=0.0):
+    """
+    Write a 5 record EDF+ file with two annotation signals, then fill the
+    annotation signals of each record with the given TALs
+
+    inputs:
+        record_tals - {record: (tals of signal 1, tals of signal 2)}, where
+            the time-keeping TAL is added to signal 1
+        record_onset - onset of the first record in its time-keeping TAL
+    """
+    writer = pyedflib.EdfWriter(fn, 2, file_type=pyedflib.FILETYPE_EDFPLUS)
+    writer.set_number_of_annotation_signals(2)
+    writer.setSignalHeaders([make_signal_header('EEG FP1-REF', 100, -1, 1),
+                             make_signal_header('EEG FP2-REF', 100, -1, 1)])
+    writer.writeSamples([np.zeros(500), np.zeros(500)])
+    writer.close()
+
+    header = read_header(fn)
+    record_bytes = 2 * header.record_samples
+    with open(fn, 'r+b') as f:
+        for record in range(header.nrecords):
+            first, second = record_tals.get(record, (b'', b''))
+            onset = '{:+g}'.format(record + record_onset).encode('ascii')
+            first = onset + b'\x14\x14\x00' + first
+            for chn, raw in zip(header.annotation_chns, (first, second)):
+                width = 2 * int(header.samples_per_record[chn])
+                assert len(raw) <= width
+                f.seek(header.header_bytes + record * record_bytes
+                       + 2 * int(header.record_offsets[chn]))
+                f.write(raw.ljust(width, b'\x00'))
+
+
+def test_tals_across_records_and_signals(tmp_path):
+    fn = str(tmp_path / 'tals.edf')
+    _write_tals(fn, {
+        0: (b'+0.5\x14start\x14\x00', b''),
+        # Several annotations in one TAL, and a TAL with a duration
+        1: (b'+1.25\x151.5\x14spike\x14sharp wave\x14\x00',
+            b'+1.75\x150.25\x14in the second signal\x14\x00'),
+        # Record 2 has no annotations, record 3 has two TALs
+        3: (b'+3\x14artifact\x14\x00+3.5\x152\x14seizure\x14\x00',
+            b'+4.125\x14late\x14\x00'),
+    })
+    header = read_header(fn)
+    width = sum(2 * int(header.samples_per_record[chn])
+                for chn in header.annotation_chns)
+    raw = read_annotation_bytes(fn, header)
+    assert len(raw) == 5
+    assert all(len(record) == width for record in raw)
+
+    onsets, durations, descriptions = read_annotations(fn)
+    np.testing.assert_array_equal(onsets, [0.5, 1.25, 1.25, 1.75, 3, 3.5,
+                                           4.125])
+    np.testing.assert_array_equal(durations, [-1, 1.5, 1.5, 0.25, -1, 2, -1])
+    assert list(descriptions) == ['start', 'spike', 'sharp wave',
+                                  'in the second signal', 'artifact',
+                                  'seizure', 'late']
+
+    with pyedflib.EdfReader(fn) as expected, EdfReader(fn) as f:
+        for actual, wanted in zip(f.readAnnotations(),
+                                  expected.readAnnotations()):
+            np.testing.assert_array_equal(actual, wanted)
+
+
+def test_tal_onsets_are_relative_to_the_first_record(tmp_path):
+    fn = str(tmp_path / 'offset.edf')
+    _write_tals(fn, {2: (b'+3.25\x150.5\x14spike\x14\x00', b'')},
+                record_onset=0.75)
+    onsets, durations, descriptions = read_annotations(fn)
+    np.testing.assert_allclose(onsets, [2.5])
+    np.testing.assert_array_equal(durations, [0.5])
+    assert list(descriptions) == ['spike']
@@ -0,0 +1,118 @@
+import datetime
+import importlib.util
+import os
+import sys
+import warnings
+
+import numpy as np
+import pyedflib
+import pytest
+
+from preprocessing.edf_reader import EdfReader, parse_tals, read_header
+from preprocessing.edf_trim import trim_edf
+from preprocessing.edf_writer import make_signal_header
+
+START = datetime.datetime(2020, 3, 9, 23, 59, 50)
+FS = [200, 50]
+SECONDS = 20
+
+
+def _trim_script():
+    """Load scripts/trim-edf.py, which holds the decode mode"""
+    fn = os.path.join(os.path.dirname(__file__), '..', 'scripts',
+                      'trim-edf.py')
+    spec = importlib.util.spec_from_file_location('trim_edf_script', fn)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def edf_fn(tmp_path):
+    """A 20 s recording with 2 s data records, starting before midnight"""
+    fn = str(tmp_path / 'rec.edf')
+    rng = np.random.default_rng(0)
+    writer = pyedflib.EdfWriter(fn, len(FS),
+                                file_type=pyedflib.FILETYPE_EDFPLUS)
+    writer.setStartdatetime(START)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        writer.setDatarecordDuration(2.0)
+    writer.setSignalHeaders([make_signal_header('EEG FP1-REF', FS[0], -100,
+                                                100),
+                             make_signal_header('EEG FP2-REF', FS[1], -10,
+                                                10)])
+    writer.writeSamples([rng.uniform(-100, 100, FS[0] * SECONDS),
+                         rng.uniform(-10, 10, FS[1] * SECONDS)])
+    for onset, duration, description in [(1.0, -1, 'start'),
+                                         (5.5, 2.0, 'spike'),
+                                         (5.5, -1, 'artifact'),
+                                         (12.25, 0.5, 'seizure'),
+                                         (19.5, -1, 'end')]:
+        writer.writeAnnotation(onset, duration, description)
+    writer.close()
+    return fn
+
+
+def _record_onsets(fn):
+    with EdfReader(fn) as f:
+        return [parse_tals(raw)[0] for raw in f.annotation_bytes()]
+
+
+@pytest.mark.parametrize('start, end, date', [(4, 12, '09-MAR-2020'),
+                                               (3, 9, '09-MAR-2020'),
+                                               (13, 100, '10-MAR-2020')],
+                         ids=['aligned', 'unaligned', 'past-end'])
+def test_copy_matches_decode(edf_fn, tmp_path, monkeypatch, start, end, date):
+    copy_fn = str(tmp_path / 'copy.edf')
+    decode_fn = str(tmp_path / 'decode.edf')
+    trim_edf(edf_fn, copy_fn, start, end)
+    monkeypatch.setattr(sys, 'argv', ['trim-edf.py', edf_fn, str(start),
+                                      str(end), decode_fn, '--mode',
+                                      'decode'])
+    _trim_script().main()
+
+    with pyedflib.EdfReader(edf_fn) as source, \
+            pyedflib.EdfReader(copy_fn) as copied, \
+            pyedflib.EdfReader(decode_fn) as decoded:
+        # The copy is bit for bit, with the last record padded with zeros,
+        # while decoding and encoding again may round to a neighbouring
+        # stored value
+        for chn, fs in enumerate(FS):
+            expected = source.readSignal(chn, digital=True)[start * fs:
+                                                            end * fs]
+            actual = copied.readSignal(chn, digital=True)
+            np.testing.assert_array_equal(actual[:len(expected)], expected)
+            np.testing.assert_allclose(decoded.readSignal(chn, digital=True),
+                                       expected, rtol=0, atol=1)
+            padding = copied.readSignal(chn)[len(expected):]
+            assert np.all(np.abs(padding) <= 2 * copied.getSignalHeader(
+                chn)['physical_max'] / 65535)
+
+        # Annotations relative to the new start
+        for actual, expected in zip(copied.readAnnotations(),
+                                    decoded.readAnnotations()):
+            if actual.dtype.kind == 'f':
+                np.testing.assert_allclose(actual, expected, atol=1e-6)
+            else:
+                np.testing.assert_array_equal(actual, expected)
+        assert len(copied.readAnnotations()[0]) > 0
+
+        # The decode mode keeps the start date, the copy mode shifts it
+        assert decoded.getStartdatetime() == START
+        assert copied.getStartdatetime() == (
+            START + datetime.timedelta(seconds=start))
+
+    assert read_header(copy_fn).recording_id.startswith('Startdate ' + date)
+
+    # One time-keeping TAL per record, at the start of the record
+    for fn, duration in [(copy_fn, 2.0), (decode_fn, 1.0)]:
+        onsets = _record_onsets(fn)
+        np.testing.assert_allclose(onsets,
+                                   np.arange(len(onsets)) * duration)
+    assert len(_record_onsets(copy_fn)) * 2 >= min(end, SECONDS) - start
+
+
+def test_start_not_on_a_sample(edf_fn, tmp_path):
+    with pytest.raises(ValueError):
+        trim_edf(edf_fn, str(tmp_path / 'copy.edf'), 1.01, 5)
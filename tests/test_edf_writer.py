@@ -0,0 +1,83 @@
+import numpy as np
+import pyedflib
+import pytest
+
+from preprocessing.edf_writer import (StreamingEdfWriter, iter_record_chunks,
+                                      make_signal_header, record_duration,
+                                      samples_per_record, write_edf)
+
+
+def _read(fn):
+    with pyedflib.EdfReader(fn) as f:
+        rates = [f.getSampleFrequency(ii) for ii in range(f.signals_in_file)]
+        signals = [f.readSignal(ii) for ii in range(f.signals_in_file)]
+        headers = f.getSignalHeaders()
+    return rates, signals, headers
+
+
+def test_record_duration_holds_whole_samples():
+    headers = [make_signal_header('EEG', 200, -1, 1),
+               make_signal_header('pred', 0.5, 0, 1)]
+    assert record_duration(headers) == 2
+    assert samples_per_record(headers) == [400, 1]
+    headers = [make_signal_header('EEG', 256, -1, 1)]
+    assert record_duration(headers) == 1
+
+
+def test_record_duration_rejects_unrepresentable_rates():
+    with pytest.raises(ValueError):
+        record_duration([make_signal_header('pred', 1 / 61, 0, 1)])
+    with pytest.raises(ValueError):
+        record_duration([make_signal_header('pred', 0, 0, 1)])
+
+
+def test_write_low_rate_channel(tmp_path):
+    fn = str(tmp_path / 'low_rate.edf')
+    t = np.arange(2000) / 200
+    eeg = np.sin(2 * np.pi * t)
+    pred = np.linspace(0, 1, 5)
+    headers = [make_signal_header('EEG', 200, -1, 1),
+               make_signal_header('pred', 0.5, 0, 1)]
+    write_edf(fn, lambda: [[eeg, pred]], headers)
+    rates, signals, _ = _read(fn)
+    assert rates == [200, 0.5]
+    np.testing.assert_allclose(signals[0], eeg, atol=1e-4)
+    np.testing.assert_allclose(signals[1], pred, atol=1e-4)
+
+
+def test_write_keeps_physical_range(tmp_path):
+    fn = str(tmp_path / 'range.edf')
+    eeg = np.random.default_rng(0).uniform(-1, 1, 600)
+    headers = [make_signal_header('EEG', 200, -500, 500)]
+    calls = []
+
+    def chunks():
+        calls.append(1)
+        return [[eeg]]
+
+    write_edf(fn, chunks, headers)
+    _, signals, sheaders = _read(fn)
+    assert len(calls) == 1
+    assert sheaders[0]['physical_min'] == -500
+    assert sheaders[0]['physical_max'] == 500
+    np.testing.assert_allclose(signals[0], eeg, atol=0.02)
+
+
+def test_write_zero_length_recording(tmp_path):
+    fn = str(tmp_path / 'empty.edf')
+    headers = [make_signal_header('EEG', 200, -1, 1),
+               make_signal_header('pred', 50, -1, 1)]
+    signals = [np.zeros(0), np.zeros(0)]
+    annotations = ([0.0], [-1], ['start'])
+    with StreamingEdfWriter(fn, headers, annotations=annotations) as writer:
+        writer.write([])
+        for chunk in iter_record_chunks(signals, headers):
+            writer.write(chunk)
+        writer.write(signals)
+    _, signals, _ = _read(fn)
+    assert [len(signal) for signal in signals] == [200, 50]
+    # One data record of zeros, as readers need at least one
+    for signal in signals:
+        np.testing.assert_allclose(signal, 0, atol=1e-4)
+    with pyedflib.EdfReader(fn) as f:
+        assert list(f.readAnnotations()[2]) == ['start']
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+import torch
+
+try:
+    import nolds  # noqa: F401
+except Exception:
+    # preprocessing.features imports nolds, which fails on import in some
+    # installs, as well as when it is missing
+    nolds = None
+
+pytestmark = pytest.mark.skipif(nolds is None,
+                                reason='nolds cannot be imported')
+
+if nolds is not None:
+    import preprocessing.features as features
+    from preprocessing.feature_graph import FeatureGraph
+    from preprocessing.feature_pool import FeaturePool
+
+GRAPH_FEATURES = ['fft', 'bandpass', 'bandpass_welch', 'kaleem_features',
+                  'linelength', 'power']
+
+
+def _windows(dtype=torch.float32):
+    x = np.random.default_rng(0).standard_normal((40, 3, 200))
+    return torch.as_tensor(x, dtype=dtype)
+
+
+@pytest.mark.filterwarnings('ignore:Level value')
+@pytest.mark.parametrize('dtype', [torch.float32, torch.float64])
+@pytest.mark.parametrize('chunk_windows', [1024, 7])
+def test_graph_matches_direct_calls(dtype, chunk_windows):
+    x = _windows(dtype)
+    feats = FeatureGraph(GRAPH_FEATURES, chunk_windows).compute(x, fs=200)
+    assert list(feats) == GRAPH_FEATURES
+    for feat_name in GRAPH_FEATURES:
+        expected = getattr(features, feat_name)(x, fs=200)
+        assert feats[feat_name].dtype == expected.dtype
+        torch.testing.assert_close(feats[feat_name], expected)
+
+
+def test_graph_rejects_unknown_features():
+    with pytest.raises(ValueError):
+        FeatureGraph(['fft', 'not_a_feature'])
+
+
+@pytest.mark.parametrize('feat_name', ['sampen', 'linelength'])
+def test_pool_matches_direct_calls(feat_name):
+    x = _windows(torch.float64)
+    expected = getattr(features, feat_name)(x, fs=200)
+    with FeaturePool(workers=2, chunk_windows=8) as pool:
+        feat = pool.extract(feat_name, x, fs=200)
+        # The pool is reused for later batches
+        again = pool.extract(feat_name, x[:25], fs=200)
+    assert feat.dtype == expected.dtype
+    torch.testing.assert_close(feat, expected)
+    torch.testing.assert_close(again, expected[:25])
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+import scipy.signal
+
+try:
+    import nolds
+except Exception:
+    # nolds fails on import in some installs, as well as when it is missing
+    nolds = None
+
+pytestmark = pytest.mark.skipif(nolds is None,
+                                reason='nolds cannot be imported')
+
+if nolds is not None:
+    import preprocessing.features as features
+
+
+def _windows():
+    rng = np.random.default_rng(0)
+    b, a = scipy.signal.butter(4, [1 / 100, 30 / 100], 'bandpass')
+    eeg = scipy.signal.lfilter(b, a, rng.standard_normal((12, 2000)))
+    return {
+        'normal': rng.standard_normal((12, 200)),
+        'eeg': eeg[:, -200:],
+        'quantized': np.round(rng.standard_normal((12, 256)) * 2),
+        'short': rng.standard_normal((12, 12)),
+    }
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'emb_dim': 3, 'lag': 2},
+                                    {'closed': True, 'tolerance': 0.5}])
+def test_sample_entropy_matches_nolds(kwargs):
+    for x in _windows().values():
+        expected = np.array([nolds.sampen(row, **kwargs) for row in x])
+        np.testing.assert_array_equal(
+            features.sample_entropy(x, threads=2, **kwargs), expected)
+        # A (T, C, L) batch gives the same values in its shape
+        np.testing.assert_array_equal(
+            features.sample_entropy(x.reshape(3, 4, -1), **kwargs),
+            expected.reshape(3, 4))
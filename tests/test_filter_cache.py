@@ -0,0 +1,40 @@
+import numpy as np
+
+from preprocessing.filter_cache import FilterCache, cached_rows, make_key
+
+
+def _compute(data, calls):
+    def compute(rows):
+        calls.append(list(rows))
+        return data[rows] * 2
+    return compute
+
+
+def test_cached_rows_hits_match_misses(tmp_path):
+    cache = FilterCache(str(tmp_path))
+    data = np.random.default_rng(0).standard_normal((4, 100))
+    keys = [make_key('row', ii) for ii in range(4)]
+    calls = []
+    first = cached_rows(cache, keys, _compute(data, calls))
+    second = cached_rows(cache, keys, _compute(data, calls))
+    assert calls == [[0, 1, 2, 3]]
+    np.testing.assert_array_equal(first, second)
+
+
+def test_cached_rows_keeps_float64(tmp_path):
+    cache = FilterCache(str(tmp_path))
+    data = np.random.default_rng(1).standard_normal((3, 50))
+    keys = [make_key('row', ii) for ii in range(3)]
+    calls = []
+    first = cached_rows(cache, keys[:2], _compute(data, calls))
+    out = cached_rows(cache, keys, _compute(data, calls))
+    assert first.dtype == np.float64
+    assert out.dtype == np.float64
+    np.testing.assert_array_equal(out, data * 2)
+
+
+def test_eviction_keeps_cache_under_limit(tmp_path):
+    cache = FilterCache(str(tmp_path), max_bytes=4000)
+    for ii in range(20):
+        cache.put(make_key(ii), np.zeros(100, dtype=np.float32))
+    assert cache.size <= 4000
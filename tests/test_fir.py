@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from preprocessing.fir import design_fir, fir_filter, overlap_save
+
+
+@pytest.mark.parametrize('numtaps,nsamples', [(31, 1000), (401, 5000),
+                                              (1001, 1200)])
+def test_overlap_save_matches_convolution(numtaps, nsamples):
+    rng = np.random.default_rng(numtaps)
+    x = rng.standard_normal((3, nsamples))
+    h = rng.standard_normal(numtaps)
+    expected = np.array([np.convolve(row, h, 'valid') for row in x])
+    np.testing.assert_allclose(overlap_save(x, h), expected, atol=1e-9)
+    # Several full segments as well as the shorter last one
+    np.testing.assert_allclose(overlap_save(x, h, nfft=2 * numtaps + 7),
+                               expected, atol=1e-9)
+
+
+def _direct_fir(x, h):
+    """Zero-phase FIR filtering by direct convolution of the signal
+    extended by odd reflection"""
+    half = len(h) // 2
+    head = 2 * x[:, :1] - x[:, half:0:-1]
+    tail = 2 * x[:, -1:] - x[:, -2:-half - 2:-1]
+    padded = np.concatenate((head, x, tail), axis=1)
+    return np.array([np.convolve(row, h, 'valid') for row in padded])
+
+
+@pytest.mark.parametrize('block', [1 << 20, 1000, 333])
+def test_fir_filter_matches_direct_convolution(block):
+    x = np.random.default_rng(0).standard_normal((4, 6000))
+    h = design_fir(200, lpf_fc=30, hpf_fc=1, notch_fc=60)
+    out = fir_filter(x, h, block=block, dtype=np.float64)
+    np.testing.assert_allclose(out, _direct_fir(x, h), atol=1e-9)
+    # A list of channels is read a block at a time
+    np.testing.assert_allclose(fir_filter(list(x), h, block=block,
+                                          dtype=np.float64), out, atol=1e-12)
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from preprocessing.eeg_info import EegInfo
+from preprocessing.montage import (LABELS_AR1010, LABELS_AR1020,
+                                   LABELS_BIP1010, LABELS_BIP1020,
+                                   canonical_label, load_montage,
+                                   read_montage_file)
+from visualization.montages import EdfMontage
+
+# Old names the viewer also accepts for T7, T8, P7 and P8
+_OLD_NAMES = {'T7': 'T3', 'T8': 'T4', 'P7': 'T5', 'P8': 'T6'}
+
+
+def _recording(electrodes):
+    """EDF style labels in a shuffled order, with an extra EKG channel"""
+    rng = np.random.default_rng(0)
+    labels = ['EEG {}-REF'.format(_OLD_NAMES.get(label, label))
+              for label in electrodes] + ['EKG']
+    labels = [labels[ii] for ii in rng.permutation(len(labels))]
+    data = rng.standard_normal((len(labels), 500))
+    return labels, data
+
+
+def _viewer_ar(labels, data, labels_ar):
+    """Referential channels as the viewer's EdfMontage derives them"""
+    eeg_info = EegInfo()
+    eeg_info.labels2chns = {label: chn for chn, label in enumerate(labels)}
+    eeg_info.nchns = len(labels)
+    montage = EdfMontage(eeg_info)
+    montage.labelsAR = labels_ar
+    montage.nchns = len(labels_ar)
+    return montage, montage.ar(data)
+
+
+@pytest.mark.parametrize('system, labels_ar', [('1020', LABELS_AR1020),
+                                               ('1010', LABELS_AR1010)])
+def test_matches_viewer_montages(system, labels_ar):
+    labels, data = _recording(labels_ar)
+    viewer, ar = _viewer_ar(labels, data, labels_ar)
+
+    ref = load_montage('ref' + system, labels)
+    np.testing.assert_allclose(ref.apply(data), ar, rtol=0, atol=1e-12)
+
+    car = load_montage('car' + system, labels)
+    np.testing.assert_allclose(car.apply(data), ar - np.mean(ar, axis=0),
+                               rtol=0, atol=1e-12)
+
+    bip = load_montage('bip' + system, labels)
+    if system == '1020':
+        expected = viewer.get_bipolar_from_ar(ar)
+    else:
+        # The viewer plots 10-10 bipolar channels as differences of the
+        # referential channels with the same names
+        index = {label: row for row, label in enumerate(labels_ar)}
+        expected = np.array([ar[index[first]] - ar[index[second]]
+                             for first, second in
+                             (label.split('-') for label in LABELS_BIP1010)])
+    np.testing.assert_allclose(bip.apply(data), expected, rtol=0, atol=1e-12)
+    assert bip.labels == (LABELS_BIP1020 if system == '1020'
+                          else LABELS_BIP1010)
+
+
+def test_canonical_label():
+    assert canonical_label('EEG T3-REF') == 'T7'
+    assert canonical_label(' eeg fp1-le ') == 'FP1'
+    assert canonical_label('EEG CZ-AR') == 'CZ'
+    assert canonical_label('P8') == 'P8'
+    assert canonical_label('EKG') == 'EKG'
+
+
+def test_montage_file(tmp_path):
+    fn = str(tmp_path / 'montage.txt')
+    with open(fn, 'w') as f:
+        f.write('# A custom montage\n'
+                'fp1-f7\n'
+                '\n'
+                '  CZ  \n'
+                'cz-avg\n'
+                '   # indented comment\n'
+                'T3-T5\n')
+    assert read_montage_file(fn) == ['FP1-F7', 'CZ', 'CZ-AVG', 'T3-T5']
+
+    labels = ['EEG FP1-REF', 'EEG F7-REF', 'EEG CZ-REF', 'EEG T7-REF',
+              'EEG P7-REF']
+    data = np.random.default_rng(0).standard_normal((len(labels), 100))
+    montage = load_montage(fn, labels)
+    assert montage.labels == ['FP1-F7', 'CZ', 'CZ-AVG', 'T3-T5']
+    expected = [data[0] - data[1], data[2], data[2] - np.mean(data, axis=0),
+                data[3] - data[4]]
+    np.testing.assert_allclose(montage.apply(data), expected, rtol=0,
+                               atol=1e-12)
+    np.testing.assert_allclose(montage.apply(data.T, axis=-1), np.transpose(
+        expected), rtol=0, atol=1e-12)
+
+    with pytest.raises(ValueError):
+        load_montage(fn, labels[:-1])
@@ -0,0 +1,70 @@
+import multiprocessing
+import time
+
+import numpy as np
+import pytest
+
+import preprocessing.parallel as parallel
+
+torch = pytest.importorskip('torch')
+
+
+def _double(rows):
+    return np.asarray(rows) * 2
+
+
+def _slow_double(rows):
+    time.sleep(0.05)
+    return _double(rows)
+
+
+def _map_in_child(queue):
+    x = np.arange(40.0).reshape(8, 5)
+    queue.put(parallel.map_rows(_double, x, threads=4).tolist())
+
+
+@pytest.fixture
+def four_threads():
+    parallel.set_max_threads(4)
+    yield
+    parallel.set_max_threads(None)
+
+
+def test_map_rows_in_forked_child(four_threads):
+    x = np.arange(40.0).reshape(8, 5)
+    # Start every thread of the parent's pool, leaving them all idle
+    np.testing.assert_array_equal(
+        parallel.map_rows(_slow_double, x, threads=4), x * 2)
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    child = context.Process(target=_map_in_child, args=(queue,))
+    child.start()
+    try:
+        result = queue.get(timeout=10)
+    finally:
+        child.join(timeout=10)
+        if child.is_alive():
+            child.terminate()
+    assert child.exitcode == 0
+    np.testing.assert_array_equal(result, x * 2)
+
+
+def test_torch_threads_restored(four_threads):
+    before = torch.get_num_threads()
+    torch.set_num_threads(4)
+    try:
+        outer = parallel.limit_inner_threads(2)
+        inner = parallel.limit_inner_threads(4)
+        outer.__enter__()
+        assert torch.get_num_threads() == 2
+        inner.__enter__()
+        assert torch.get_num_threads() == 1
+        outer.__exit__(None, None, None)
+        # Still limited while the other call runs
+        assert torch.get_num_threads() == 1
+        inner.__exit__(None, None, None)
+        assert torch.get_num_threads() == 4
+        parallel.map_rows(_double, np.ones((4, 3)), threads=4)
+        assert torch.get_num_threads() == 4
+    finally:
+        torch.set_num_threads(before)
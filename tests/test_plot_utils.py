@@ -0,0 +1,65 @@
+import types
+
+import numpy as np
+import pytest
+
+pytest.importorskip('PyQt5')
+import visualization.plot_utils as plot_utils  # noqa: E402
+
+
+class _Progress():
+    canceled = False
+
+    def __init__(self, *args):
+        pass
+
+    def setWindowModality(self, modality):
+        pass
+
+    def setValue(self, value):
+        pass
+
+    def wasCanceled(self):
+        return _Progress.canceled
+
+
+def _filter_info():
+    return types.SimpleNamespace(
+        lp=30, hp=1.6, bp1=0, bp2=0, do_lp=1, do_hp=1, do_bp=0, notch=0,
+        filter_method='iir', fir_transition=1.0, filter_canceled=0)
+
+
+def test_filter_after_cancel(monkeypatch):
+    monkeypatch.setattr(plot_utils, 'QProgressDialog', _Progress)
+    monkeypatch.setattr(plot_utils, 'default_cache', None)
+    data = np.random.default_rng(0).standard_normal((3, 2000))
+    fi = _filter_info()
+
+    _Progress.canceled = True
+    out = plot_utils.filter_data(data, 200, fi)
+    assert fi.filter_canceled == 1
+    np.testing.assert_array_equal(out, data)
+
+    # A canceled call does not stop later calls from filtering
+    _Progress.canceled = False
+    out = plot_utils.filter_data(data, 200, fi)
+    assert fi.filter_canceled == 0
+    assert not np.allclose(out, data)
+
+
+def test_fir_combines_bandpass_with_lowpass_and_highpass(monkeypatch):
+    monkeypatch.setattr(plot_utils, 'default_cache', None)
+    data = np.random.default_rng(1).standard_normal((2, 4000))
+    fi = _filter_info()
+    fi.filter_method = 'fir'
+    fi.do_bp, fi.bp1, fi.bp2 = 1, 5, 40
+    # The band passed is 5 - 30 Hz, where all three filters pass
+    expected = plot_utils.fir.fir_filter(
+        data, plot_utils.fir.design_fir(200, 30, 5, 0, 1.0),
+        dtype=np.float64)
+    np.testing.assert_allclose(plot_utils.filter_data(data, 200, fi),
+                               expected)
+
+    # Disjoint bands pass nothing
+    fi.bp1, fi.bp2 = 40, 60
+    assert not np.any(plot_utils.filter_data(data, 200, fi))
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from scipy.signal import resample_poly
+
+from preprocessing.resample import StreamingResampler, resample
+
+RATES = [(256, 200), (250, 200), (512, 200), (200, 256), (200, 100)]
+
+
+def _signal(nsamples=3001):
+    return np.random.default_rng(0).standard_normal((3, nsamples))
+
+
+def _resample_poly(x, fs_in, fs_out):
+    gcd = np.gcd(fs_in, fs_out)
+    return resample_poly(x, fs_out // gcd, fs_in // gcd, axis=-1)
+
+
+@pytest.mark.parametrize('fs_in,fs_out', RATES)
+def test_resample_matches_resample_poly(fs_in, fs_out):
+    x = _signal()
+    expected = _resample_poly(x, fs_in, fs_out)
+    np.testing.assert_allclose(resample(x, fs_in, fs_out), expected,
+                               atol=1e-12)
+    np.testing.assert_allclose(resample(x.T, fs_in, fs_out, axis=0),
+                               expected.T, atol=1e-12)
+    out = resample(x.astype(np.float32), fs_in, fs_out)
+    assert out.dtype == np.float32
+    np.testing.assert_allclose(out, expected, atol=1e-5)
+
+
+@pytest.mark.parametrize('fs_in,fs_out', RATES)
+@pytest.mark.parametrize('chunk', [1, 37, 500, 4000])
+def test_streaming_matches_resample_poly(fs_in, fs_out, chunk):
+    x = _signal()
+    expected = _resample_poly(x, fs_in, fs_out)
+    resampler = StreamingResampler(fs_in, fs_out)
+    parts = [resampler.process(x[:, start:start + chunk])
+             for start in range(0, x.shape[-1], chunk)]
+    parts.append(resampler.flush())
+    np.testing.assert_allclose(np.concatenate(parts, axis=-1), expected,
+                               atol=1e-12)
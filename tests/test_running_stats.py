@@ -0,0 +1,24 @@
+import numpy as np
+
+from preprocessing.running_stats import RunningStats
+
+
+def test_chunked_stats_match_numpy():
+    rng = np.random.default_rng(0)
+    # A large offset makes a naive sum of squares lose precision
+    x = 1e4 + 20 * rng.standard_normal((3, 100000))
+    bounds = np.sort(np.concatenate((rng.integers(0, x.shape[1], 40),
+                                     [0, 0, 1, x.shape[1]])))
+    stats = RunningStats(x.shape[0])
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        stats.update(x[:, start:stop])
+    assert stats.count == x.shape[1]
+    np.testing.assert_allclose(stats.mean, np.mean(x, axis=-1), rtol=1e-12)
+    np.testing.assert_allclose(stats.std, np.std(x, axis=-1), rtol=1e-9)
+
+
+def test_empty_stats():
+    stats = RunningStats(2)
+    stats.update(np.zeros((2, 0)))
+    assert stats.count == 0
+    np.testing.assert_array_equal(stats.std, np.zeros(2))
@@ -7,6 +7,7 @@ import torch
 from torch.utils.data import Dataset
 
 import utils.read_files as read
+from preprocessing.buffer_store import STORE_EXT, BufferStorePool
 
 
 def normalize(buffers):
@@ -107,6 +108,7 @@ class EpilepsyDataset(Dataset):
 
         self.device = device
         self.features_dir = features_dir
+        self.store_pool = None
         self.features = features
         self.normalize_windows = normalize_windows
         self.post_sz = post_sz
@@ -182,12 +184,19 @@ class EpilepsyDataset(Dataset):
         self.buffer_list = []
         self.filenames = []
         self.buffer_windows = []
+        self.close()
+        self.store_pool = BufferStorePool()
 
         for eeg in self.manifest_files:
-            # Load the relevant file
-            fn = eeg['fn'].split('.')[0] + '.pt'
-            curr_file = torch.load(os.path.join(self.data_dir, fn),
-                                   map_location=self.device)
+            # Keep the path of chunked stores, which are read a window at a
+            # time, or load the whole .pt buffer
+            fn = eeg['fn'].split('.')[0] + STORE_EXT
+            if os.path.exists(os.path.join(self.data_dir, fn)):
+                curr_file = os.path.join(self.data_dir, fn)
+            else:
+                fn = eeg['fn'].split('.')[0] + '.pt'
+                curr_file = torch.load(os.path.join(self.data_dir, fn),
+                                       map_location=self.device)
 
             # Store the current buffer in the list of buffers
             self.filenames.append(fn)
@@ -205,6 +214,19 @@ class EpilepsyDataset(Dataset):
         # Set the length of the output
         self.d_out = [self.nchns, self.window_samples]
 
+    def _read_buffer(self, buffer_idx, start, end):
+        """Read samples [start, end) of a recording as a (L, C) tensor"""
+        buffer = self.buffer_list[buffer_idx]
+        if isinstance(buffer, str):
+            return torch.from_numpy(
+                self.store_pool.read(buffer, start, end)).to(self.device)
+        return buffer[start:end, :]
+
+    def close(self):
+        """Close the chunked stores opened to read windows"""
+        if self.store_pool is not None:
+            self.store_pool.close()
+
     def _load_features(self):
         """Load features
 
@@ -282,15 +304,18 @@ class EpilepsyDataset(Dataset):
                 start_idx, end_idx = self.sequence_indices[idx]
                 sample['buffers'] = self.data[start_idx:end_idx]
             else:
-                windowed_buffer = self.buffer_list[0].new_zeros(
+                windowed_buffer = torch.zeros(
                     (self.buffer_windows[idx],
                      self.nchns, self.window_samples),
-                    device=self.device)
+                    dtype=torch.float32, device=self.device)
+                buffer = self._read_buffer(
+                    idx, 0, (self.buffer_windows[idx] - 1)
+                    * self.window_advance_samples + self.window_samples)
                 for ii in range(self.buffer_windows[idx]):
                     start = ii * self.window_advance_samples
                     end = ii * self.window_advance_samples + self.window_samples
                     windowed_buffer[ii, :, :] = torch.transpose(
-                        self.buffer_list[idx][start:end, :], 0, 1)
+                        buffer[start:end, :], 0, 1)
                 sample['buffers'] = windowed_buffer
         else:
             # Find the buffer containing the window
@@ -311,8 +336,8 @@ class EpilepsyDataset(Dataset):
             else:
                 sample_start = window_number * self.window_advance_samples
                 sample['buffers'] = torch.transpose(
-                    self.buffer_list[buffer_idx][sample_start:sample_start
-                                                 + self.window_samples, :],
+                    self._read_buffer(buffer_idx, sample_start,
+                                      sample_start + self.window_samples),
                     0, 1)
         if self.normalize_windows:
             sample['buffers'] = normalize(sample['buffers'])
@@ -328,12 +353,12 @@ class EpilepsyDataset(Dataset):
                 (self.start_windows[-1] + self.buffer_windows[-1],
                  self.nchns, self.window_samples))
             idx = 0
-            for buffer, nwindows in zip(self.buffer_list, self.buffer_windows):
+            for buffer_idx, nwindows in enumerate(self.buffer_windows):
                 for ii in range(nwindows):
                     start = ii * self.advance_samples
                     end = ii * self.advance_samples + self.window_samples
                     all_data[idx, :, :] = torch.transpose(
-                        buffer[start:end, :], 0, 1)
+                        self._read_buffer(buffer_idx, start, end), 0, 1)
                     idx += 1
             return all_data
 
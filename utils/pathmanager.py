@@ -40,6 +40,17 @@ class PathManager():
                 self.config_dict['notch'], self.config_dict['clip level'],
                 self.config_dict['normalize']
             ))
+        # FIR filtered buffers go in their own folder; IIR keeps the old name
+        if ('filter method' in self.config_dict
+                and self.config_dict['filter method'] != 'iir'):
+            self.preprocessing_str += "_{}{}".format(
+                self.config_dict['filter method'],
+                self.config_dict['fir transition'])
+        if ('montage' in self.config_dict
+                and self.config_dict['montage'] != 'none'):
+            montage = os.path.basename(self.config_dict['montage'])
+            self.preprocessing_str += "_montage{}".format(
+                os.path.splitext(montage)[0])
         self.window_str = "window_length{}_overlap{}".format(
             self.config_dict['window length'], self.config_dict['overlap']
         )
@@ -78,6 +78,9 @@ class TestConfiguration():
             'visualize train': exp_cfg.getboolean('visualize train'),
             'smoothing': exp_cfg.getint('smoothing'),
             'features': json.loads(exp_cfg['features']),
+            'feature workers': json.loads(exp_cfg['feature workers']),
+            'feature chunk windows': json.loads(
+                exp_cfg['feature chunk windows']),
             'load to device': exp_cfg.getboolean('load to device'),
             'load as': exp_cfg['load as'],
             'load model fn': exp_cfg['load model fn'],
@@ -94,10 +97,23 @@ class TestConfiguration():
             'notch': preprocessing_cfg.getboolean('notch'),
             'lpf fc': preprocessing_cfg.getfloat('lpf fc'),
             'hpf fc': preprocessing_cfg.getfloat('hpf fc'),
+            'filter method': preprocessing_cfg['filter method'],
+            'fir transition': preprocessing_cfg.getfloat('fir transition'),
+            'filter cache dir': preprocessing_cfg['filter cache dir'],
+            'filter cache size': preprocessing_cfg.getfloat(
+                'filter cache size'),
+            'montage': preprocessing_cfg['montage'],
             'clip level': preprocessing_cfg.getfloat('clip level'),
             'normalize': preprocessing_cfg.getboolean('normalize'),
             'window length': preprocessing_cfg.getfloat('window length'),
             'overlap': preprocessing_cfg.getfloat('overlap'),
+            'sample dtype': preprocessing_cfg['sample dtype'],
+            'dsp threads': preprocessing_cfg.getint('dsp threads'),
+            'buffer format': preprocessing_cfg['buffer format'],
+            'buffer dtype': preprocessing_cfg['buffer dtype'],
+            'buffer compression': preprocessing_cfg['buffer compression'],
+            'buffer chunk seconds': preprocessing_cfg.getfloat(
+                'buffer chunk seconds'),
         })
 
     def _update_model_params(self):
@@ -18,6 +18,9 @@ class FilterInfo():
                 do_bp - whether to bandpass filter or not
                 filter_canceled - used to determine if filtering
                     was canceled during edf saving
+                filter_method - 'iir' for Butterworth filters, 'fir' for a
+                    linear phase filter applied with FFT overlap-save
+                fir_transition - width of the FIR band edges in Hz
         """
         self.fs = 0
         self.hp = 2
@@ -30,3 +33,5 @@ class FilterInfo():
         self.do_notch = 0
         self.do_bp = 0
         self.filter_canceled = 0
+        self.filter_method = 'iir'
+        self.fir_transition = 1.0
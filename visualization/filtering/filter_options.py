@@ -34,7 +34,7 @@ class FilterOptions(QWidget):
                 center_point.y() - self.height / 2, self.width, self.height)
 
         self.btn_exit = QPushButton('Ok', self)
-        layout.addWidget(self.btn_exit,4,3)
+        layout.addWidget(self.btn_exit,5,3)
 
         self.cbox_lp = QCheckBox("Lowpass",self)
         self.cbox_lp.setToolTip("Click to filter")
@@ -100,6 +100,21 @@ class FilterOptions(QWidget):
         notch_hz_lbl = QLabel("Hz",self)
         layout.addWidget(notch_hz_lbl,3,4)
 
+        self.cbox_fir = QCheckBox("Linear phase (FIR)",self)
+        self.cbox_fir.setToolTip("Use a steep FIR filter with the given "
+                                 "transition width")
+        if self.data.filter_method == 'fir':
+            self.cbox_fir.setChecked(True)
+        layout.addWidget(self.cbox_fir,4,0)
+
+        self.btn_get_transition = QDoubleSpinBox(self)
+        self.btn_get_transition.setRange(0.1, self.data.fs / 4)
+        self.btn_get_transition.setValue(self.data.fir_transition)
+        layout.addWidget(self.btn_get_transition,4,1)
+
+        transition_hz_lbl = QLabel("Hz",self)
+        layout.addWidget(transition_hz_lbl,4,2)
+
         self.setLayout(layout)
         self.set_signals_slots()
         self.show()
@@ -112,6 +127,7 @@ class FilterOptions(QWidget):
         self.cbox_hp.toggled.connect(self.hp_filter_checked)
         self.cbox_notch.toggled.connect(self.notch_filter_checked)
         self.cbox_bp.toggled.connect(self.bp_filter_checked)
+        self.cbox_fir.toggled.connect(self.fir_filter_checked)
 
     def lp_filter_checked(self):
         """ Called when the lp filter cbox is toggled.
@@ -153,6 +169,15 @@ class FilterOptions(QWidget):
         else:
             self.data.do_bp = 0
 
+    def fir_filter_checked(self):
+        """ Called when the FIR filter cbox is toggled.
+        """
+        cbox = self.sender()
+        if cbox.isChecked():
+            self.data.filter_method = 'fir'
+        else:
+            self.data.filter_method = 'iir'
+
     def change(self):
         """ Checks to make sure values are legal and updates
             the FilterInfo object
@@ -179,6 +204,7 @@ class FilterOptions(QWidget):
                 self.data.notch = self.btn_get_notch.value()
         else:
             self.data.do_notch = 0
+        self.data.fir_transition = self.btn_get_transition.value()
         self.parent.call_move_plot(0,0,0)
         self.close_window()
 
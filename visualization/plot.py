@@ -43,6 +43,9 @@ import pyqtgraph as pg
 from pyqtgraph.dockarea import *
 
 from preprocessing.edf_loader import *
+from preprocessing.edf_pool import EdfHandlePool
+from preprocessing.edf_writer import (StreamingEdfWriter, iter_record_chunks,
+                                      make_signal_header)
 from scipy import signal
 
 class MainPage(QMainWindow):
@@ -1040,47 +1043,27 @@ class MainPage(QMainWindow):
             nchns = self.ci.nchns_to_plot
             labels = self.ci.labels_to_plot
 
-            # if predictions, save them as well
-            if self.predicted == 1:
-                if self.pi.pred_by_chn:
-                    saved_edf = pyedflib.EdfWriter(file + '.edf', nchns * 2)
-                else:
-                    saved_edf = pyedflib.EdfWriter(file + '.edf', nchns + 1)
-            else:
-                saved_edf = pyedflib.EdfWriter(file + '.edf', nchns)
-
-            self.sei.convert_to_header()
-            saved_edf.setHeader(self.sei.pyedf_header)
             # Set fs and physical min/max
             fs = self.edf_info.fs
+            signals = []
+            signal_headers = []
             for i in range(nchns):
-                saved_edf.setPhysicalMaximum(i, np.max(data_to_save[i]))
-                saved_edf.setPhysicalMinimum(i, np.min(data_to_save[i]))
-                saved_edf.setSamplefrequency(i, fs)
-                saved_edf.setLabel(i, labels[i + 1])
+                signals.append(data_to_save[i])
+                signal_headers.append(make_signal_header(
+                    labels[i + 1], fs, np.min(data_to_save[i]),
+                    np.max(data_to_save[i])))
             # if predictions, save them as well
             if self.predicted == 1:
-                temp = []
-                for i in range(nchns):
-                    temp.append(data_to_save[i])
                 if self.pi.pred_by_chn:
                     for i in range(nchns):
-                        saved_edf.setPhysicalMaximum(nchns + i, 1)
-                        saved_edf.setPhysicalMinimum(nchns + i, 0)
-                        saved_edf.setSamplefrequency(
-                            nchns + i, fs / self.pi.pred_width)
-                        saved_edf.setLabel(nchns + i, "PREDICTIONS_" + str(i))
-                    for i in range(nchns):
-                        temp.append(self.pi.preds_to_plot[:, i])
+                        signals.append(self.pi.preds_to_plot[:, i])
+                        signal_headers.append(make_signal_header(
+                            "PREDICTIONS_" + str(i),
+                            fs / self.pi.pred_width, 0, 1))
                 else:
-                    saved_edf.setPhysicalMaximum(nchns, 1)
-                    saved_edf.setPhysicalMinimum(nchns, 0)
-                    saved_edf.setSamplefrequency(nchns, fs / self.pi.pred_width)
-                    saved_edf.setLabel(nchns, "PREDICTIONS")
-                    temp.append(self.pi.preds_to_plot)
-                data_to_save = temp
-
-            saved_edf.writeSamples(data_to_save)
+                    signals.append(self.pi.preds_to_plot)
+                    signal_headers.append(make_signal_header(
+                        "PREDICTIONS", fs / self.pi.pred_width, 0, 1))
 
             # write annotations
             if len(ann[0]) > 0 and ann[2][0] == "filtered":
@@ -1103,9 +1086,18 @@ class MainPage(QMainWindow):
                                 str(self.fi.do_bp * self.fi.bp2) + "Hz")
                 ann = np.insert(ann, 4, [0.0, -1.0, str_filt], axis=1)
                 # ann = np.insert(ann, 1, [0.0, -1.0, str_filt], axis=1)
-            for i in range(len(ann[0])):
-                saved_edf.writeAnnotation(
-                    float(ann[0][i]), float((ann[1][i])), ann[2][i])
+
+            # pyedflib cannot write a file that is open, so close the
+            # loaded file in case it is the one being written
+            if self.ci.pool is not None:
+                self.ci.pool.close()
+
+            # Write the signals a block of data records at a time
+            self.sei.convert_to_header()
+            saved_edf = StreamingEdfWriter(file + '.edf', signal_headers,
+                                           self.sei.pyedf_header, ann)
+            for chunk in iter_record_chunks(signals, signal_headers):
+                saved_edf.write(chunk)
 
             # Close file
             saved_edf.close()
@@ -1132,10 +1124,20 @@ class MainPage(QMainWindow):
             return
         else:
             self.edf_file_name_temp = name
-            loader = EdfLoader()
+            # Close a file that was loaded but whose channels were never
+            # plotted
+            ci_temp = getattr(self, 'ci_temp', None)
+            if (ci_temp is not None and ci_temp.pool is not None
+                    and ci_temp.pool is not self.ci.pool):
+                ci_temp.pool.close()
+            # One pool per loaded file, shared by the loader and ChannelInfo
+            # so that the file is read through a single open reader
+            pool = EdfHandlePool(max_open=1)
+            loader = EdfLoader(pool=pool)
             try:
                 self.edf_info_temp = loader.load_metadata(name)
             except:
+                pool.close()
                 self.throw_alert("The .edf file is invalid.")
                 return
             self.edf_info_temp.annotations = np.array(
@@ -1166,6 +1168,7 @@ class MainPage(QMainWindow):
             self.ci_temp.fs = self.edf_info_temp.fs
             self.ci_temp.max_time = self.max_time_temp
             self.ci_temp.edf_fn = name
+            self.ci_temp.pool = pool
             self.fn_full_temp = name
             if len(name.split('/')[-1]) < 40:
                 self.fn_temp = name.split('/')[-1]
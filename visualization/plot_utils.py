@@ -5,6 +5,10 @@ import scipy.signal
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QProgressDialog
 import preprocessing.dsp as dsp
+import preprocessing.fir as fir
+import preprocessing.parallel as parallel
+from preprocessing.filter_cache import (array_key, cached_rows,
+                                        default_cache, make_key)
 
 def check_annotations(t_start,window_size,edf_info):
     """ Checks to see if there are any anotations in the range t_start to t_end sec
@@ -53,17 +57,30 @@ def check_annotations(t_start,window_size,edf_info):
 
     return ret, idx_w_ann
 
+class FilterCanceled(Exception):
+    """ Raised when filtering is canceled, so nothing is cached """
+
+
 def filter_data(data, fs, fi):
     """ Calls dsp.prefilter to filter the data
         Progress bar is created if the process is estimated to take > 4s
 
+        When the filter cache is enabled (see filter_cache.env_cache),
+        filtered channels are kept in it, keyed by their samples and the
+        filter settings, so only channels that have not been filtered the
+        same way before are filtered.
+
+        fi.filter_canceled is cleared at the start of each call and set if
+        this call is canceled.
+
     Args:
         data - the data to filter
         fs - the fs
         fi - a filterInfo object
     Returns:
-        filtered data
+        filtered data, or the unfiltered data if filtering was canceled
     """
+    fi.filter_canceled = 0
     lp = fi.lp
     hp = fi.hp
     bp1 = fi.bp1
@@ -76,45 +93,69 @@ def filter_data(data, fs, fi):
         bp1 = 0
         bp2 = 0
 
+    settings = (fs, lp, hp, fi.notch, bp1, bp2, fi.filter_method,
+                fi.fir_transition)
+    keys = [make_key(array_key(row), settings) for row in data]
+
+    def compute(rows):
+        filt_bufs = _filter_rows(np.asarray(data)[rows], fs, fi,
+                                 lp, hp, bp1, bp2)
+        if fi.filter_canceled:
+            raise FilterCanceled()
+        return filt_bufs
+
+    try:
+        return cached_rows(default_cache, keys, compute)
+    except FilterCanceled:
+        return deepcopy(data)
+
+def _filter_rows(data, fs, fi, lp, hp, bp1, bp2):
+    """ Filter each row of data with the settings checked by filter_data
+    """
+    if fi.filter_method == 'fir':
+        # One linear phase filter covers every band and is applied to all
+        # channels at once, which is fast enough to not need a progress bar.
+        # As with the IIR filters applied one after another, the passband
+        # is where the lowpass, highpass and bandpass all pass.
+        if bp1 > 0:
+            hp = max(hp, bp1)
+            lp = min(lp, bp2) if lp > 0 else bp2
+        if 0 < lp <= hp:
+            return np.zeros_like(np.asarray(data, dtype=np.float64))
+        notch = fi.notch if 0 < fi.notch < fs / 2 else 0
+        h = fir.design_fir(fs, lp, hp, notch, fi.fir_transition)
+        if h is None:
+            return deepcopy(data)
+        return fir.fir_filter(np.asarray(data), h, dtype=np.float64)
+
     nchns = len(data)
     filt_bufs = deepcopy(data)
-    progress = QProgressDialog("Filtering...", "Cancel", 0, nchns * 4)
+    progress = QProgressDialog("Filtering...", "Cancel", 0, nchns)
     progress.setWindowModality(Qt.WindowModal)
 
-    i = 0
-    for chn in range(nchns):
-        # Notch
+    def filter_channel(x):
         if fi.notch > 0 and fi.notch < fs / 2:
-            filt_bufs[chn] = apply_notch(filt_bufs[chn], fs,fi.notch)
-        i += 1
-        progress.setValue(i)
-        if progress.wasCanceled():
-            fi.filter_canceled = 1
-            break
-        # LPF
+            x = apply_notch(x, fs, fi.notch)
         if lp > 0:
-            filt_bufs[chn] = dsp.applyLowPass(filt_bufs[chn], fs, lp)
-        i += 1
-        progress.setValue(i)
-        if progress.wasCanceled():
-            fi.filter_canceled = 1
-            break
-        # HPF
+            x = dsp.applyLowPass(x, fs, lp)
         if hp > 0:
-            filt_bufs[chn] = dsp.applyHighPass(filt_bufs[chn], fs, hp)
-        i += 1
-        progress.setValue(i)
-        if progress.wasCanceled():
-            fi.filter_canceled = 1
-            break
-        # BPF
+            x = dsp.applyHighPass(x, fs, hp)
         if bp1 > 0:
-            filt_bufs[chn] = apply_band_pass(filt_bufs[chn], fs, [bp1, bp2])
-        i += 1
-        progress.setValue(i)
-        if progress.wasCanceled():
-            fi.filter_canceled = 1
-            break
+            x = apply_band_pass(x, fs, [bp1, bp2])
+        return x
+
+    # The channels are filtered by the DSP threads, in order, and the
+    # progress bar is updated here as each one finishes
+    channels = parallel.imap_rows(filter_channel, filt_bufs)
+    try:
+        for chn, x in enumerate(channels):
+            filt_bufs[chn] = x
+            progress.setValue(chn + 1)
+            if progress.wasCanceled():
+                fi.filter_canceled = 1
+                break
+    finally:
+        channels.close()
 
     return filt_bufs
 
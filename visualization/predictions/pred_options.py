@@ -178,7 +178,8 @@ class PredictionOptions(QWidget):
     def load_pt_data(self):
         """ Load data for prediction.
         """
-        ptfile_fn = QFileDialog.getOpenFileName(self, 'Open file','.','Pytorch files (*.pt)')
+        ptfile_fn = QFileDialog.getOpenFileName(self, 'Open file','.',
+                        'Pytorch files (*.pt);;Buffer stores (*.bufs)')
         if ptfile_fn[0] is None or len(ptfile_fn[0]) == 0:
             return
         if len(ptfile_fn[0].split('/')[-1]) < 18:
@@ -2,6 +2,8 @@
 import torch
 import numpy as np
 
+from preprocessing.buffer_store import STORE_EXT, BufferStore
+
 class PredsInfo():
     """ Data structure for holding model and preprocessed data for prediction """
     def __init__(self):
@@ -14,6 +16,8 @@ class PredsInfo():
                                 # preds should be of shape [n_preds, nchns] if multi-chn
         self.model_fn = "" # name of the model file
         self.data_fn = "" # name of the data file
+        self.data_store = "" # name of the data file if it is a buffer store,
+                             # read when predicting
         self.preds_fn = "" # name of the loaded predictions file
         self.model_loaded = 0 # if the model has been loaded
         self.data_loaded = 0 # if the data has been loaded
@@ -47,6 +51,7 @@ class PredsInfo():
         self.preds_to_plot = pi2.preds_to_plot
         self.model_fn = pi2.model_fn
         self.data_fn = pi2.data_fn
+        self.data_store = pi2.data_store
         self.preds_fn = pi2.preds_fn
         self.model_loaded = pi2.model_loaded
         self.data_loaded = pi2.data_loaded
@@ -57,9 +62,16 @@ class PredsInfo():
         self.pred_by_chn = pi2.pred_by_chn
 
     def set_data(self, data_fn):
-        """ Set the data to the data from data_fn
+        """ Set the data to the data from data_fn, either a .pt file or a
+            chunked buffer store. Stores are only read when predicting, and
+            then only for the length of the .edf file.
         """
-        self.data = torch.load(data_fn)
+        if data_fn.endswith(STORE_EXT):
+            self.data = []
+            self.data_store = data_fn
+        else:
+            self.data = torch.load(data_fn)
+            self.data_store = ""
         self.data_loaded = 1
         self.update_ready()
 
@@ -117,6 +129,10 @@ class PredsInfo():
             0 for sucess, -2 for failure to pass through the predict function,
             -1 for incorrect size
         """
+        if self.data_store:
+            with BufferStore(self.data_store) as store:
+                self.data = torch.from_numpy(
+                    store.read_seconds(0, max_time))
         try:
             preds = self.model.predict(self.data)
             preds = np.array(preds)
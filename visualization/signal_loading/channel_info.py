@@ -1,6 +1,6 @@
 """ Module for holding channel information."""
 import numpy as np
-import pyedflib
+from preprocessing.edf_pool import open_edf
 
 def _check_label(label, label_list):
     """
@@ -126,6 +126,8 @@ class ChannelInfo():
         self.fs = 0
         self.max_time = 0
         self.edf_fn = ""
+        # EdfHandlePool shared with the loader, None to open edf_fn each time
+        self.pool = None
 
         self.total_nchns = 0
         self.list_of_chns = []
@@ -212,6 +214,10 @@ class ChannelInfo():
         self.fs = ci2.fs
         self.max_time = ci2.max_time
         self.edf_fn = ci2.edf_fn
+        # Close the file that is no longer plotted
+        if self.pool is not None and self.pool is not ci2.pool:
+            self.pool.close()
+        self.pool = ci2.pool
 
         self.labels_from_txt_file = ci2.labels_from_txt_file
         self.use_loaded_txt_file = ci2.use_loaded_txt_file
@@ -330,6 +336,18 @@ class ChannelInfo():
                             ret[i] = 0
         return ret
 
+    def open_edf(self):
+        """
+        Borrows an open reader for edf_fn, from the pool if there is one.
+
+        usage:
+            with ci.open_edf() as handle:
+                signal = handle.reader.readSignal(0)
+        """
+        if self.pool is None:
+            return open_edf(self.edf_fn)
+        return self.pool.open(self.edf_fn)
+
     def prepare_to_plot(self, idxs, parent, mont_type, plot_bip_from_ar = 0, txt_file_name = ""):
         """
         Prepares everything needed to plot the data.
@@ -346,8 +364,16 @@ class ChannelInfo():
             txt_file_name - name of text file if needed
         """
         self._set_colors()
-        f = pyedflib.EdfReader(self.edf_fn)
+        with self.open_edf() as handle:
+            self._prepare_to_plot(handle.reader, idxs, parent, mont_type,
+                                  plot_bip_from_ar, txt_file_name)
 
+    def _prepare_to_plot(self, f, idxs, parent, mont_type, plot_bip_from_ar,
+                         txt_file_name):
+        """
+        Does the work of prepare_to_plot, reading signals from the open
+        reader f.
+        """
         # Things needed to plot - reset each time
         # see if channels are already loaded and ordered
         ret = 1
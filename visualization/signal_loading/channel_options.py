@@ -9,7 +9,6 @@ from predictions.preds_info import PredsInfo
 from signal_loading.channel_info import ChannelInfo, convert_txt_chn_names
 from signal_loading.organize_channels import OrganizeChannels
 from signal_loading.color_options import ColorOptions
-import pyedflib
 
 class ChannelOptions(QWidget):
     """ Class for the channel loading window """
@@ -167,7 +166,6 @@ class ChannelOptions(QWidget):
         chns = self.data.chns2labels
         lbls = self.data.labels2chns
         self.data.pred_chn_data = []
-        edf_reader_obj = pyedflib.EdfReader(self.data.edf_fn)
         # if len(self.unprocessed_data) > 0: # reset predicted
         #    self.parent.predicted = 0
         if len(chns) == 0:
@@ -175,19 +173,21 @@ class ChannelOptions(QWidget):
             self.close_window()
         else:
             self.chn_items = []
-            for i in range(len(chns)):
-                if chns[i].find("PREDICTIONS") == -1:
-                    self.chn_items.append(QListWidgetItem(chns[i], self.chn_qlist))
-                    self.chn_qlist.addItem(self.chn_items[i])
-                # elif len(self.unprocessed_data) > 0:
-                # load in the prediction channels if they exist
-                # if they do, then the file was saved which
-                # means that there are a reasonable amount of channels
-                elif self.new_load:
-                    # self.data.pred_chn_data.append(self.unprocessed_data[i])
-                    self.data.pred_chn_data.append(edf_reader_obj.readSignal(i))
-                    lbls.pop(chns[i])
-                    chns.pop(i)
+            with self.data.open_edf() as handle:
+                for i in range(len(chns)):
+                    if chns[i].find("PREDICTIONS") == -1:
+                        self.chn_items.append(QListWidgetItem(chns[i], self.chn_qlist))
+                        self.chn_qlist.addItem(self.chn_items[i])
+                    # elif len(self.unprocessed_data) > 0:
+                    # load in the prediction channels if they exist
+                    # if they do, then the file was saved which
+                    # means that there are a reasonable amount of channels
+                    elif self.new_load:
+                        # self.data.pred_chn_data.append(self.unprocessed_data[i])
+                        self.data.pred_chn_data.append(
+                            handle.reader.readSignal(i))
+                        lbls.pop(chns[i])
+                        chns.pop(i)
 
             # if len(self.unprocessed_data) > 0 and len(self.data.pred_chn_data) != 0:
             if self.new_load and len(self.data.pred_chn_data) != 0: